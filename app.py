@@ -4,17 +4,24 @@ import math
 import io
 import logging
 from datetime import datetime
+import click
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, flash, session, send_file, current_app, abort
+    url_for, flash, session, send_file, current_app, abort, jsonify
 )
 from werkzeug.utils import secure_filename
 import pandas as pd
-import re
-import unicodedata
 import db
 import db_utils
 from db_utils import get_oc_detalle
+from services import (
+    datasets, import_jobs, importer, inventarios, listing, nv_query, scan_ledger, scan_store, uploads,
+)
+from services.indices import code_map, norm_code
+from services.db_pool import pool_stats
+from services.stock_cache import StockCache
+from models import db as orm
+import auth_service
 from auth_service import login_nivel1, login_nivel2_operario
 from auth_map import ROL_JEFE, ROL_OPERARIO
 
@@ -52,10 +59,45 @@ MASTER_FILE   = os.path.join(DATA_DIR, 'productos_maestra.csv')
 
 INV_SESIONES_FILE = os.path.join(DATA_DIR, 'inv_sesiones.csv')
 
+# --- Base local de la aplicación (estado de escaneo, asignaciones) ---
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+    'APP_DATABASE_URL', 'sqlite:///' + os.path.join(DATA_DIR, 'app.db')
+)
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+orm.init_app(app)
+
+
+def init_db() -> None:
+    """Crea las tablas que falten y migra ``inv_sesiones.csv`` (una sola vez)."""
+    orm.create_all()
+    inventarios.migrar_csv(INV_SESIONES_FILE)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Prepara la base de la aplicación; correr antes de iniciar los workers."""
+    init_db()
+    click.echo('Base de la aplicación lista.')
+
+
+@app.cli.command('purge-scans')
+@click.option('--max-age-hours', type=float, default=lambda: float(os.getenv('SCAN_MAX_AGE_HOURS', '72')),
+              help='Elimina los flujos de escaneo sin actividad en este tiempo.')
+def purge_scans_command(max_age_hours):
+    """Elimina los flujos de escaneo abandonados (p. ej. desde cron)."""
+    click.echo(f'{scan_store.purge(max_age_hours)} flujos de escaneo eliminados.')
+
 ALLOWED_EXT  = {'csv', 'xls', 'xlsx'}
 FIELDNAMES   = ['codigo_producto', 'cantidad', 'ultima_actualizacion']
 
 # --- Integración con la base de datos ---
+# Snapshot de stock compartido por el proceso (TTL en segundos)
+STOCK_CACHE = StockCache(
+    lambda: db_utils.get_stock_actual(),
+    ttl=float(os.getenv('STOCK_CACHE_TTL', '60')),
+    loader_codigos=lambda codigos: db.get_stock_por_codigos(codigos)
+)
+
 def fetch_oc_items(num_oc):
     """Obtiene detalle de una OC usando db_utils.get_oc_detalle.
 
@@ -75,10 +117,6 @@ def fetch_oc_items(num_oc):
     ])
     return df, guia
 
-def norm_code(x):
-    # quita espacios y * de Code39; pasa a mayúsculas
-    return str(x).strip().strip('*').upper()
-
 def group_by_code(df):
     """Agrupa filas por código de producto sumando sus cantidades.
 
@@ -148,28 +186,28 @@ def append_guide_entry(guia, codigo, cantidad, timestamp):
         w.writerow([guia, codigo, cantidad, timestamp])
 
 
-def inv_create_session():
-    """Crea un registro de sesión de inventario y retorna su ID."""
-    now = datetime.now().strftime('%Y%m%d%H%M%S')
-    record = {'id': now, 'estado': 'EN_PROCESO', 'creado': datetime.now().isoformat()}
-    exists = os.path.exists(INV_SESIONES_FILE)
-    with open(INV_SESIONES_FILE, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=['id', 'estado', 'creado'])
-        if not exists:
-            writer.writeheader()
-        writer.writerow(record)
-    return record['id']
+def _scan_sid():
+    """Identificador del estado de escaneo de este navegador (ver ``scan_store``)."""
+    sid = session.get('scan_sid')
+    if not sid:
+        sid = session['scan_sid'] = scan_store.new_sid()
+    return sid
+
 
+def _nv_code(x):
+    """Código de una línea NV para comparar escaneos (sin sufijo ``.0``)."""
+    return norm_code(x).removesuffix('.0')
 
-def inv_get_session(sid):
-    """Obtiene la información de una sesión de inventario por ID."""
-    if not os.path.exists(INV_SESIONES_FILE):
-        return None
-    with open(INV_SESIONES_FILE, newline='', encoding='utf-8') as f:
-        for row in csv.DictReader(f):
-            if row.get('id') == sid:
-                return row
-    return None
+
+app.add_template_filter(_nv_code, 'nv_code')
+app.add_template_filter(norm_code, 'norm_code')
+
+
+def _operador():
+    """Nombre con que se registran los conteos de este usuario."""
+    op = session.get('operario') or {}
+    cu = session.get('current_user') or {}
+    return str(op.get('nombre') or cu.get('nombre') or '').strip()
 
 # --- Rutas ---
 @app.route('/')
@@ -275,6 +313,37 @@ def admin_listados():
     return render_template('admin/listados.html')
 
 
+def pool_metricas() -> dict:
+    pools = {'db': pool_stats(db.ENGINE)}
+    if auth_service.ENGINE is db.ENGINE:
+        pools['auth'] = 'compartido con db'
+    else:
+        pools['auth'] = pool_stats(auth_service.ENGINE)
+    return pools
+
+
+@app.route('/admin/pools')
+def admin_pools():
+    """Uso de los pools de conexiones (espera de checkout, en uso, overflow)."""
+    if not session.get('is_admin'):
+        return abort(403)
+    return jsonify(pool_metricas())
+
+
+@app.route('/admin/metricas')
+def admin_metricas():
+    """Tiempos y consultas por cargador de la BBDD y uso de las cachés."""
+    if not session.get('is_admin'):
+        return abort(403)
+    return jsonify(
+        loaders=db.loader_stats(),
+        documentos=db.DOC_CACHE.stats(),
+        nv_headers=nv_query.header_stats(),
+        pools=pool_metricas(),
+        datasets=datasets.stats(),
+    )
+
+
 @app.route('/devoluciones')
 def devoluciones():
     return render_template('devoluciones.html')
@@ -296,10 +365,6 @@ def devolucion_ingreso():
         field_name='No. Factura',
         label='Factura',
         search_action='buscar_factura',
-        session_keys={'num': 'dev_current_factura',
-                      'guia': 'dev_current_guia',
-                      'items': 'dev_factura_items',
-                      'scanned': 'dev_scanned'},
         context_keys={'num': 'factura', 'items': 'factura_items'}
     )
 
@@ -317,20 +382,17 @@ def devoluciones_salida():
         return redirect(url_for('login1'))
     if cu.get('rol') == ROL_OPERARIO and not op:
         return redirect(url_for('login2'))
-    # Recuperar datos desde sesión
-    factura      = session.get('dev_current_factura', '')
-    guia_actual  = session.get('dev_current_guia', '')
-    factura_items = session.get('dev_factura_items', [])
-    salida_items = session.get('dev_salida_items', [])
+    # Recuperar datos desde el estado de escaneo
+    sid = _scan_sid()
+    factura, guia_actual, factura_items = scan_store.documento(sid, 'devoluciones_salida')
+    salida_items = scan_store.scans(sid, 'devoluciones_salida')
 
     if request.method == 'POST':
         action = request.form.get('action', 'buscar_factura')
 
         if action == 'buscar_factura':
             factura = (request.form.get('factura') or '').strip()
-            session['dev_current_factura'] = factura
-            session.pop('dev_factura_items', None)
-            session.pop('dev_salida_items', None)
+            scan_store.set_documento(sid, 'devoluciones_salida', factura, guia=guia_actual)
 
             if not factura:
                 flash('Debes ingresar un número de Factura de Compra.', 'warning')
@@ -340,9 +402,7 @@ def devoluciones_salida():
                 return redirect(url_for('devoluciones_salida'))
 
             try:
-                df_nv = pd.read_csv(FACTURA_FILE, header=0, dtype=str, keep_default_na=False)
-                df_nv.columns = [c.strip() for c in df_nv.columns]
-                df_nv = df_nv.loc[:, ~df_nv.columns.str.match(r'^Unnamed', case=False)]
+                df_nv = datasets.load(FACTURA_FILE)
 
                 if 'No. Factura' not in df_nv.columns:
                     flash("La columna 'No. Factura' no está en el archivo de Facturas.", 'error')
@@ -361,8 +421,7 @@ def devoluciones_salida():
                 df_show['Faltan'] = df_show['Cant.']
 
                 factura_items = df_show.to_dict(orient='records')
-                session['dev_factura_items'] = factura_items
-                session['dev_salida_items'] = []
+                scan_store.set_documento(sid, 'devoluciones_salida', factura, factura_items, guia_actual)
                 flash(f'Factura {factura} cargada con {len(factura_items)} líneas.', 'success')
             except Exception as e:
                 app.logger.error(f"Error al leer Factura en devoluciones: {e}")
@@ -375,76 +434,54 @@ def devoluciones_salida():
                 cantidad = int(request.form.get('cantidad', 1))
             except ValueError:
                 cantidad = 1
-            ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             guia = guia_actual
             if (g := request.form.get('guia', '').strip()):
                 guia = g
-                session['dev_current_guia'] = guia
-
-            found = False
-            for s in salida_items:
-                if s['guia'] == guia and s['codigo'] == codigo:
-                    s['cantidad'] += cantidad
-                    s['hora'] = ahora
-                    found = True
-                    break
-            if not found:
-                salida_items.append({
-                    'guia': guia,
-                    'codigo': codigo,
-                    'cantidad': cantidad,
-                    'hora': ahora
-                })
-            session['dev_salida_items'] = salida_items
+                scan_store.set_guia(sid, 'devoluciones_salida', guia)
+
+            _total, nuevo = scan_store.add_scan(sid, 'devoluciones_salida', codigo, cantidad, guia)
+            found = not nuevo
             flash(f'{cantidad} unidad(es) de {codigo} ' + ('sumadas' if found else 'registradas') + '.', 'success')
             return redirect(url_for('devoluciones_salida'))
 
         elif action == 'terminar_salida':
-            session['items_para_guia'] = salida_items
+            session['scan_para_guia']  = 'devoluciones_salida'
             session['nv_para_guia']    = factura
             session['guia_para_guia']  = guia_actual
             flash("Productos escaneados preparados para la Guía de Despacho.", "info")
             return redirect(url_for('finalizar_salida'))
 
-    # Cargar Stock desde la BBDD
-    stock_map = {}
-    try:
-        df_st = db_utils.get_stock_actual()
-        for _, row in df_st.iterrows():
-            key = str(row.get('codigo', '')).strip()
-            stock_map[key] = {
-                'Nombre': row.get('nombre', '').strip(),
-                'Cantidad': int(row.get('cantidad', 0))
-            }
-    except Exception as e:
-        app.logger.error(f"Error al consultar Stock: {e}")
-        flash(f"Error al consultar Stock: {e}", 'error')
-
     # Construir stock_items restando escaneos
     stock_items = []
-    scanned_totals = {}
+    resumen = None
 
     if factura_items:
-        for s in salida_items:
-            k = str(s['codigo']).strip()
-            scanned_totals[k] = scanned_totals.get(k, 0) + s['cantidad']
-
-        for item in factura_items:
-            code = str(item['Código']).strip()
-            total = int(item['Cant.'])
-            esc = scanned_totals.get(code, 0)
-            falta = max(total - esc, 0)
+        # Stock sólo de los códigos de la factura (caché + consulta por lote)
+        stock_map = {}
+        try:
+            stock_map = STOCK_CACHE.get_many(str(it['Código']).strip() for it in factura_items)
+        except Exception as e:
+            app.logger.error(f"Error al consultar Stock: {e}")
+            flash(f"Error al consultar Stock: {e}", 'error')
+
+        ledger = scan_store.ledger(sid, 'devoluciones_salida', 'Código', 'Cant.')
+        resumen = ledger.summary()
+        factura_items = []
+        for it, total, esc in ledger.rows():
+            item = dict(it)  # no mutar la caché
             item['scanned'] = esc
-            item['Faltan'] = falta
+            item['Faltan'] = max(total - esc, 0)
+            factura_items.append(item)
 
         for line in factura_items:
             code = str(line['Código']).strip()
-            orig = stock_map.get(code, {}).get('Cantidad', 0)
+            stk = stock_map.get(norm_code(code), {})
+            orig = stk.get('Cantidad', 0)
             remain = max(orig - line['scanned'], 0)
             stock_items.append({
                 'Código':  code,
-                'Nombre':  stock_map.get(code, {}).get('Nombre', line['Nombre']),
+                'Nombre':  stk.get('Nombre', line['Nombre']),
                 'Cantidad': remain
             })
 
@@ -454,7 +491,8 @@ def devoluciones_salida():
         guia=guia_actual,
         factura_items=factura_items,
         salida_items=salida_items,
-        stock_items=stock_items
+        stock_items=stock_items,
+        resumen=resumen,
     )
 
 
@@ -464,45 +502,29 @@ def listados():
 
 @app.route('/listados/oc')
 def listado_oc():
-    page = int(request.args.get('page', 1))
+    page = max(1, int(request.args.get('page', 1)))
     per_page = 100
     ordenes = []
     total_pages = 1
+    query_ms = None
 
-    # Filtros desde GET
-    ciudad_filtro = request.args.get('ciudad', '').strip().lower()
-    razon_filtro = request.args.get('razon_social', '').strip().lower()
+    # Filtros y orden desde GET
+    filtros = {
+        'Ciudad': request.args.get('ciudad', ''),
+        'Razón Social': request.args.get('razon_social', ''),
+    }
 
     if os.path.exists(OC_FILE):
         try:
-            df = pd.read_csv(OC_FILE, dtype=str)
-
-            # Eliminar columnas innecesarias
-            hide_cols = {
-                'descto.', 'dcto.tipo', 'dcto.pje',
-                'bodega', 'item', 'cantidad',
-                'cant. recibida', 'transito', 'línea de negocio',
-                'nombre', 'prec.unit.'
-            }
-            cols_lower = {c: c.lower() for c in df.columns}
-            keep = [orig for orig, low in cols_lower.items() if low not in hide_cols]
-            df = df[keep]
-
-            # Filtrado dinámico
-            if ciudad_filtro and 'Ciudad' in df.columns:
-                df = df[df['Ciudad'].str.lower().str.contains(ciudad_filtro, na=False)]
-
-            if razon_filtro and 'Razón Social' in df.columns:
-                df = df[df['Razón Social'].str.lower().str.contains(razon_filtro, na=False)]
+            index = listing.cached_index('oc', datasets.version(OC_FILE), _build_oc_listing)
+            orden = listing.parse_sort(request.args.get('orden'), index.columns)
+            res = index.query(filtros, orden, (page - 1) * per_page, per_page)
+            logger.info(f"Listado OC: {res.total} filas, consulta {res.elapsed_ms:.1f} ms")
 
             # Paginación
-            total = len(df)
-            total_pages = max(1, math.ceil(total / per_page))
-            start = (page - 1) * per_page
-            df_pagina = df.iloc[start:start + per_page]
-
-            # Convertir a dict
-            ordenes = df_pagina.to_dict(orient='records')
+            total_pages = max(1, math.ceil(res.total / per_page))
+            ordenes = res.rows
+            query_ms = round(res.elapsed_ms, 1)
 
         except Exception as e:
             logger.error(f"Error al leer Órdenes de Compra: {e}")
@@ -514,16 +536,40 @@ def listado_oc():
         'listado_oc.html',
         ordenes=ordenes,
         page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        query_ms=query_ms
+    )
+
+
+def _build_oc_listing():
+    """Arma el índice de listado de OC leyendo sólo las columnas visibles."""
+    hide_cols = {
+        'descto.', 'dcto.tipo', 'dcto.pje',
+        'bodega', 'item', 'cantidad',
+        'cant. recibida', 'transito', 'línea de negocio',
+        'nombre', 'prec.unit.'
+    }
+    keep = [c for c in datasets.column_names(OC_FILE) if c.lower() not in hide_cols]
+    return listing.ListingIndex(
+        datasets.load(OC_FILE, columns=keep),
+        search_cols=['No. OC', 'RUT'],
+        categorical=['Ciudad', 'Razón Social']
     )
 
 @app.route('/listados/nv')
 def listado_nv():
-    page        = int(request.args.get('page', 1))
+    page        = max(1, int(request.args.get('page', 1)))
     per_page    = 20
     ordenes     = []
     columns     = []        # ← inicializamos aquí
     total_pages = 1
+    query_ms    = None
+
+    # Filtros desde GET
+    filtros = {
+        'Ciudad': request.args.get('ciudad', ''),
+        'Razón Social': request.args.get('razon_social', ''),
+    }
 
     # 0) Verificar que el archivo exista
     if not os.path.exists(NV_FILE):
@@ -547,63 +593,24 @@ def listado_nv():
             total_pages=total_pages
         )
 
-    try:
-        # 2) Leer sin header para detectar la fila real de cabecera
-        df_raw = pd.read_csv(NV_FILE,
-                             header=None,
-                             dtype=str,
-                             keep_default_na=False)
-
-        expected = {
-            'ciudad', 'fecha', 'numnota', 'rut',
-            'razonsocial', 'canal', 'fechaentrega', 'formadepago'
-        }
-        def _norm(txt: str) -> str:
-            s = unicodedata.normalize("NFKD", str(txt))
-            s = s.encode("ascii", "ignore").decode().lower()
-            return re.sub(r'[^a-z0-9]', '', s)
-
-        header_idx = 0
-        for i, row in df_raw.iterrows():
-            norms = {_norm(cell) for cell in row if cell}
-            if expected.issubset(norms):
-                header_idx = i
-                break
-
-        # 3) Volver a leer con esa fila como cabecera
-        df = pd.read_csv(NV_FILE,
-                         header=header_idx,
-                         dtype=str,
-                         keep_default_na=False)
-
-        # 4) Limpiar columnas: strip, eliminar Unnamed y vacías
-        df.columns = [c.strip() for c in df.columns]
-        df = df.loc[:, ~df.columns.str.match(r'^Unnamed', case=False)]
-        df.dropna(axis=1, how='all', inplace=True)
-
-        # 5) Ocultar las que no quieres
-        ocultar = {
-            'Línea', 'Sub Línea 1', 'Sub Línea 2', 'Clasificación',
-            'Cod. Vend. Cartera', 'Nombre Vendedor Cartera',
-            'Cod. Vendedor', 'Nombre Vendedor N/V',
-            'Marca', 'Forma de Pago', 'Tot. Neto', 'Fecha', 'Canal', 'Fecha', 'Entrega', 'Num. Ord .Compra', 'Item'
-        }
-        df = df[[c for c in df.columns if c not in ocultar]]
+    # Columnas del índice de cabeceras que se muestran en el listado
+    visibles = [
+        'Ciudad', 'Num. Nota', 'RUT', 'Razón Social', 'Fecha Entrega',
+        'Terminado', 'Líneas', 'Total Neto'
+    ]
 
-        # 5.5) Eliminar columnas de detalle y agrupar por Num. Nota y RUT
-        df = df[[c for c in df.columns if c not in {"Código", "Descriptor"}]]
-        if {"Num. Nota", "RUT"}.issubset(df.columns):
-            df = df.groupby(["Num. Nota", "RUT"], as_index=False).first()
+    try:
+        # 2) Página del índice de cabeceras (una fila por nota, armado al importar)
+        start = (page - 1) * per_page
+        orden = listing.parse_sort(request.args.get('orden'), visibles)
+        res = nv_query.page_nv_headers(start, per_page, filtros, columns=visibles, sort=orden)
+        logger.info(f"Listado NV: {res.total} notas, consulta {res.elapsed_ms:.1f} ms")
 
         # aquí salvamos la lista de columnas para el template
-        columns = df.columns.tolist()
-
-        # 6) Paginación
-        total       = len(df)
-        total_pages = max(1, math.ceil(total / per_page))
-        start       = (page - 1) * per_page
-        df_page     = df.iloc[start:start + per_page]
-        ordenes     = df_page.to_dict(orient='records')
+        ordenes = res.rows
+        columns = list(ordenes[0].keys()) if ordenes else []
+        total_pages = max(1, math.ceil(res.total / per_page))
+        query_ms = round(res.elapsed_ms, 1)
 
     except Exception as e:
         logger.error(f"Error al leer Notas de Venta: {e}")
@@ -614,42 +621,31 @@ def listado_nv():
         columns=columns,         # ← añadimos columns
         ordenes=ordenes,
         page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        query_ms=query_ms
     )
 
 
 
 
 
+
 @app.route('/notas/preview')
 def notas_preview():
     if not os.path.exists(NV_FILE):
         flash('No se ha importado ninguna Nota de Venta.', 'warning')
         return redirect(url_for('index'))
 
-    df_raw = pd.read_csv(NV_FILE, header=None, dtype=str, keep_default_na=False)
+    df_raw = datasets.read_csv(NV_FILE, header=None, nrows=5, dtype=str, keep_default_na=False)
     # Flash de diagnóstico: primeras 5 filas
     flash('Primeras 5 filas (sin header):', 'info')
-    for i, row in df_raw.head(5).iterrows():
-        flash(f'Fila {i}: ' + ' | '.join(row.astype(str).tolist()), 'info')
-
-    # Detección de cabecera basándonos en tus títulos esperados
-    expected = {'ciudad','fecha','numnota','rut','razonsocial','canal','fechaentrega','formadepago'}
-    def _norm(txt):
-        return re.sub(r'[^a-z0-9]', '', unicodedata.normalize("NFKD", str(txt)).encode("ascii","ignore").decode().lower())
-
-    header_idx = None
     for i, row in df_raw.iterrows():
-        norms = {_norm(c) for c in row if c}
-        if expected.issubset(norms):
-            header_idx = i
-            break
-    flash(f'Cabecera detectada en fila: {header_idx}', 'info')
+        flash(f'Fila {i}: ' + ' | '.join(row.astype(str).tolist()), 'info')
 
-    # Ahora léelo con esa cabecera y muéstrame las columnas
-    if header_idx is not None:
-        df = pd.read_csv(NV_FILE, header=header_idx, dtype=str, keep_default_na=False)
-        flash('Columnas detectadas: ' + ', '.join([c.strip() for c in df.columns]), 'info')
+    # Cabecera y columnas según el manifiesto de importación
+    manifest = datasets.ensure_manifest(NV_FILE, 'nv')
+    flash(f'Cabecera detectada en fila: {manifest["header_row"]} ({manifest["rows"]} filas)', 'info')
+    flash('Columnas detectadas: ' + ', '.join(datasets.column_names(NV_FILE, tipo='nv')), 'info')
 
     return render_template('notas_preview.html')
 
@@ -661,6 +657,21 @@ def nota_credito():
 
 
 
+def _detect_keys(sample):
+    """Claves de código, nombre, cantidad y precio en las líneas de un documento."""
+    def pick(options, default):
+        for opt in options:
+            if opt in sample:
+                return opt
+        return default
+    return (
+        pick(['codigo', 'Código'], 'codigo'),
+        pick(['nombre', 'Nombre'], 'nombre'),
+        pick(['cantidad', 'Cantidad', 'Cant.'], 'cantidad'),
+        pick(['prec_unit', 'Prec.Unit.', 'Precio Unitario'], 'prec_unit'),
+    )
+
+
 def ingreso_core(
     template,
     endpoint,
@@ -670,58 +681,39 @@ def ingreso_core(
     field_name='No. OC',
     label='OC',
     search_action='buscar_oc',
-    session_keys=None,
+    flujo=None,
     context_keys=None,
     db_fetcher=None
 ):
-    session_keys = session_keys or {
-        'num': 'current_oc',
-        'guia': 'current_guia',
-        'items': 'oc_items',
-        'scanned': 'scanned'
-    }
+    flujo = flujo or endpoint
     context_keys = context_keys or {'num': 'oc', 'items': 'oc_items'}
 
-    numero = session.get(session_keys['num'])
-    guia_actual = session.get(session_keys['guia'], '')
-    items = session.get(session_keys['items'], [])
-    scanned_items = session.get(session_keys['scanned'], [])
-
-    def detect_keys(sample):
-        def pick(options, default):
-            for opt in options:
-                if opt in sample:
-                    return opt
-            return default
-        return (
-            pick(['codigo', 'Código'], 'codigo'),
-            pick(['nombre', 'Nombre'], 'nombre'),
-            pick(['cantidad', 'Cantidad', 'Cant.'], 'cantidad'),
-            pick(['prec_unit', 'Prec.Unit.', 'Precio Unitario'], 'prec_unit'),
-        )
+    # Estado en el servidor; la cookie sólo lleva el sid
+    sid = _scan_sid()
+    numero, guia_actual, items = scan_store.documento(sid, flujo)
+    scanned_items = [
+        {'guia': s['guia'], 'codigo_producto': s['codigo'],
+         'cantidad': s['cantidad'], 'fecha_hora': s['hora']}
+        for s in scan_store.scans(sid, flujo)
+    ]
 
     code_key = name_key = qty_key = price_key = None
     if items:
-        code_key, name_key, qty_key, price_key = detect_keys(items[0])
+        code_key, name_key, qty_key, price_key = _detect_keys(items[0])
 
     # ───────────── GET con ?<query_param>=XXXX ─────────────
     if request.method == 'GET' and request.args.get(query_param):
         numero = request.args.get(query_param).strip()
-        session[session_keys['num']] = numero
-        session.pop(session_keys['guia'], None)
-        session.pop(session_keys['scanned'], None)
-        session.pop(session_keys['items'], None)
+        items, guia_actual = [], ''
 
         if db_fetcher:
             try:
                 df, guia_db = db_fetcher(numero)
                 df = group_by_code(df)
                 items = df.to_dict('records')
-                session[session_keys['items']] = items
                 if items:
-                    code_key, name_key, qty_key, price_key = detect_keys(items[0])
+                    code_key, name_key, qty_key, price_key = _detect_keys(items[0])
                 if guia_db:
-                    session[session_keys['guia']] = guia_db
                     guia_actual = guia_db
                 if not items:
                     flash(f'La {label} {numero} no fue encontrada.', 'error')
@@ -735,11 +727,10 @@ def ingreso_core(
                 flash(f'Primero importa {label}s.', 'warning')
             else:
                 try:
-                    df = pd.read_csv(data_file, dtype=str)
+                    df = datasets.load(data_file)
                     df = df[df[field_name] == numero]
                     df = group_by_code(df)
                     items = df.to_dict('records')
-                    session[session_keys['items']] = items
                     if not items:
                         flash(f'La {label} {numero} no fue encontrada.', 'error')
                     else:
@@ -747,6 +738,7 @@ def ingreso_core(
                 except Exception as e:
                     logger.error(f'Error procesando {label} desde parámetro: {e}')
                     flash(f'Error al procesar {label} desde la URL: {e}', 'error')
+        scan_store.set_documento(sid, flujo, numero, items, guia_actual)
 
     # ───────────── POST desde formulario ─────────────
     if request.method == 'POST':
@@ -754,10 +746,7 @@ def ingreso_core(
 
         if action == search_action:
             numero = request.form[query_param].strip()
-            session[session_keys['num']] = numero
-            session.pop(session_keys['guia'], None)
-            session.pop(session_keys['scanned'], None)
-            session.pop(session_keys['items'], None)
+            items, guia_actual = [], ''
 
             if not numero:
                 flash(f'El No. {label} es obligatorio.', 'warning')
@@ -766,11 +755,9 @@ def ingreso_core(
                     df, guia_db = db_fetcher(numero)
                     df = group_by_code(df)
                     items = df.to_dict('records')
-                    session[session_keys['items']] = items
                     if items:
-                        code_key, name_key, qty_key, price_key = detect_keys(items[0])
+                        code_key, name_key, qty_key, price_key = _detect_keys(items[0])
                     if guia_db:
-                        session[session_keys['guia']] = guia_db
                         guia_actual = guia_db
                     if not items:
                         flash(f'La {label} {numero} no fue encontrada.', 'error')
@@ -783,11 +770,10 @@ def ingreso_core(
                 flash(f'Primero importa {label}s.', 'warning')
             else:
                 try:
-                    df = pd.read_csv(data_file, dtype=str)
+                    df = datasets.load(data_file)
                     df = df[df[field_name] == numero]
                     df = group_by_code(df)
                     items = df.to_dict('records')
-                    session[session_keys['items']] = items
                     if not items:
                         flash(f'La {label} {numero} no fue encontrada.', 'error')
                     else:
@@ -795,6 +781,7 @@ def ingreso_core(
                 except Exception as e:
                     logger.error(f'Error procesando {label}: {e}')
                     flash(f'Error al procesar {label}s: {e}', 'error')
+            scan_store.set_documento(sid, flujo, numero, items, guia_actual)
             return redirect(url_for(endpoint))
 
         elif action == 'scan':
@@ -804,10 +791,9 @@ def ingreso_core(
                 cantidad = int(request.form.get('cantidad', 1))
             except Exception:
                 cantidad = 1
-            ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
             if guia and guia != guia_actual:
-                session[session_keys['guia']] = guia
+                scan_store.set_guia(sid, flujo, guia)
                 guia_actual = guia
 
             if not numero:
@@ -873,28 +859,16 @@ def ingreso_core(
             session['informe_path'] = ruta_informe
             session['diferencias_path'] = ruta_dif
 
-            for k in (session_keys['scanned'], session_keys['num'], session_keys['guia'], session_keys['items']):
-                session.pop(k, None)
+            scan_store.clear(sid, flujo)
+            STOCK_CACHE.invalidate()
+            db.invalidate_documento(numero)
 
             flash('Recepción finalizada correctamente.', 'success')
             return redirect(url_for('finalizar'))
 
-        if any(norm_code(item.get(code_key, '')) == codigo for item in items):
-            found = False
-            for s in scanned_items:
-                if s['guia'] == guia and s['codigo_producto'] == codigo:
-                    s['cantidad'] += cantidad
-                    s['fecha_hora'] = ahora
-                    found = True
-                    break
-            if not found:
-                scanned_items.append({
-                    'guia': guia,
-                    'codigo_producto': codigo,
-                    'cantidad': cantidad,
-                    'fecha_hora': ahora
-                })
-            session[session_keys['scanned']] = scanned_items
+        if codigo in scan_store.ledger(sid, flujo, code_key, qty_key):
+            _total, nuevo = scan_store.add_scan(sid, flujo, codigo, cantidad, guia)
+            found = not nuevo
             flash(
                 f'{cantidad} unidad(es) de {codigo} ' + ('sumadas' if found else 'registradas') + '.',
                 'success'
@@ -921,27 +895,10 @@ def ingreso_core(
             }
         )
 
-    scanned_map = {}
-    for s in scanned_items:
-        c = norm_code(s.get('codigo_producto'))
-        if c:
-            scanned_map[c] = scanned_map.get(c, 0) + int(s.get('cantidad', 0))
-
-    def _to_qty(val):
-        # Convierte "1.000000" o "1,000000" a 1; valores raros -> 0
-        s = str(val).strip().replace(',', '.')
-        try:
-            return int(round(float(s)))
-        except Exception:
-            import re
-            m = re.search(r'\d+', s)
-            return int(m.group(0)) if m else 0
-
+    # Cantidades por línea y totales escaneados desde el índice del documento
     display_items = []
-    for item in items:
-        qty_ord = _to_qty(item.get(qty_key, 0))
-        item_code = norm_code(item.get(code_key, ''))
-        scanned_qty = scanned_map.get(item_code, 0)
+    ledger = scan_store.ledger(sid, flujo, code_key, qty_key)
+    for item, qty_ord, scanned_qty in ledger.rows():
         faltan = max(qty_ord - scanned_qty, 0)
 
         item2 = item.copy()
@@ -960,6 +917,8 @@ def ingreso_core(
             'name_key': name_key,
             'qty_key': qty_key,
             'price_key': price_key,
+            'resumen': ledger.summary(),
+            'flujo': flujo,
         }
     )
 
@@ -1029,11 +988,23 @@ def salida():
     if cu.get('rol') == ROL_OPERARIO and not op:
         return redirect(url_for('login2'))
 
-    # Estado
-    nota         = session.get('current_nv', '')
-    guia_actual  = session.get('current_guia', '')
-    nv_items     = session.get('nv_items', [])        # detalle NV (desde BBDD)
-    salida_items = session.get('salida_items', [])    # items para salida/escaneo
+    # Estado (en el servidor, ver scan_store)
+    sid = _scan_sid()
+    nota, guia_actual, nv_items = scan_store.documento(sid, 'salida')  # detalle NV (desde BBDD)
+    ledger = scan_store.ledger(sid, 'salida', 'Código', 'Cant.', normalize=_nv_code)
+
+    # items para salida/escaneo: cantidades escaneadas + datos de la línea NV
+    salida_items = []
+    for s in scan_store.scans(sid, 'salida'):
+        row = ledger.line(s['codigo']) or {}
+        salida_items.append({
+            'N° Nota':     row.get('N° Nota', nota),
+            'Código':      s['codigo'],
+            'Nombre':      row.get('Nombre', ''),
+            'Prec.Unit':   row.get('Prec.Unit', ''),
+            'Cant.NV':     int(row.get('Cant.', 0) or 0),   # pendiente permitido por NV
+            'Cant.Salida': s['cantidad']
+        })
 
     if request.method == 'POST':
         action = request.form.get('action', 'buscar_nv')
@@ -1042,12 +1013,10 @@ def salida():
         # 1) Buscar NV en BBDD
         if action == 'buscar_nv':
             nota = (request.form.get('nv') or '').strip()
-            session['current_nv'] = nota
-            session.pop('nv_items', None)
-            session.pop('salida_items', None)
-            nv_items, salida_items = [], []
+            nv_items = []
 
             if not nota:
+                scan_store.set_documento(sid, 'salida', nota)
                 flash('Debes ingresar un número de Nota de Venta.', 'warning')
                 return redirect(url_for('salida'))
 
@@ -1064,12 +1033,10 @@ def salida():
                         "cantidad": "Cant.",      # cantidad pendiente (CANTIDAD - CANTDESP)
                         "prec_unit":"Prec.Unit"
                     }).to_dict(orient='records')
-
-                    session['nv_items'] = nv_items
-                    session['salida_items'] = salida_items
             except Exception as e:
                 flash(f'Error al consultar la BBDD: {e}', 'danger')
 
+            scan_store.set_documento(sid, 'salida', nota, nv_items)
             return redirect(url_for('salida'))
 
         # 2) Escanear (agregar item a salida)
@@ -1085,42 +1052,19 @@ def salida():
                 flash('Primero busca una Nota de Venta.', 'warning')
                 return redirect(url_for('salida'))
 
-            base = pd.DataFrame(nv_items)
-            codigos = (
-                base["Código"].astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
-            )
-            match = base[codigos == codigo]
-            if match.empty:
+            row = ledger.line(codigo)
+            if row is None:
                 flash(f'El código {codigo} no está en la Nota de Venta {nota}.', 'warning')
                 return redirect(url_for('salida'))
 
-            row = match.iloc[0].to_dict()
-
             # Agrega o acumula
-            updated = False
-            for it in salida_items:
-                if str(it['Código']) == str(row['Código']):
-                    it['Cant.Salida'] = int(it.get('Cant.Salida', 0)) + cant
-                    updated = True
-                    break
-            if not updated:
-                salida_items.append({
-                    'N° Nota':     row['N° Nota'],
-                    'Código':      row['Código'],
-                    'Nombre':      row['Nombre'],
-                    'Prec.Unit':   row['Prec.Unit'],
-                    'Cant.NV':     int(row.get('Cant.', 0)),   # pendiente permitido por NV
-                    'Cant.Salida': cant
-                })
-
-            session['salida_items'] = salida_items
+            scan_store.add_scan(sid, 'salida', str(row['Código']), cant)
             return redirect(url_for('salida'))
 
         # 3) Eliminar item
         elif action == 'eliminar_item':
             codigo = request.form.get('codigo') or ''
-            salida_items = [it for it in salida_items if str(it.get('Código','')) != str(codigo)]
-            session['salida_items'] = salida_items
+            scan_store.remove_scan(sid, 'salida', str(codigo))
             return redirect(url_for('salida'))
 
         # 4) Finalizar salida (validaciones básicas)
@@ -1143,31 +1087,16 @@ def salida():
                 return redirect(url_for('salida'))
 
             # Si todo OK: (aquí podrías insertar movimiento, generar GD, etc.)
-            session.pop('salida_items', None)
+            scan_store.clear(sid, 'salida', documento=False)
+            STOCK_CACHE.invalidate()
+            db.invalidate_documento(nota)
             flash('Salida finalizada correctamente.', 'success')
             return redirect(url_for('salida'))
 
     # GET
     # Calcular cantidades escaneadas y faltantes para cada ítem de la NV
-    scanned_map = {}
-    for si in salida_items:
-        try:
-            code = str(si.get('Código'))
-            qty = int(si.get('Cant.Salida', 0))
-        except Exception:
-            # Valores inesperados se tratan como 0
-            code, qty = str(si.get('Código')), 0
-        scanned_map[code] = scanned_map.get(code, 0) + qty
-
     display_nv_items = []
-    for it in nv_items:
-        orig = 0
-        try:
-            orig = int(it.get('Cant.', 0))
-        except Exception:
-            orig = 0
-        code = str(it.get('Código'))
-        scanned_qty = scanned_map.get(code, 0)
+    for it, orig, scanned_qty in ledger.rows():
         item2 = it.copy()
         item2['scanned'] = scanned_qty
         item2['Faltan'] = max(orig - scanned_qty, 0)
@@ -1178,29 +1107,19 @@ def salida():
     if display_nv_items:
         stock_map = {}
         try:
-            df_st = db_utils.get_stock_actual()
-            for _, row in df_st.iterrows():
-                key = str(row.get('codigo', '')).strip()
-                stock_map[key] = {
-                    'Nombre': row.get('nombre', '').strip(),
-                    'Cantidad': int(row.get('cantidad', 0))
-                }
+            stock_map = STOCK_CACHE.get_many(str(line.get('Código')).strip() for line in display_nv_items)
         except Exception as e:
             app.logger.error(f"Error al consultar Stock: {e}")
             flash(f"Error al consultar Stock: {e}", 'error')
 
-        scanned_totals = {}
-        for s in salida_items:
-            k = str(s.get('Código')).strip()
-            scanned_totals[k] = scanned_totals.get(k, 0) + int(s.get('Cant.Salida', 0))
-
         for line in display_nv_items:
             code = str(line.get('Código')).strip()
-            orig = stock_map.get(code, {}).get('Cantidad', 0)
-            remain = max(orig - scanned_totals.get(code, 0), 0)
+            stk = stock_map.get(norm_code(code), {})
+            orig = stk.get('Cantidad', 0)
+            remain = max(orig - line['scanned'], 0)
             stock_items.append({
                 'Código': code,
-                'Nombre': stock_map.get(code, {}).get('Nombre', line.get('Nombre')),
+                'Nombre': stk.get('Nombre', line.get('Nombre')),
                 'Cantidad': remain
             })
 
@@ -1210,7 +1129,8 @@ def salida():
         guia_actual=guia_actual,
         nv_items=display_nv_items,
         salida_items=salida_items,
-        stock_items=stock_items
+        stock_items=stock_items,
+        resumen=ledger.summary() if display_nv_items else None,
     )
 
 
@@ -1223,44 +1143,46 @@ def inventario(sesion_id=None):
         session['inv_sesion_id'] = sesion_id
 
     inv_id = session.get('inv_sesion_id')
-    inv_data = inv_get_session(inv_id) if inv_id else None
-    inv_estado = inv_data.get('estado') if inv_data else None
+    inv_data = inventarios.get_sesion(inv_id)
+    inv_estado = inv_data.estado if inv_data else None
 
-    expected_items = session.get('expected_items', [])
-    scanned_items  = session.get('scanned_inv', [])
+    # Conciliación por código: conteos de todos los operarios de la sesión
+    ledger = inventarios.ledger(inv_id)
+
+    def _resultado(exp, esperado, cnt):
+        return {
+            'Código':   exp['Código'],
+            'Nombre':   exp['Nombre'],
+            'Esperado': esperado,
+            'Contado':  cnt if cnt is not None else '',
+            'Diferencia': '' if cnt is None else (cnt - esperado)
+        }
 
     if request.method == 'POST':
         action = request.form.get('action')
 
         if action == 'crear_sesion':
-            new_id = inv_create_session()
+            new_id = inventarios.crear_sesion(_operador()).id
             session['inv_sesion_id'] = new_id
-            session.pop('expected_items', None)
-            session.pop('scanned_inv', None)
             return redirect(url_for('inventario', sesion_id=new_id))
 
+        if inv_estado != 'EN_PROCESO' and action != 'export_inv':
+            flash('La sesión de inventario no está en proceso.', 'warning')
+            return redirect(url_for('inventario'))
+
         if action == 'cargar_inv':
             if not os.path.exists(STOCK_FILE):
                 flash('No se encontró el archivo de stock.', 'error')
             else:
                 try:
-                    df = pd.read_csv(
-                        STOCK_FILE,
-                        header=0,
-                        dtype=str,
-                        keep_default_na=False
-                    )
-                    df.columns = [c.strip() for c in df.columns]
-                    df = df.loc[:, ~df.columns.str.match(r'^Unnamed', case=False)]
-                    if 'Cantidad' in df.columns:
-                        df['Cantidad'] = pd.to_numeric(
-                            df['Cantidad'], errors='coerce'
-                        ).fillna(0).astype(int)
+                    # Sin relleno y con Cantidad ya entera (ver datasets.compact);
+                    # las cantidades ilegibles (<NA>) se cargan como 0
+                    df = datasets.load_compact(STOCK_FILE, 'stock', columns=['Código', 'Nombre', 'Cantidad'])
+                    df['Cantidad'] = df['Cantidad'].fillna(0).astype(int)
                     expected_items = df[['Código', 'Nombre', 'Cantidad']].to_dict(
                         orient='records'
                     )
-                    session['expected_items'] = expected_items
-                    session['scanned_inv'] = []
+                    inventarios.cargar_esperado(inv_id, expected_items)
                     flash(
                         f'Se cargaron {len(expected_items)} ítems de inventario.',
                         'success'
@@ -1276,24 +1198,10 @@ def inventario(sesion_id=None):
             except ValueError:
                 contado = 1
 
-            ahora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            if any(item['Código'] == codigo for item in expected_items):
-                found = False
-                for s in scanned_items:
-                    if s['Código'] == codigo:
-                        s['Contado'] += contado
-                        s['Hora'] = ahora
-                        total = s['Contado']
-                        found = True
-                        break
-                if not found:
-                    total = contado
-                    scanned_items.append({
-                        'Código': codigo,
-                        'Contado': total,
-                        'Hora': ahora
-                    })
-                session['scanned_inv'] = scanned_items
+            line = ledger.line(codigo)
+            if line is not None:
+                inventarios.registrar(inv_id, str(line['Código']), contado, _operador())
+                total = inventarios.ledger(inv_id).scanned(line['Código'])
                 flash(
                     f'Conteo para {codigo} incrementado en {contado}. Total: {total}',
                     'success'
@@ -1304,17 +1212,15 @@ def inventario(sesion_id=None):
                     'warning'
                 )
 
+        elif action == 'cerrar_sesion':
+            inventarios.cerrar_sesion(inv_id)
+            flash(f'Sesión de inventario {inv_id} cerrada.', 'success')
+
         elif action == 'export_inv':
-            results = []
-            for exp in expected_items:
-                cnt = next((s['Contado'] for s in scanned_items if s['Código'] == exp['Código']), 0)
-                results.append({
-                    'Código': exp['Código'],
-                    'Nombre': exp['Nombre'],
-                    'Esperado': exp['Cantidad'],
-                    'Contado': cnt,
-                    'Diferencia': cnt - exp['Cantidad']
-                })
+            vista = request.form.get('vista', 'todos')
+            rows, _total = ledger.view(vista, 0, None)
+            # En el archivo lo no contado es 0 (Diferencia = -Esperado)
+            results = [_resultado(exp, esperado, cnt or 0) for exp, esperado, cnt in rows]
             if results:
                 output = io.StringIO()
                 writer = csv.DictWriter(output, fieldnames=['Código', 'Nombre', 'Esperado', 'Contado', 'Diferencia'])
@@ -1331,25 +1237,170 @@ def inventario(sesion_id=None):
 
         return redirect(url_for('inventario', sesion_id=inv_id) if inv_id else url_for('inventario'))
 
-    results = []
-    for exp in expected_items:
-        cnt = next((s['Contado'] for s in scanned_items if s['Código']==exp['Código']), None)
-        results.append({
-            'Código':   exp['Código'],
-            'Nombre':   exp['Nombre'],
-            'Esperado': exp['Cantidad'],
-            'Contado':  cnt if cnt is not None else '',
-            'Diferencia': '' if cnt is None else (cnt - exp['Cantidad'])
-        })
+    # GET: sólo la página pedida de la vista elegida
+    vista = request.args.get('vista', 'todos')
+    if vista not in scan_ledger.VISTAS:
+        vista = 'todos'
+    per_page = 50
+    page = max(request.args.get('page', 1, type=int), 1)
+    rows, total = ledger.view(vista, (page - 1) * per_page, per_page)
+    total_pages = max(math.ceil(total / per_page), 1)
+
+    scanned_items = [
+        {'Código': c.codigo, 'Contado': c.cantidad, 'Operario': c.operario,
+         'Hora': c.registrado.strftime('%Y-%m-%d %H:%M:%S')}
+        for c in (inventarios.ultimos(inv_id, 20) if inv_data else [])
+    ]
 
     return render_template('inventario.html',
-                           expected=expected_items,
+                           expected=len(ledger),
                            scanned=scanned_items,
-                           results=results,
+                           operarios=inventarios.por_operario(inv_id) if inv_data else [],
+                           abiertas=inventarios.sesiones_abiertas(),
+                           results=[_resultado(*r) for r in rows],
+                           resumen=ledger.summary(),
+                           vista=vista,
+                           vistas=scan_ledger.VISTAS,
+                           page=page,
+                           total_pages=total_pages,
+                           total=total,
                            inv_sesion_id=inv_id,
                            inv_estado=inv_estado)
 
 
+# ─── API de escaneo por lotes ───────────────────────────────────────────────
+
+SCAN_BATCH_MAX = int(os.getenv('SCAN_BATCH_MAX', '1000'))
+
+# flujo -> (clave de código, clave de cantidad, normalización); None = detectar
+API_FLUJOS = {
+    'ingreso':             (None, None, norm_code),
+    'devolucion_ingreso':  (None, None, norm_code),
+    'salida':              ('Código', 'Cant.', _nv_code),
+    'devoluciones_salida': ('Código', 'Cant.', norm_code),
+    'inventario':          (inventarios.CODE_KEY, inventarios.QTY_KEY, norm_code),
+}
+
+
+@app.route('/api/<flujo>/escaneos', methods=['POST'])
+def api_escaneos(flujo):
+    """Registra un lote de escaneos de una pistola RF.
+
+    Recibe ``{"escaneos": [{"codigo", "cantidad", "guia"}, ...]}`` (o la lista
+    directamente), valida cada código contra el documento cargado en la
+    sesión del navegador (o la sesión de inventario) y graba todo en una
+    transacción. Retorna el resultado por línea con el total escaneado y lo
+    que falta del código, más el resumen del documento.
+
+    ``lineas`` y ``escaneos`` traen sólo lo que cambió (por código y por
+    guía/código), con el stock restante donde la pantalla lo muestra, para
+    que las pantallas de escaneo actualicen sus filas sin recargar.
+    """
+    cu = session.get('current_user')
+    op = session.get('operario')
+    if not cu or (cu.get('rol') == ROL_OPERARIO and not op):
+        return jsonify(error='Sesión no iniciada.'), 401
+    if flujo not in API_FLUJOS:
+        abort(404)
+
+    payload = request.get_json(silent=True)
+    entradas = payload.get('escaneos') if isinstance(payload, dict) else payload
+    if not isinstance(entradas, list):
+        return jsonify(error='Se espera una lista de escaneos.'), 400
+    if len(entradas) > SCAN_BATCH_MAX:
+        return jsonify(error=f'Máximo {SCAN_BATCH_MAX} escaneos por lote.'), 413
+
+    code_key, qty_key, normalize = API_FLUJOS[flujo]
+    if flujo == 'inventario':
+        inv_id = (payload.get('sesion') if isinstance(payload, dict) else None) or session.get('inv_sesion_id')
+        inv = inventarios.get_sesion(inv_id)
+        if inv is None or inv.estado != 'EN_PROCESO':
+            return jsonify(error='No hay una sesión de inventario en proceso.'), 409
+        numero, guia_doc = inv.id, ''
+        ledger = inventarios.ledger(inv.id)
+    else:
+        sid = _scan_sid()
+        numero, guia_doc, items = scan_store.documento(sid, flujo)
+        if not numero or not items:
+            return jsonify(error='Primero carga un documento.'), 409
+        if code_key is None:
+            code_key, _name_key, qty_key, _price_key = _detect_keys(items[0])
+        ledger = scan_store.ledger(sid, flujo, code_key, qty_key, normalize=normalize)
+
+    # Validación en una pasada contra el índice del documento
+    resultados, validos = [], []
+    for i, e in enumerate(entradas):
+        e = e if isinstance(e, dict) else {}
+        codigo = str(e.get('codigo') or '').strip()
+        try:
+            cantidad = int(e.get('cantidad', 1))
+        except (TypeError, ValueError):
+            cantidad = 0
+        res = {'indice': i, 'codigo': codigo, 'cantidad': cantidad}
+        line = ledger.line(codigo) if codigo else None
+        if not codigo or cantidad <= 0:
+            res['estado'] = 'invalido'
+        elif line is None:
+            res['estado'] = 'no_encontrado'
+        else:
+            res['estado'] = 'ok'
+            if flujo in ('ingreso', 'devolucion_ingreso'):
+                guardado = norm_code(codigo)
+            else:
+                guardado = str(line[code_key]).strip()
+            guia = '' if flujo in ('salida', 'inventario') else (str(e.get('guia') or '').strip() or guia_doc)
+            validos.append((guia, guardado, cantidad))
+        resultados.append(res)
+
+    escaneos = []
+    if validos:
+        if flujo == 'inventario':
+            inventarios.registrar_lote(inv.id, [(c, q) for _g, c, q in validos], _operador())
+            ledger = inventarios.ledger(inv.id)
+        else:
+            totales = scan_store.add_scans(sid, flujo, validos)
+            ultima_guia = validos[-1][0]
+            if ultima_guia and ultima_guia != guia_doc:
+                scan_store.set_guia(sid, flujo, ultima_guia)
+            ledger = scan_store.ledger(sid, flujo, code_key, qty_key, normalize=normalize)
+            hora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            escaneos = [
+                {'guia': g, 'codigo': c, 'cantidad': total, 'hora': hora}
+                for (g, c), (total, _nuevo) in totales.items()
+            ]
+
+    lineas, codigos = {}, {}
+    for res in resultados:
+        if res['estado'] == 'ok':
+            res['total'] = ledger.scanned(res['codigo'])
+            res['esperado'] = ledger.expected_qty(res['codigo'])
+            res['faltan'] = ledger.faltan(res['codigo'])
+            clave = ledger.normalize(res['codigo'])
+            codigos[clave] = str(ledger.line(clave)[code_key]).strip()
+            lineas[clave] = {'clave': clave, 'escaneado': res['total'], 'faltan': res['faltan']}
+
+    # Stock restante de los códigos tocados (salida y devoluciones lo muestran)
+    if lineas and flujo in ('salida', 'devoluciones_salida'):
+        try:
+            stock_map = STOCK_CACHE.get_many(codigos.values())
+            for clave, linea in lineas.items():
+                orig = stock_map.get(norm_code(codigos[clave]), {}).get('Cantidad', 0)
+                linea['stock'] = max(orig - linea['escaneado'], 0)
+        except Exception as e:
+            app.logger.error(f"Error al consultar Stock: {e}")
+
+    return jsonify(
+        flujo=flujo,
+        documento=numero,
+        aceptados=len(validos),
+        rechazados=len(resultados) - len(validos),
+        resultados=resultados,
+        lineas=list(lineas.values()),
+        escaneos=escaneos,
+        resumen=ledger.summary(),
+    )
+
+
 # ─── Ruta /importar ─────────────────────────────────────────────────────────
 
 # Asume que ya tienes definidos:
@@ -1359,7 +1410,12 @@ def inventario(sesion_id=None):
 def importar():
     """
     Sube un archivo Excel/CSV a uploads/{tipo}/ y guarda un CSV limpio en DATA_DIR.
-    Detecta cabecera real, elimina Unnamed y guarda con UTF-8 BOM.
+    Un archivo idéntico (mismo sha256) al de la última importación no se
+    vuelve a procesar; los originales se guardan por contenido
+    (``services.uploads``).
+    Detecta cabecera real, elimina Unnamed y guarda con UTF-8 BOM; el archivo
+    se procesa por bloques en segundo plano (ver ``services.import_jobs``) y
+    la página consulta el avance en ``/importar/estado/<id>``.
     Tipos válidos: oc, nv, master, stock.
     """
     if request.method == "POST":
@@ -1374,83 +1430,14 @@ def importar():
             flash("Formato no soportado. Usa CSV o Excel.", "warning")
             return redirect(url_for("importar"))
 
-        # ── 2. Guardar copia original ────────────────────────────────────
+        # ── 2. Guardar original en el almacén por contenido ──────────────
         uploads_tipo = os.path.join(UPLOADS_DIR, tipo)
-        os.makedirs(uploads_tipo, exist_ok=True)
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         original_name = f"{tipo}_{ts}_{secure_filename(f.filename)}"
-        orig_path     = os.path.join(uploads_tipo, original_name)
-        f.save(orig_path)
-
-        # ── 3. Vista previa para detectar cabecera ───────────────────────
-        ext       = orig_path.rsplit(".", 1)[-1].lower()
-        read_excel = ext in {"xls", "xlsx"}
-
-        if read_excel:
-            preview = pd.read_excel(
-                orig_path,
-                header=None,
-                nrows=30,
-                dtype=str,
-                keep_default_na=False
-            )
-        else:
-            preview = pd.read_csv(
-                orig_path,
-                header=None,
-                nrows=30,
-                dtype=str,
-                keep_default_na=False,
-                encoding="latin-1",
-                sep=","
-            )
+        subida = uploads.store(f.stream, uploads_tipo, secure_filename(f.filename),
+                               en_uso=import_jobs.pending_sha256())
 
-        expected_map = {
-            "oc":     {"no.", "oc", "ciudad"},
-            "nv":     {"ciudad", "num", "nota", "rut"},
-            "master": set(),
-            "stock":  {"ciudad", "bodega", "codigo", "nombre", "cantidad"},
-        }
-        expected = expected_map.get(tipo, set())
-
-        header_row = None
-        if expected:
-            for idx, row in preview.iterrows():
-                cells = {str(c).lower() for c in row if str(c).strip()}
-                if len(cells & expected) >= 2:
-                    header_row = idx
-                    break
-        if header_row is None:
-            header_row = 0  # respaldo
-
-        # ── 4. Lectura definitiva con codificación y separador correctos ──
-        if read_excel:
-            df = pd.read_excel(
-                orig_path,
-                header=header_row,
-                dtype=str,
-                keep_default_na=False
-            )
-        else:
-            df = pd.read_csv(
-                orig_path,
-                header=header_row,
-                dtype=str,
-                keep_default_na=False,
-                encoding="latin-1",
-                sep=","
-            )
-
-        # ── 5. Normalización de columnas ─────────────────────────────────
-        df.columns = [
-            str(c).strip().replace("\ufeff", "")
-            for c in df.columns
-        ]
-        # Eliminar Unnamed y columnas vacías
-        df = df.loc[:, ~df.columns.str.match(r"^Unnamed", case=False)]
-        df = df.dropna(axis=1, how="all")
-
-        # ── 6. Guardar CSV limpio con BOM para futuras lecturas ──────────
+        # ── 3. Importación en segundo plano (ver services.import_jobs) ───
         destino_map = {
             "oc":     (OC_FILE,     "Órdenes de Compra"),
             "nv":     (NV_FILE,     "Notas de Venta"),
@@ -1458,16 +1445,34 @@ def importar():
             "stock":  (STOCK_FILE,  "Stock"),
         }
         dest_path, etiqueta = destino_map[tipo]
-        df.to_csv(
-            dest_path,
-            index=False,
-            encoding="utf-8-sig"
+        if importer.is_current(dest_path, subida.sha256):
+            flash(f"{etiqueta}: el archivo es idéntico a la última importación, no hay cambios.", "info")
+            return redirect(url_for("importar"))
+        job_id = import_jobs.submit(
+            subida.path, tipo, dest_path,
+            etiqueta=etiqueta, source=original_name, sha256=subida.sha256,
+            uploads_dir=uploads_tipo,  # las copias antiguas se compactan en el trabajo
         )
-        flash(f"{etiqueta} importadas correctamente ({len(df)} filas).", "success")
-        return redirect(url_for("importar"))
+        flash(f"Importando {etiqueta} en segundo plano…", "success")
+        return redirect(url_for("importar", job=job_id))
 
     # GET
-    return render_template("importar.html", tipos=["oc", "nv", "master", "stock"])
+    job = import_jobs.status(request.args.get("job", ""))
+    return render_template(
+        "importar.html",
+        tipos=["oc", "nv", "master", "stock"],
+        job=job,
+        recientes=import_jobs.recent(),
+    )
+
+
+@app.route("/importar/estado/<job_id>")
+def importar_estado(job_id):
+    """Estado de una importación: fase, filas leídas y segundos transcurridos."""
+    job = import_jobs.status(job_id)
+    if job is None:
+        return jsonify(error="Importación no encontrada"), 404
+    return jsonify(job)
 
 
 
@@ -1491,13 +1496,13 @@ def finalizar_salida():
     if cu.get('rol') == ROL_OPERARIO and not op:
         return redirect(url_for('login2'))
 
-    num_nota = session.get('current_nv', '')
+    sid = _scan_sid()
+    num_nota = scan_store.documento(sid, 'salida')[0]
 
-    # Limpiar el estado de la sesión para comenzar de cero si es necesario
-    session.pop('nv_items', None)
-    session.pop('salida_items', None)
-    session.pop('current_nv', None)
-    session.pop('current_guia', None)
+    # Limpiar el estado de escaneo para comenzar de cero si es necesario
+    scan_store.clear(sid, 'salida')
+    STOCK_CACHE.invalidate()
+    db.invalidate_documento(num_nota)
 
     # Renderiza la plantilla final pasando el número de nota
     return render_template('finalizar_salida.html', num_nota=num_nota)
@@ -1527,51 +1532,16 @@ def guia_despacho_view(template_name: str = 'guia_despacho.html',
     # 1. Cargar sesión o querystring
     nota     = session.get('nv_para_guia') or request.args.get('nv', '').strip()
     guia     = session.get('guia_para_guia') or request.args.get('guia', '').strip()
-    scaneado = session.get('items_para_guia', [])  # ← solo los escaneados
+    flujo_guia = session.get('scan_para_guia')
+    scaneado = scan_store.scans(_scan_sid(), flujo_guia) if flujo_guia else []  # ← solo los escaneados
 
     # 2. Cargar archivo NV para traer nombre, descripción, precio
     datos_nv = {}
     lineas: list[dict] = []
     if nota and os.path.exists(NV_FILE):
         try:
-            df = pd.read_csv(NV_FILE, header=0, dtype=str, keep_default_na=False)
-            df.columns = [c.strip() for c in df.columns]
-
-            # Normalizar nombres de columnas al formato usado en la guía
-            def _norm(txt: str) -> str:
-                s = unicodedata.normalize("NFKD", str(txt))
-                s = s.encode("ascii", "ignore").decode().lower()
-                return re.sub(r"[^a-z0-9]", "", s)
-
-            wanted = {
-                'ciudad': 'Ciudad',
-                'fecha': 'Fecha',
-                'numnota': 'Num. Nota',
-                'rut': 'RUT',
-                'razonsocial': 'Razón Social',
-                'canal': 'Canal',
-                'fechaentrega': 'Fecha Entrega',
-                'formadepago': 'Forma de Pago',
-                'numordcompra': 'Num. Ord .Compra',
-                'codigo': 'Código',
-                'codigoproducto': 'Código',
-                'descriptor': 'Descriptor',
-                'descripcion': 'Descriptor',
-                'cantidad': 'Cantidad',
-                'cant': 'Cantidad',
-                'preciounitario': 'Precio Unitario',
-                'precio': 'Precio Unitario',
-            }
-
-            renames = {}
-            norm_cols = {_norm(c): c for c in df.columns}
-            for key, canonical in wanted.items():
-                if key in norm_cols:
-                    renames[norm_cols[key]] = canonical
-            if renames:
-                df.rename(columns=renames, inplace=True)
-
-            df = df.loc[:, ~df.columns.str.match(r'^Unnamed', case=False)]
+            # Columnas ya con los nombres canónicos (ver datasets.CANONICAL['nv'])
+            df = datasets.load(NV_FILE, tipo='nv')
 
             if 'Num. Nota' in df.columns:
                 df = df[df['Num. Nota'].astype(str).str.strip() == str(nota)]
@@ -1587,11 +1557,14 @@ def guia_despacho_view(template_name: str = 'guia_despacho.html',
             # 2b. Armar líneas para la guía
             if scaneado:
                 # Usar sólo los productos escaneados
-                map_nv = {row.get('Código'): row for _, row in df.iterrows()}
+                map_nv = code_map(df, 'Código', {
+                    'Descriptor': 'Descriptor',
+                    'Precio Unitario': 'Precio Unitario',
+                })
                 for s in scaneado:
                     codigo = s['codigo']
                     cantidad = s['cantidad']
-                    info = map_nv.get(codigo, {})
+                    info = map_nv.get(norm_code(codigo), {})
                     linea = {
                         'codigo': codigo,
                         'descripcion': info.get('Descriptor', ''),
@@ -1602,14 +1575,10 @@ def guia_despacho_view(template_name: str = 'guia_despacho.html',
                     lineas.append(linea)
             else:
                 # Si no se escaneó nada, incluir todas las líneas de la NV
-                for _, row in df.iterrows():
-                    lineas.append({
-                        'codigo': row.get('Código', ''),
-                        'descripcion': row.get('Descriptor', ''),
-                        'cantidad': row.get('Cantidad', 0),
-                        'precio': row.get('Precio Unitario', ''),
-                        'descuento': '0%'
-                    })
+                df_lineas = df.reindex(columns=['Código', 'Descriptor', 'Cantidad', 'Precio Unitario']).fillna('')
+                df_lineas.columns = ['codigo', 'descripcion', 'cantidad', 'precio']
+                df_lineas['descuento'] = '0%'
+                lineas = df_lineas.to_dict(orient='records')
 
         except Exception as e:
             flash(f'Error leyendo NV para la guía: {e}', 'error')
@@ -1618,7 +1587,6 @@ def guia_despacho_view(template_name: str = 'guia_despacho.html',
     if request.method == 'POST':
         datos = request.form.to_dict()
         session['guia_datos'] = datos
-        session['guia_lineas'] = lineas
 
         if request.form.get('action') == 'guardar':
             df = pd.DataFrame(lineas)
@@ -1712,5 +1680,7 @@ def descargar_xls():
     )
 
 if __name__ == "__main__":
+    with app.app_context():
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
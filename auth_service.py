@@ -1,20 +1,60 @@
 # auth_service.py
 import os, re
-import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 try:
     from passlib.hash import bcrypt
 except ModuleNotFoundError:  # pragma: no cover - dependencias opcionales
     bcrypt = None
 from auth_map import *
+from services import consultas
+from services.db_pool import instrument, pool_options
 
-# Un solo engine para ambas tablas (misma BD)
-ENGINE = create_engine(os.environ.get("USERS_DB_URL", "sqlite://"), pool_pre_ping=True, future=True)
+USERS_DB_URL = os.environ.get("USERS_DB_URL", "sqlite://")
 
 
-def _q(sql: str, params=None) -> pd.DataFrame:
-    with ENGINE.connect() as c:
-        return pd.read_sql(text(sql), c, params=params or {})
+def _odbc_server(url) -> tuple[str, str] | None:
+    """``(servidor, base)`` de una URL de SQL Server, o None si no lo es."""
+    if not url.drivername.startswith("mssql"):
+        return None
+    odbc = url.query.get("odbc_connect")
+    if odbc:
+        parts = dict(p.split("=", 1) for p in str(odbc).split(";") if "=" in p)
+        parts = {k.strip().upper(): v.strip() for k, v in parts.items()}
+        return parts.get("SERVER", "").lower(), parts.get("DATABASE", "").lower()
+    return (url.host or "").lower(), (url.database or "").lower()
+
+
+def _shared_engine():
+    """Engine de ``db`` si USERS_DB_URL apunta al mismo servidor y base.
+
+    Se desactiva con ``USERS_DB_SHARE_POOL=no``.
+    """
+    if os.environ.get("USERS_DB_SHARE_POOL", "yes").strip().lower() in {"no", "false", "0"}:
+        return None
+    destino = _odbc_server(make_url(USERS_DB_URL))
+    if destino is None:
+        return None
+    import db  # sólo para SQL Server: crea el engine (y requiere pyodbc)
+    if destino == (db.SERVER.lower(), db.DATABASE.lower()):
+        return db.ENGINE
+    return None
+
+
+# Un solo engine para ambas tablas (misma BD); comparte el pool de ``db``
+# cuando es el mismo servidor. Pool propio: USERS_DB_POOL_SIZE, etc.
+ENGINE = _shared_engine()
+if ENGINE is None:
+    if USERS_DB_URL.startswith("sqlite"):
+        ENGINE = create_engine(USERS_DB_URL, future=True)
+    else:
+        ENGINE = create_engine(USERS_DB_URL, future=True, **pool_options("USERS_DB"))
+        instrument(ENGINE, "auth")
+
+
+def _one(sql: str, params=None) -> dict | None:
+    """Una fila de la BD de usuarios como diccionario (sin DataFrame)."""
+    return consultas.query_one(sql, params, ENGINE)
 
 
 def _norm(s: str) -> str:
@@ -48,11 +88,10 @@ def login_nivel1(nombre: str, password: str):
     FROM {USER_TABLE}
     WHERE RTRIM({USER_COL_NOM}) = :n
     """
-    df = _q(sql, {"n": nombre})
-    if df.empty:
+    r = _one(sql, {"n": nombre})
+    if r is None:
         return None
 
-    r = df.iloc[0]
     # activo?
     if str(r["act"]) in ("1", "True", "true"):
         return None
@@ -78,11 +117,10 @@ def login_nivel2_operario(codigo: str, clave_nombre: str):
         if op:
             cols.append(op)
     sql = f"SELECT {', '.join(cols)} FROM {PERSO_TABLE} WHERE {PERSO_COL_COD} = :c"
-    df = _q(sql, {"c": codigo})
-    if df.empty:
+    r = _one(sql, {"c": codigo})
+    if r is None:
         return None
 
-    r = df.iloc[0]
     # activo?
     if str(r.get(PERSO_COL_ACT, 0)) in ("1", "True", "true"):
         return None
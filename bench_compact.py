@@ -0,0 +1,79 @@
+"""Benchmark: dataset como texto (``dtype=str``) vs ``datasets.load_compact``.
+
+Uso::
+
+    python bench_compact.py [ruta_nv.csv] [ruta_stock.csv]
+
+Por defecto usa ``data/nv.csv`` y ``data/stock.csv``. Para cada archivo
+informa la memoria del DataFrame (``memory_usage(deep=True)``) en ambas
+representaciones y el tiempo de un filtro por valor y de un groupby con
+suma, escritos como los hace hoy cada consumidor: sobre texto hay que
+``strip`` + ``to_numeric`` en cada llamada.
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+from services import datasets
+
+BASE_DIR = os.path.dirname(__file__)
+
+CASOS = {
+    # tipo: (columna a filtrar, columna de grupo, columna a sumar)
+    "nv": ("Num. Nota", "Ciudad", "Cantidad"),
+    "stock": ("Bodega", "Línea", "Cantidad"),
+}
+
+
+def _medir(fn, repeticiones: int = 50) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        fn()
+    return (time.perf_counter() - t0) / repeticiones * 1000
+
+
+def _texto(path: str, tipo: str) -> pd.DataFrame:
+    manifest = datasets.ensure_manifest(path, tipo)
+    df = datasets.read_csv(path, header=manifest["header_row"], dtype=str,
+                           keep_default_na=False, cache=False)
+    return df.rename(columns=manifest.get("renames") or {})
+
+
+def main(paths: dict[str, str]) -> None:
+    print(f"{'archivo':>10} {'repr.':>8} {'MB':>8} {'filtro ms':>10} {'groupby ms':>11}")
+    for tipo, path in paths.items():
+        filtro, grupo, suma = CASOS[tipo]
+        texto = _texto(path, tipo)
+        compacto = datasets.compact(texto, tipo)
+        valor = str(compacto[filtro].iloc[len(compacto) // 2])
+
+        def filtro_texto():
+            return texto[texto[filtro].str.strip() == valor]
+
+        def grupo_texto():
+            num = pd.to_numeric(texto[suma].str.strip(), errors="coerce").fillna(0)
+            return num.groupby(texto[grupo].str.strip()).sum()
+
+        def filtro_compacto():
+            return compacto[compacto[filtro] == valor]
+
+        def grupo_compacto():
+            return compacto.groupby(grupo, observed=True)[suma].sum()
+
+        assert len(filtro_texto()) == len(filtro_compacto())
+        # Las cantidades se redondean a entero (``SCHEMAS``): se comparan los grupos
+        assert set(grupo_texto().index) == set(grupo_compacto().index)
+        for nombre, df, f, g in (("texto", texto, filtro_texto, grupo_texto),
+                                 ("compacto", compacto, filtro_compacto, grupo_compacto)):
+            mb = df.memory_usage(deep=True).sum() / 1e6
+            print(f"{os.path.basename(path):>10} {nombre:>8} {mb:>8.2f} {_medir(f):>10.3f} {_medir(g):>11.3f}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main({
+        "nv": args[0] if len(args) > 0 else os.path.join(BASE_DIR, "data", "nv.csv"),
+        "stock": args[1] if len(args) > 1 else os.path.join(BASE_DIR, "data", "stock.csv"),
+    })
@@ -0,0 +1,83 @@
+"""Benchmark: leer una fila con ``pd.read_sql`` vs ``db.query_one``.
+
+Uso::
+
+    python bench_query_row.py [llamadas]
+
+Crea una tabla de usuarios en SQLite (temporal) y repite ``llamadas``
+búsquedas por nombre (por defecto 2000), como hace el login: por el camino
+de ``query_df`` (DataFrame + ``iloc[0]``) y por ``db.query_one`` (mapping
+directo del cursor). Informa latencia por llamada y el pico de memoria
+asignada en cada llamada (``tracemalloc``). Al ser una base local mide sólo
+el costo del lado del cliente, que es lo que cambia entre ambos caminos.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+import db
+
+SQL = "SELECT NOMBRE AS nom, PASSWORD AS pwd, Eliminado AS act FROM USER_DB WHERE RTRIM(NOMBRE) = :n"
+
+
+def _engine(path: str, filas: int = 500):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE USER_DB (NOMBRE TEXT, PASSWORD TEXT, Eliminado INTEGER)"))
+        conn.execute(
+            text("INSERT INTO USER_DB VALUES (:n, :p, 0)"),
+            [{"n": f"USUARIO {i}", "p": f"clave{i}"} for i in range(filas)],
+        )
+    return engine
+
+
+def via_dataframe(engine, nombre: str) -> dict | None:
+    with engine.connect() as conn:
+        df = pd.read_sql(text(SQL), conn, params={"n": nombre})
+    return df.iloc[0].to_dict() if not df.empty else None
+
+
+def via_query_one(engine, nombre: str) -> dict | None:
+    return db.query_one(SQL, {"n": nombre}, engine=engine)
+
+
+def _medir(fn, engine, llamadas: int) -> tuple[float, float]:
+    nombres = [f"USUARIO {i % 500}" for i in range(llamadas)]
+    t0 = time.perf_counter()
+    for n in nombres:
+        fn(engine, n)
+    us = (time.perf_counter() - t0) / llamadas * 1e6
+
+    # Pico de memoria asignada durante cada llamada, promediado
+    picos = []
+    tracemalloc.start()
+    for n in nombres[:200]:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(engine, n)
+        picos.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return us, sum(picos) / len(picos) / 1024
+
+
+def main(llamadas: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(os.path.join(tmp, "usuarios.db"))
+        assert via_dataframe(engine, "USUARIO 7")["pwd"] == via_query_one(engine, "USUARIO 7")["pwd"]
+        via_dataframe(engine, "USUARIO 1"), via_query_one(engine, "USUARIO 1")  # calentar
+
+        print(f"{llamadas} búsquedas de una fila")
+        print(f"{'camino':>14} {'µs/llamada':>11} {'KB/llamada':>11}")
+        for nombre, fn in (("DataFrame", via_dataframe), ("query_one", via_query_one)):
+            us, kb = _medir(fn, engine, llamadas)
+            print(f"{nombre:>14} {us:>11.1f} {kb:>11.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,74 @@
+"""Benchmark: escaneo de inventario con listas vs ``ScanLedger``.
+
+Uso::
+
+    python bench_scan_ledger.py [lineas escaneos]
+
+Reproduce ``escaneos`` escaneos (por defecto 10k) sobre un inventario de
+``lineas`` líneas (10k) y luego arma la tabla de resultados, como hace
+``/inventario``: validar el código, acumular y calcular Contado/Diferencia.
+"""
+import random
+import sys
+import time
+
+from services.scan_ledger import ScanLedger
+
+
+def _inventario(n: int) -> list[dict]:
+    return [{'Código': f'{1000000 + i}', 'Nombre': f'PRODUCTO {i}', 'Cantidad': i % 50} for i in range(n)]
+
+
+def _escaneos(expected: list[dict], n: int) -> list[tuple[str, int]]:
+    rng = random.Random(0)
+    return [(rng.choice(expected)['Código'], rng.randint(1, 3)) for _ in range(n)]
+
+
+def legacy(expected: list[dict], escaneos) -> list[dict]:
+    scanned_items = []
+    for codigo, contado in escaneos:
+        if any(item['Código'] == codigo for item in expected):
+            for s in scanned_items:
+                if s['Código'] == codigo:
+                    s['Contado'] += contado
+                    break
+            else:
+                scanned_items.append({'Código': codigo, 'Contado': contado})
+    results = []
+    for exp in expected:
+        cnt = next((s['Contado'] for s in scanned_items if s['Código'] == exp['Código']), 0)
+        results.append({'Código': exp['Código'], 'Contado': cnt, 'Diferencia': cnt - exp['Cantidad']})
+    return results
+
+
+def ledger(expected: list[dict], escaneos) -> list[dict]:
+    led = ScanLedger(expected, 'Código', 'Cantidad')
+    for codigo, contado in escaneos:
+        if codigo in led:
+            led.add(codigo, contado)
+    return [
+        {'Código': exp['Código'], 'Contado': cnt, 'Diferencia': cnt - qty}
+        for exp, qty, cnt in led.rows()
+    ]
+
+
+def _timeit(fn, *args) -> tuple[float, list]:
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t0, out
+
+
+def main(lineas: int, escaneos: int) -> None:
+    expected = _inventario(lineas)
+    scans = _escaneos(expected, escaneos)
+    t_old, old = _timeit(legacy, expected, scans)
+    t_new, new = _timeit(ledger, expected, scans)
+    assert old == new
+    print(f"{lineas} líneas, {escaneos} escaneos")
+    print(f"{'listas (s)':>14} {'ScanLedger (s)':>16} {'speedup':>9}")
+    print(f"{t_old:>14.3f} {t_new:>16.3f} {t_old / t_new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*(args + [10_000, 10_000][len(args):]))
@@ -0,0 +1,56 @@
+"""Benchmark: mapa de stock con ``iterrows`` vs ``StockCache._rows`` (``code_map``).
+
+Uso::
+
+    python bench_stock_map.py [filas ...]
+
+Por defecto mide 10k, 100k y 1M filas con un DataFrame sintético con la
+misma forma que devuelve ``db.get_stock_actual``.
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.stock_cache import StockCache
+
+
+def _frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'codigo': [f'{1000000 + i:<30}' for i in range(n)],
+        'nombre': [f'PRODUCTO {i}  ' for i in range(n)],
+        'cantidad': rng.integers(0, 500, n),
+    })
+
+
+def legacy(df: pd.DataFrame) -> dict:
+    stock_map = {}
+    for _, row in df.iterrows():
+        key = str(row.get('codigo', '')).strip()
+        stock_map[key] = {
+            'Nombre': row.get('nombre', '').strip(),
+            'Cantidad': int(row.get('cantidad', 0))
+        }
+    return stock_map
+
+
+def _timeit(fn, df) -> tuple[float, dict]:
+    t0 = time.perf_counter()
+    out = fn(df)
+    return time.perf_counter() - t0, out
+
+
+def main(sizes: list[int]) -> None:
+    print(f"{'filas':>10} {'iterrows (s)':>14} {'code_map (s)':>14} {'speedup':>9}")
+    for n in sizes:
+        df = _frame(n)
+        t_old, old = _timeit(legacy, df)
+        t_new, new = _timeit(StockCache._rows, df)
+        assert old == new
+        print(f"{n:>10} {t_old:>14.3f} {t_new:>14.3f} {t_old / t_new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -1,10 +1,18 @@
 # db.py
+import functools
+import logging
 import os
+import threading
+import time
 import urllib.parse
 import pandas as pd
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+from services import consultas
+from services.cache import LRUCache
+from services.db_pool import instrument, pool_options, retry_on_disconnect
+
 load_dotenv()
 
 DRIVER   = os.getenv("DB_DRIVER", "ODBC Driver 17 for SQL Server")
@@ -35,11 +43,143 @@ else:
     )
 
 params = urllib.parse.quote_plus(odbc)
-ENGINE = create_engine(f"mssql+pyodbc:///?odbc_connect={params}", pool_pre_ping=True, fast_executemany=True)
+# Pool: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_PRE_PING
+ENGINE = create_engine(f"mssql+pyodbc:///?odbc_connect={params}", fast_executemany=True, **pool_options("DB"))
+instrument(ENGINE, "db")
 
-def query_df(sql: str, params: dict | None = None) -> pd.DataFrame:
+logger = logging.getLogger(__name__)
+
+# --- Métricas por cargador: llamadas, tiempo y viajes a la BBDD ---
+_STATS_LOCK = threading.Lock()
+_LOADER_STATS: dict[str, dict] = {}
+_round_trips = consultas.round_trips
+
+
+def timed(fn):
+    """Registra duración y consultas de cada llamada en ``loader_stats()``."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0, q0 = time.perf_counter(), _round_trips()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            n_consultas = _round_trips() - q0
+            with _STATS_LOCK:
+                st = _LOADER_STATS.setdefault(fn.__name__, {
+                    "llamadas": 0, "errores": 0, "consultas": 0,
+                    "ms_total": 0.0, "ms_max": 0.0, "ms_ultimo": 0.0,
+                })
+                st["llamadas"] += 1
+                st["errores"] += not ok
+                st["consultas"] += n_consultas
+                st["ms_total"] += ms
+                st["ms_max"] = max(st["ms_max"], ms)
+                st["ms_ultimo"] = ms
+            logger.debug(f"{fn.__name__}: {ms:.1f} ms, {n_consultas} consulta(s)")
+    return wrapper
+
+
+def loader_stats() -> dict[str, dict]:
+    """Copia de las métricas con el promedio por llamada."""
+    with _STATS_LOCK:
+        out = {name: dict(st) for name, st in _LOADER_STATS.items()}
+    for st in out.values():
+        st["ms_promedio"] = round(st["ms_total"] / st["llamadas"], 2) if st["llamadas"] else None
+        st["ms_total"] = round(st["ms_total"], 2)
+        st["ms_max"] = round(st["ms_max"], 2)
+        st["ms_ultimo"] = round(st["ms_ultimo"], 2)
+    return out
+
+
+# --- Caché de documentos (NV/OC) por número, con TTL corto ---
+DOC_CACHE = LRUCache(
+    max_items=int(os.getenv("DOC_CACHE_ITEMS", "256")),
+    ttl=float(os.getenv("DOC_CACHE_TTL", "30")),
+)
+
+
+def _copy(value):
+    """Copia lo que el llamador podría mutar sin tocar la caché."""
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy(v) for v in value)
+    return value
+
+
+def doc_cached(fn):
+    """Lectura a través de ``DOC_CACHE`` para cargadores ``fn(numero)``."""
+    @functools.wraps(fn)
+    def wrapper(numero):
+        key = (fn.__name__, str(numero).strip())
+        value = DOC_CACHE.get(key)
+        if value is None:
+            value = fn(numero)
+            DOC_CACHE.put(key, value)
+        return _copy(value)
+    return wrapper
+
+
+def cache_documento(loader, numero: str, value) -> None:
+    """Deja en ``DOC_CACHE`` lo que ``loader(numero)`` habría retornado."""
+    DOC_CACHE.put((loader.__name__, str(numero).strip()), value)
+
+
+def invalidate_documento(numero: str | None = None) -> int:
+    """Olvida un documento de todos los cargadores (o todos si es None)."""
+    if numero is None:
+        DOC_CACHE.clear()
+        return 0
+    numero = str(numero).strip()
+    return DOC_CACHE.pop_where(lambda k: k[1] == numero)
+
+
+def _read_df(sql: str, params: dict) -> pd.DataFrame:
     with ENGINE.begin() as conn:
-        return pd.read_sql(text(sql), conn, params=params or {})
+        return pd.read_sql(text(sql), conn, params=params)
+
+
+def query_df(sql: str, params: dict | None = None) -> pd.DataFrame:
+    consultas.count_round_trip()
+    # Lectura: si la conexión estaba muerta (sin pre-ping) se reintenta una vez
+    return retry_on_disconnect(_read_df, sql, params or {})
+
+
+# --- Consultas de una fila / un valor, sin DataFrame (ver ``services.consultas``) ---
+
+def query_rows(sql: str, params: dict | None = None, engine=None) -> list[dict]:
+    """Filas como diccionarios, directo del cursor."""
+    return consultas.query_rows(sql, params, engine or ENGINE)
+
+
+def query_one(sql: str, params: dict | None = None, engine=None) -> dict | None:
+    """Primera fila como diccionario, o None si no hay resultados."""
+    return consultas.query_one(sql, params, engine or ENGINE)
+
+
+def query_scalar(sql: str, params: dict | None = None, engine=None, default=None):
+    """Primera columna de la primera fila (``default`` si no hay filas)."""
+    return consultas.query_scalar(sql, params, engine or ENGINE, default)
+
+
+IN_CHUNK = 500  # SQL Server admite hasta 2100 parámetros por consulta
+
+
+def _query_in(sql: str, values: list, chunk: int = IN_CHUNK) -> pd.DataFrame:
+    """Ejecuta ``sql`` con ``{binds}`` reemplazado por lotes de ``chunk`` valores."""
+    frames = []
+    for start in range(0, len(values), chunk):
+        lote = values[start:start + chunk]
+        binds = ",".join([f":v{i}" for i in range(len(lote))])
+        frames.append(query_df(sql.format(binds=binds), {f"v{i}": v for i, v in enumerate(lote)}))
+    return pd.concat(frames, ignore_index=True)
+
 
 # === Repositorio para /ingreso ===
 
@@ -83,29 +223,40 @@ def get_docu_por_numorden(num_oc: str) -> pd.DataFrame:
     return query_df(sql, {"num_oc": num_oc})
 
 def get_numguia_por_numorden(num_oc: str) -> str | None:
-    df = query_df("SELECT TOP 1 NUMGUIAF FROM DOCU_DB WHERE NUMORDEN = :num_oc", {"num_oc": num_oc})
-    return (df["NUMGUIAF"].iloc[0] if not df.empty and "NUMGUIAF" in df.columns else None)
+    return query_scalar("SELECT TOP 1 NUMGUIAF FROM DOCU_DB WHERE NUMORDEN = :num_oc", {"num_oc": num_oc})
 
 
+@doc_cached
+@timed
 def get_oc_items(num_oc: str) -> tuple[pd.DataFrame, str | None]:
     """Obtiene líneas de una OC directamente desde la base de datos.
 
     Devuelve un ``DataFrame`` con las columnas ``Código``, ``Nombre``,
     ``Cantidad`` y ``Prec.Unit.``.  Además retorna el número de guía
-    asociado a la OC (si existe).
+    asociado a la OC (si existe). Líneas y guía vienen en una sola consulta:
+    la OC siempre aporta una fila (con ``ITEM`` nulo si no tiene líneas).
     """
     sql = """
         SELECT
+            g.NUMGUIAF,
+            d.ITEM,
             a.CODIGO2,
             a.NOMBRE,
             d.CANTIDAD,
             d.RPECUNIT
-        FROM DOCDE_DB d
-        JOIN ART_DB a ON a.CODIGO = d.CODIGO
-        WHERE d.NUMORDEN = :num_oc
+        FROM (SELECT :num_oc AS NUMORDEN) o
+        OUTER APPLY (
+            SELECT TOP 1 NUMGUIAF FROM DOCU_DB WHERE NUMORDEN = o.NUMORDEN
+        ) g
+        LEFT JOIN (DOCDE_DB d JOIN ART_DB a ON a.CODIGO = d.CODIGO)
+            ON d.NUMORDEN = o.NUMORDEN
         ORDER BY d.ITEM
     """
     df = query_df(sql, {"num_oc": num_oc})
+    num_guia = None
+    if not df.empty and pd.notna(df["NUMGUIAF"].iloc[0]):
+        num_guia = df["NUMGUIAF"].iloc[0]
+    df = df[df["ITEM"].notna()].drop(columns=["NUMGUIAF", "ITEM"]).reset_index(drop=True)
     if not df.empty:
         df = df.rename(columns={
             "CODIGO2": "Código",
@@ -113,12 +264,13 @@ def get_oc_items(num_oc: str) -> tuple[pd.DataFrame, str | None]:
             "CANTIDAD": "Cantidad",
             "RPECUNIT": "Prec.Unit."
         })
-    num_guia = get_numguia_por_numorden(num_oc)
     return df, num_guia
 
 
 # === Migrado desde db_utils.py ===
 
+@doc_cached
+@timed
 def get_oc_detalle(num_oc: str) -> list[dict]:
     """Obtiene el detalle de una OC como lista de diccionarios."""
     sql = """
@@ -142,6 +294,8 @@ def get_oc_detalle(num_oc: str) -> list[dict]:
     return df.to_dict(orient="records")
 
 
+@doc_cached
+@timed
 def get_nota_detalle(num_nota: str) -> pd.DataFrame:
     """Trae detalle de NV desde la BBDD."""
     sql = """
@@ -166,6 +320,73 @@ def get_nota_detalle(num_nota: str) -> pd.DataFrame:
     return df
 
 
+NOTA_COLS = ["num_nota", "codigo", "nombre", "cantidad", "prec_unit"]
+NOTAS_CHUNK = IN_CHUNK
+
+
+@timed
+def get_notas_detalle(nums: list[str]) -> pd.DataFrame:
+    """Cabecera y líneas de varias NV, con las mismas líneas que ``get_nota_detalle``.
+
+    Cada fila trae además los datos de cabecera de su nota (``fecha``,
+    ``rut``, ``razon_social``, ``sucursal``, ``num_oc``). Los números se
+    envían en lotes de ``NOTAS_CHUNK``: una ola de hasta 500 notas es un
+    solo viaje a la BBDD.
+    """
+    nums = list(dict.fromkeys(str(n).strip() for n in nums if str(n).strip()))
+    if not nums:
+        return pd.DataFrame(columns=NOTA_COLS + ["fecha", "rut", "razon_social", "sucursal", "num_oc"])
+    sql = """
+        SELECT
+            nv.NUMNOTA                                             AS num_nota,
+            nv.FECHA                                               AS fecha,
+            nv.NRUTCLIE                                            AS rut,
+            c.RAZSOC                                               AS razon_social,
+            nv.SUCUR                                               AS sucursal,
+            nv.NUMORDC                                             AS num_oc,
+            COALESCE(art.CODIGO2, CAST(nd.NCODART AS VARCHAR(50))) AS codigo,
+            nd.DESCRIP                                             AS nombre,
+            (nd.CANTIDAD - COALESCE(nd.CANTDESP, 0))               AS cantidad,
+            nd.PRECUNIT                                            AS prec_unit
+        FROM dbo.NOTV_DB  AS nv
+        JOIN dbo.NOTDE_DB AS nd
+            ON nd.NUMRECOR = nv.NUMREG
+        LEFT JOIN dbo.ART_DB AS art
+            ON art.NREGUIST = nd.NCODART
+        LEFT JOIN dbo.CLIEN_DB AS c
+            ON c.NREGUIST = nv.NRUTCLIE
+        WHERE nv.NUMNOTA IN ({binds})
+        ORDER BY nv.NUMNOTA, nd.ITEM
+    """
+    df = _query_in(sql, nums, NOTAS_CHUNK)
+    if not df.empty:
+        df["num_nota"] = df["num_nota"].astype(str).str.strip()
+        df["cantidad"] = pd.to_numeric(df["cantidad"], errors="coerce").fillna(0).astype(int)
+        df["prec_unit"] = pd.to_numeric(df["prec_unit"], errors="coerce").fillna(0.0)
+    return df
+
+
+NV_HEADER_DB_COLS = ["NUMNOTA", "NRUTCLIE", "FECHA", "SUCUR", "TOTAL", "ESTADO"]
+
+
+@timed
+def get_nv_headers(nums: list[str]) -> pd.DataFrame:
+    """Cabeceras de ``NOTV_DB`` para los números de nota indicados, por lotes."""
+    nums = list(dict.fromkeys(str(n).strip() for n in nums if str(n).strip()))
+    if not nums:
+        return pd.DataFrame(columns=NV_HEADER_DB_COLS)
+    sql = """
+        SELECT nv.NUMNOTA, nv.NRUTCLIE, nv.FECHA, nv.SUCUR, nv.TOTAL, nv.ESTADO
+        FROM dbo.NOTV_DB AS nv
+        WHERE nv.NUMNOTA IN ({binds})
+    """
+    df = _query_in(sql, nums)
+    if not df.empty:
+        df["NUMNOTA"] = df["NUMNOTA"].astype(str).str.strip()
+    return df
+
+
+@timed
 def get_stock_actual() -> pd.DataFrame:
     """Obtiene el stock físico de los productos desde la BBDD."""
     sql = """
@@ -183,9 +404,53 @@ def get_stock_actual() -> pd.DataFrame:
     return df
 
 
+STOCK_CHUNK = IN_CHUNK
+
+
+@timed
+def get_stock_por_codigos(codigos2: list[str]) -> pd.DataFrame:
+    """Stock físico sólo para los CODIGO2 indicados.
+
+    Arma los binds igual que ``get_art_por_codigos2`` pero en lotes de
+    ``STOCK_CHUNK`` códigos, de modo que el costo depende del tamaño del
+    documento y no del catálogo.
+    """
+    codigos2 = list(dict.fromkeys(str(c).strip() for c in codigos2 if str(c).strip()))
+    if not codigos2:
+        return pd.DataFrame(columns=["codigo", "nombre", "cantidad"])
+    sql = """
+        SELECT
+            art.CODIGO2   AS codigo,
+            art.NOMBRE    AS nombre,
+            stk.STK_FISICO AS cantidad
+        FROM dbo.STOCK_DB AS stk
+        JOIN dbo.ART_DB   AS art
+            ON art.NREGUIST = stk.ARTICULO
+        WHERE art.CODIGO2 IN ({binds})
+    """
+    df = _query_in(sql, codigos2, STOCK_CHUNK)
+    if not df.empty:
+        df["cantidad"] = pd.to_numeric(df["cantidad"], errors="coerce").fillna(0).astype(int)
+    return df
+
+
+# Columnas de la cabecera de la guía; se repiten en cada línea de la NV
+GUIA_HEADER = [
+    "GD_NUM", "OC_NUM", "FAV_RUT", "FAV_RAZSOC", "DESP_A", "VEND_CODIGO",
+    "VEND_NOMBRE", "ENTREGAR_EN", "COMISION", "SUCURSAL", "GLOSA_PAG",
+]
+
+
+@doc_cached
+@timed
 def get_guia_desde_nv(num_nota: str) -> tuple[dict, list[dict]]:
-    """Retorna ``(header, detalles)`` para prellenar la Guía de Despacho."""
-    header_sql = """
+    """Retorna ``(header, detalles)`` para prellenar la Guía de Despacho.
+
+    Cabecera y líneas salen de una sola consulta sobre ``NOTV_DB JOIN
+    NOTDE_DB``: la cabecera se toma de la primera fila y
+    ``DESCUENTO_UNICO_LINEAS`` se calcula sobre las líneas.
+    """
+    sql = """
         SELECT
             CAST(NULL AS VARCHAR(50))       AS GD_NUM,
             nv.NUMORDC                      AS OC_NUM,
@@ -198,19 +463,6 @@ def get_guia_desde_nv(num_nota: str) -> tuple[dict, list[dict]]:
             nv.COMISION                     AS COMISION,
             nv.SUCUR                        AS SUCURSAL,
             nv.GLOSACON                     AS GLOSA_PAG,
-            CASE WHEN MIN(COALESCE(nd.DESCTO,0)) = MAX(COALESCE(nd.DESCTO,0))
-                 THEN MIN(COALESCE(nd.DESCTO,0))
-                 ELSE NULL
-            END                             AS DESCUENTO_UNICO_LINEAS
-        FROM dbo.NOTV_DB  nv
-        LEFT JOIN dbo.CLIEN_DB c  ON c.NREGUIST = nv.NRUTCLIE
-        LEFT JOIN dbo.PERSO_DB p  ON p.NUMREG   = nv.CODVEND
-        JOIN dbo.NOTDE_DB nd ON nd.NUMRECOR = nv.NUMREG
-        WHERE nv.NUMNOTA = :num_nota
-        GROUP BY nv.NUMORDC, nv.RUTFACT, c.RAZSOC, nv.NRUTCLIE, p.CODIGO, p.NOMBRE, p.APELLIDO, c.DIR, nv.COMISION, nv.SUCUR, nv.GLOSACON
-    """
-    detail_sql = """
-        SELECT
             COALESCE(art.CODIGO2, CAST(nd.NCODART AS VARCHAR(50))) AS Codigo,
             nd.DESCRIP                                             AS Descripcion,
             (COALESCE(nd.CANTIDAD,0) - COALESCE(nd.CANTDESP,0))    AS Cantidad,
@@ -218,19 +470,25 @@ def get_guia_desde_nv(num_nota: str) -> tuple[dict, list[dict]]:
             COALESCE(nd.DESCTO,0)                                  AS [D%],
             nd.ITEM                                                AS Item
         FROM dbo.NOTV_DB  nv
+        LEFT JOIN dbo.CLIEN_DB c  ON c.NREGUIST = nv.NRUTCLIE
+        LEFT JOIN dbo.PERSO_DB p  ON p.NUMREG   = nv.CODVEND
         JOIN dbo.NOTDE_DB nd   ON nd.NUMRECOR = nv.NUMREG
         LEFT JOIN dbo.ART_DB art ON art.NREGUIST = nd.NCODART
         WHERE nv.NUMNOTA = :num_nota
         ORDER BY nd.ITEM
     """
-    with ENGINE.begin() as conn:
-        df_h = pd.read_sql(text(header_sql), conn, params={"num_nota": num_nota})
-        df_d = pd.read_sql(text(detail_sql), conn,  params={"num_nota": num_nota})
-    header = df_h.iloc[0].to_dict() if not df_h.empty else {}
-    detalles = df_d.to_dict(orient="records")
+    df = query_df(sql, {"num_nota": num_nota})
+    if df.empty:
+        return {}, []
+    header = df[GUIA_HEADER].iloc[0].to_dict()
+    descuentos = df["D%"].unique()
+    header["DESCUENTO_UNICO_LINEAS"] = descuentos[0] if len(descuentos) == 1 else None
+    detalles = df.drop(columns=GUIA_HEADER).to_dict(orient="records")
     return header, detalles
 
 
+@doc_cached
+@timed
 def get_factura_desde_nv(num_nota: str) -> dict:
     """Obtiene datos para prellenar la Factura de Venta desde una Nota de Venta."""
     sql = """
@@ -242,8 +500,7 @@ def get_factura_desde_nv(num_nota: str) -> dict:
         LEFT JOIN dbo.PERSO_DB p ON p.NUMREG = nv.CODVEND
         WHERE nv.NUMNOTA = :num_nota
     """
-    df = query_df(sql, {"num_nota": num_nota})
-    return df.iloc[0].to_dict() if not df.empty else {}
+    return query_one(sql, {"num_nota": num_nota}) or {}
 
 
 # --- Ejecutar SQL no-SELECT (INSERT/UPDATE/MERGE/DDL) ---
@@ -20,4 +20,65 @@ class AsignacionNV(db.Model):
     assigned_by = db.Column(db.String(120), nullable=False)
     assigned_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    zona = db.relationship("Zona", lazy="joined")
\ No newline at end of file
+    zona = db.relationship("Zona", lazy="joined")
+
+
+class ScanSesion(db.Model):
+    """Documento cargado en un flujo de escaneo (ingreso, salida, ...).
+
+    Una fila por navegador (``sid`` guardado en la cookie) y flujo. Las
+    líneas del documento se guardan serializadas (se cargan sólo si se piden);
+    ``version`` cambia cada vez que se reemplaza el documento.
+    """
+    __tablename__ = "scan_sesiones"
+    __table_args__ = (db.UniqueConstraint("sid", "flujo"),)
+    id = db.Column(db.Integer, primary_key=True)
+    sid = db.Column(db.String(32), index=True, nullable=False)
+    flujo = db.Column(db.String(40), nullable=False)
+    numero = db.Column(db.String(64), default="", nullable=False)
+    guia = db.Column(db.String(64), default="", nullable=False)
+    items_json = db.deferred(db.Column(db.Text, default="[]", nullable=False))
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class ScanItem(db.Model):
+    """Cantidad escaneada de un código (por guía) dentro de una ``ScanSesion``."""
+    __tablename__ = "scan_items"
+    __table_args__ = (db.UniqueConstraint("sesion_id", "guia", "codigo"),)
+    id = db.Column(db.Integer, primary_key=True)
+    sesion_id = db.Column(db.Integer, db.ForeignKey("scan_sesiones.id"), index=True, nullable=False)
+    guia = db.Column(db.String(64), default="", nullable=False)
+    codigo = db.Column(db.String(64), nullable=False)
+    cantidad = db.Column(db.Integer, default=0, nullable=False)
+    scanned_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+
+class InvSesion(db.Model):
+    """Sesión de inventario compartida por los operarios que cuentan."""
+    __tablename__ = "inv_sesiones"
+    id = db.Column(db.String(32), primary_key=True)
+    estado = db.Column(db.String(20), default="EN_PROCESO", nullable=False)
+    creado_por = db.Column(db.String(120), default="", nullable=False)
+    creado = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    items_json = db.deferred(db.Column(db.Text, default="[]", nullable=False))
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class InvConteo(db.Model):
+    """Registro append-only de cada conteo (nunca se actualiza ni se borra)."""
+    __tablename__ = "inv_conteos"
+    __table_args__ = (db.Index("ix_inv_conteos_sesion_id_id", "sesion_id", "id"),)
+    id = db.Column(db.Integer, primary_key=True)
+    sesion_id = db.Column(db.String(32), db.ForeignKey("inv_sesiones.id"), nullable=False)
+    operario = db.Column(db.String(120), default="", nullable=False)
+    codigo = db.Column(db.String(64), nullable=False)
+    cantidad = db.Column(db.Integer, nullable=False)
+    registrado = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+
+class Migracion(db.Model):
+    """Migraciones de datos de una sola vez ya aplicadas, por nombre."""
+    __tablename__ = "migraciones"
+    nombre = db.Column(db.String(64), primary_key=True)
+    aplicada = db.Column(db.DateTime, default=datetime.now, nullable=False)
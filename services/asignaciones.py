@@ -1,5 +1,6 @@
 from typing import List
 from models import db, Zona, AsignacionNV
+from services import nv_query
 
 
 def upsert_asignacion(num_nota: str, zona_id: int, assigned_by: str) -> AsignacionNV:
@@ -22,6 +23,11 @@ def nv_asignadas_por_zona(zona_id: int, estados: List[str] = None) -> list[str]:
     return [a.num_nota for a in q.order_by(AsignacionNV.assigned_at.desc()).all()]
 
 
+def notas_por_zona(zona_id: int, estados: List[str] = None) -> dict[str, dict]:
+    """NV asignadas a la zona con cabecera y líneas, cargadas en un solo lote."""
+    return nv_query.cargar_notas(nv_asignadas_por_zona(zona_id, estados))
+
+
 def marcar_asignacion_completada(num_nota: str):
     a = AsignacionNV.query.filter_by(num_nota=num_nota).first()
     if a and a.estado != "completada":
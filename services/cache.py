@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Caché LRU en memoria con límite de ítems, de bytes y TTL opcional.
+
+    ``sizeof`` estima el tamaño de cada valor; si se define ``max_bytes`` se
+    desalojan los ítems menos usados hasta quedar bajo el presupuesto. Lleva
+    contadores de aciertos/fallos para poder afinar los límites.
+    """
+
+    def __init__(
+        self,
+        max_items: int = 128,
+        max_bytes: int | None = None,
+        ttl: float | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda _v: 0)
+        self._lock = threading.Lock()
+        self._items: OrderedDict[Hashable, tuple[Any, int, float]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # no cabe: mejor no desalojar todo lo demás
+            self._items[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._items and (
+                len(self._items) > self.max_items
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._items))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Si ``key`` está en la caché (sin contar acierto ni renovar su uso)."""
+        with self._lock:
+            return key in self._items
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+
+    def pop_where(self, pred: Callable[[Hashable], bool]) -> int:
+        """Elimina todas las claves que cumplan ``pred``; retorna cuántas."""
+        with self._lock:
+            keys = [k for k in self._items if pred(k)]
+            for k in keys:
+                self._drop(k)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def _drop(self, key: Hashable) -> None:
+        _value, size, _ts = self._items.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'items': len(self._items),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+            }
@@ -0,0 +1,51 @@
+"""Consultas de filas / una fila / un valor, sin DataFrame.
+
+Reciben el engine explícito y no crean ninguno al importarse, así que
+``auth_service`` las puede usar con su propia base (p. ej. SQLite) sin
+cargar ``db`` ni pyodbc. ``db`` las expone con su ``ENGINE`` por defecto.
+
+También llevan la cuenta de viajes a la BBDD por hilo que usa ``db.timed``.
+"""
+import threading
+
+from sqlalchemy import text
+
+from services.db_pool import retry_on_disconnect
+
+_local = threading.local()
+
+
+def round_trips() -> int:
+    """Consultas ejecutadas hasta ahora por este hilo."""
+    return getattr(_local, "consultas", 0)
+
+
+def count_round_trip() -> None:
+    _local.consultas = round_trips() + 1
+
+
+def _execute(engine, sql: str, params: dict, fetch):
+    with engine.connect() as conn:
+        return fetch(conn.execute(text(sql), params))
+
+
+def _run(sql: str, params: dict | None, engine, fetch):
+    count_round_trip()
+    return retry_on_disconnect(_execute, engine, sql, params or {}, fetch)
+
+
+def query_rows(sql: str, params: dict | None, engine) -> list[dict]:
+    """Filas como diccionarios, directo del cursor."""
+    return _run(sql, params, engine, lambda res: [dict(r) for r in res.mappings()])
+
+
+def query_one(sql: str, params: dict | None, engine) -> dict | None:
+    """Primera fila como diccionario, o None si no hay resultados."""
+    row = _run(sql, params, engine, lambda res: res.mappings().first())
+    return dict(row) if row is not None else None
+
+
+def query_scalar(sql: str, params: dict | None, engine, default=None):
+    """Primera columna de la primera fila (``default`` si no hay filas)."""
+    value = _run(sql, params, engine, lambda res: res.scalar())
+    return default if value is None else value
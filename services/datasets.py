@@ -0,0 +1,484 @@
+"""Acceso a los archivos de ``data/*.csv`` con caché del DataFrame parseado.
+
+Cada archivo se parsea una sola vez por combinación de argumentos y se
+mantiene en memoria mientras su ``mtime``/tamaño no cambien. ``/importar``
+invalida explícitamente el archivo que reescribe.
+
+Si ``pyarrow`` está instalado, ``/importar`` deja además una copia columnar
+(Arrow IPC / Feather sin comprimir) junto a cada CSV, con un esquema fijo por
+tipo. ``load`` la lee con poda de columnas y ``memory_map``. Las columnas
+numéricas quedan como enteros nullable (``Int64``): una celda vacía o que no
+se puede leer es ``<NA>``, no 0.
+
+Al importar también se escribe un manifiesto ``<nombre>.manifest.json`` con
+la fila de cabecera detectada, el mapeo a nombres canónicos y el conteo de
+filas, para que los lectores no tengan que detectar nada por request.
+"""
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import unicodedata
+from datetime import datetime
+
+import pandas as pd
+
+from services.cache import LRUCache
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ModuleNotFoundError:  # pragma: no cover - dependencia opcional
+    pa = feather = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_MB = int(os.getenv("DATASET_CACHE_MB", "256"))
+
+_CACHE = LRUCache(
+    max_items=32,
+    max_bytes=CACHE_MB * 1024 * 1024,
+    sizeof=lambda v: int(v[1].memory_usage(deep=True).sum()),
+)
+
+
+# Columnas numéricas por tipo de importación; el resto se guarda como texto.
+SCHEMAS = {
+    "oc": {
+        "DCTO.TIPO": "int64", "DCTO.PJE": "int64", "Item": "int64", "Descto.": "int64",
+        "Cantidad": "int64", "Cant. Recibida": "int64", "Transito": "int64",
+        "Prec.Unit.": "int64",
+    },
+    "nv": {
+        "Tot. Neto": "int64", "Item": "int64", "Cantidad": "int64", "Cant. Desp.": "int64",
+        "Precio Unitario": "int64", "Pendiente": "int64",
+    },
+    "stock": {
+        "Cantidad": "int64", "P.Ult.Comp": "int64", "Costo Lista": "int64",
+    },
+    "master": {},
+    "nv_headers": {"Líneas": "int64", "Total Neto": "int64"},
+}
+
+
+# Nombres normalizados (ver ``norm_header``) -> nombre canónico de columna
+CANONICAL = {
+    "nv": {
+        'ciudad': 'Ciudad',
+        'fecha': 'Fecha',
+        'numnota': 'Num. Nota',
+        'rut': 'RUT',
+        'razonsocial': 'Razón Social',
+        'canal': 'Canal',
+        'fechaentrega': 'Fecha Entrega',
+        'formadepago': 'Forma de Pago',
+        'numordcompra': 'Num. Ord .Compra',
+        'codigo': 'Código',
+        'codigoproducto': 'Código',
+        'descriptor': 'Descriptor',
+        'descripcion': 'Descriptor',
+        'cantidad': 'Cantidad',
+        'cant': 'Cantidad',
+        'preciounitario': 'Precio Unitario',
+        'precio': 'Precio Unitario',
+    },
+}
+
+# Columnas que identifican la fila de cabecera de un archivo sin manifiesto
+HEADER_KEYS = {
+    "nv": {'ciudad', 'fecha', 'numnota', 'rut', 'razonsocial', 'canal', 'fechaentrega', 'formadepago'},
+    "oc": {'ciudad', 'noc', 'rut'},
+    "stock": {'ciudad', 'bodega', 'codigo', 'nombre', 'cantidad'},
+}
+
+
+def norm_header(txt) -> str:
+    """Nombre de columna sin tildes, minúsculas y sólo alfanumérico."""
+    s = unicodedata.normalize("NFKD", str(txt))
+    s = s.encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z0-9]", "", s)
+
+
+def canonical_renames(columns, tipo: str) -> dict[str, str]:
+    """Renombres ``original -> canónico`` para las columnas de ``tipo``."""
+    renames = {}
+    norm_cols = {norm_header(c): c for c in columns}
+    for key, canonical in CANONICAL.get(tipo, {}).items():
+        orig = norm_cols.get(key)
+        if orig is not None and orig not in renames and canonical not in renames.values():
+            renames[orig] = canonical
+    return {o: c for o, c in renames.items() if o != c}
+
+
+def _signature(path: str) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def clean_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Quita espacios/BOM de los nombres y elimina columnas ``Unnamed``."""
+    df.columns = [str(c).strip().replace("\ufeff", "") for c in df.columns]
+    return df.loc[:, ~df.columns.str.match(r"^Unnamed", case=False)]
+
+
+def read_csv(path: str, *, clean: bool = True, cache: bool = True, **kwargs) -> pd.DataFrame:
+    """``pd.read_csv`` con caché; devuelve una copia que el llamador puede mutar.
+
+    Con ``clean=True`` (y cabecera) se normalizan los nombres de columnas
+    igual que al importar. Con ``cache=False`` se parsea sin guardar nada.
+    """
+    path = os.path.abspath(path)
+    key = (path, clean, tuple(sorted(kwargs.items())))
+    sig = _signature(path)
+
+    entry = _CACHE.get(key) if cache else None
+    if entry is None or entry[0] != sig:
+        df = pd.read_csv(path, **kwargs)
+        if clean and kwargs.get("header", 0) is not None:
+            df = clean_columns(df)
+        if not cache:
+            return df
+        entry = (sig, df)
+        _CACHE.put(key, entry)
+        logger.info(f"Parseado {os.path.basename(path)} ({len(df)} filas)")
+    return entry[1].copy()
+
+
+def manifest_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".manifest.json"
+
+
+def temp_path(path: str) -> str:
+    """Archivo temporal nuevo junto a ``path``, para dejarlo con ``os.replace``.
+
+    El nombre es único: dos procesos que escriben el mismo destino no se
+    pisan el temporal.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    os.chmod(tmp, 0o644)  # mkstemp lo crea 0600
+    return tmp
+
+
+def write_manifest(path: str, tipo: str, df: pd.DataFrame, **extra) -> dict:
+    """Guarda el manifiesto del CSV ya escrito en ``path``."""
+    mtime, size = _signature(path)
+    manifest = {
+        "tipo": tipo,
+        "header_row": 0,
+        "columns": [str(c) for c in df.columns],
+        "renames": {},
+        "rows": int(len(df)),
+        "csv_mtime_ns": mtime,
+        "csv_size": size,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        **extra,
+    }
+    tmp = temp_path(manifest_path(path))
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, manifest_path(path))
+    return manifest
+
+
+def read_manifest(path: str) -> dict | None:
+    """Manifiesto vigente de ``path`` o None si no existe o quedó obsoleto."""
+    mpath = manifest_path(path)
+    if not os.path.exists(mpath) or not os.path.exists(path):
+        return None
+    try:
+        with open(mpath, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get("csv_mtime_ns"), manifest.get("csv_size")) != _signature(path):
+        return None
+    return manifest
+
+
+def detect_header(path: str, tipo: str, nrows: int = 30) -> int:
+    """Busca la fila de cabecera entre las primeras ``nrows`` filas."""
+    expected = HEADER_KEYS.get(tipo)
+    if not expected:
+        return 0
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for i, row in enumerate(csv.reader(f)):
+            if i >= nrows:
+                break
+            norms = {norm_header(c) for c in row if c}
+            if expected.issubset(norms):
+                return i
+    return 0
+
+
+def ensure_manifest(path: str, tipo: str) -> dict:
+    """Devuelve el manifiesto de ``path``, generándolo una vez si falta.
+
+    Sirve para archivos que no pasaron por ``/importar`` (o que se
+    reemplazaron a mano): la detección se hace sobre una vista previa y el
+    resultado queda persistido para los siguientes requests.
+    """
+    manifest = read_manifest(path)
+    if manifest is not None:
+        return manifest
+    header_row = detect_header(path, tipo)
+    df = read_csv(path, header=header_row, dtype=str, keep_default_na=False, cache=False)
+    manifest = write_manifest(
+        path, tipo, df, header_row=header_row, renames=canonical_renames(df.columns, tipo)
+    )
+    logger.info(f"Manifiesto generado para {os.path.basename(path)} (cabecera en fila {header_row})")
+    return manifest
+
+
+# Las columnas enteras se leen como ``Int64`` (con ``<NA>``), no como float
+_NULLABLE = {pa.int64(): pd.Int64Dtype()} if pa is not None else {}
+
+
+def columnar_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".feather"
+
+
+def has_columnar(path: str) -> bool:
+    """Hay copia columnar vigente (no más antigua que el CSV)."""
+    if feather is None:
+        return False
+    col = columnar_path(path)
+    if not os.path.exists(col):
+        return False
+    return not os.path.exists(path) or os.stat(col).st_mtime_ns >= os.stat(path).st_mtime_ns
+
+
+# "1.234" / "1,234.567": grupos de miles sin parte decimal
+_MILES = re.compile(r"^-?\d{1,3}(?:\.\d{3})+$|^-?\d{1,3}(?:,\d{3})+$")
+
+
+def parse_number(s: pd.Series) -> pd.Series:
+    """Texto numérico a float; lo que no se puede leer queda como NaN.
+
+    "1.234" y "1,234" son miles; con ambos separadores ("1.234,5" o
+    "1,234.5") el último es el decimal; un solo separador que no forma
+    grupos de miles es decimal ("14.8", "1,000000").
+    """
+    txt = s.astype(str).str.strip()
+    coma, punto = txt.str.rfind(","), txt.str.rfind(".")
+    ambos = (coma >= 0) & (punto >= 0)
+    miles = ~ambos & txt.str.match(_MILES)
+    out = txt.str.replace(",", ".", regex=False)
+    out = out.mask(miles, txt.str.replace(r"[.,]", "", regex=True))
+    out = out.mask(ambos & (coma > punto), txt.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    out = out.mask(ambos & (punto > coma), txt.str.replace(",", "", regex=False))
+    return pd.to_numeric(out, errors="coerce")
+
+
+def _to_int(s: pd.Series) -> pd.Series:
+    """Entero nullable (``Int64``): celdas vacías o no numéricas quedan ``<NA>``."""
+    if pd.api.types.is_integer_dtype(s):
+        return s.astype("Int64")
+    num = parse_number(s)
+    malos = num.isna() & (s.astype(str).str.strip() != "")
+    if malos.any():
+        logger.warning(
+            f"Columna {s.name!r}: {int(malos.sum())} valores no numéricos quedan vacíos "
+            f"(p.ej. {s[malos].iloc[0]!r})"
+        )
+    return num.round().astype("Int64")
+
+
+def _typed(df: pd.DataFrame, tipo: str) -> pd.DataFrame:
+    schema = SCHEMAS.get(tipo, {})
+    out = {}
+    for c in df.columns:
+        if schema.get(c) == "int64":
+            out[c] = _to_int(df[c])
+        else:
+            out[c] = df[c].astype(str)
+    return pd.DataFrame(out)
+
+
+def write_columnar(df: pd.DataFrame, tipo: str, path: str) -> str | None:
+    """Escribe la copia columnar tipada de ``df`` junto a ``path``."""
+    if feather is None:
+        return None
+    col = columnar_path(path)
+    tmp = temp_path(col)
+    table = pa.Table.from_pandas(_typed(df, tipo), preserve_index=False)
+    feather.write_feather(table, tmp, compression="uncompressed")
+    os.replace(tmp, col)
+    invalidate(path)
+    return col
+
+
+class ColumnarWriter:
+    """Copia columnar escrita por partes, con el mismo esquema que ``write_columnar``.
+
+    Cada ``write`` agrega un lote de filas al archivo temporal; ``close``
+    lo deja en su lugar con ``os.replace``. Sin ``pyarrow`` no hace nada.
+    """
+
+    def __init__(self, path: str, tipo: str, columns: list[str]):
+        self.path = path
+        self.tipo = tipo
+        self._writer = None
+        if feather is None:
+            return
+        schema = SCHEMAS.get(tipo, {})
+        self.schema = pa.schema([
+            (c, pa.int64() if schema.get(c) == "int64" else pa.string()) for c in columns
+        ])
+        self._tmp = temp_path(columnar_path(path))
+        self._writer = pa.ipc.new_file(self._tmp, self.schema)
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self._writer is not None:
+            table = pa.Table.from_pandas(_typed(df, self.tipo), schema=self.schema, preserve_index=False)
+            self._writer.write_table(table)
+
+    def close(self) -> str | None:
+        if self._writer is None:
+            return None
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp, columnar_path(self.path))
+        invalidate(self.path)
+        return columnar_path(self.path)
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.remove(self._tmp)
+
+
+def column_names(path: str, tipo: str | None = None) -> list[str]:
+    """Columnas disponibles (canónicas) sin cargar los datos."""
+    if has_columnar(path):
+        return list(feather.read_table(columnar_path(path), memory_map=True).column_names)
+    manifest = ensure_manifest(path, tipo) if tipo else read_manifest(path)
+    if manifest is not None:
+        return [manifest["renames"].get(c, c) for c in manifest["columns"]]
+    return list(read_csv(path, dtype=str, keep_default_na=False, nrows=0).columns)
+
+
+def load(path: str, columns: list[str] | None = None, tipo: str | None = None,
+         cache: bool = True) -> pd.DataFrame:
+    """Carga un dataset importado, preferentemente desde su copia columnar.
+
+    ``columns`` poda las columnas a leer (las inexistentes se ignoran). Sin
+    copia columnar se cae al CSV con ``dtype=str``, usando la cabecera y los
+    nombres canónicos del manifiesto (que se genera si se indica ``tipo``).
+    Con ``cache=False`` el resultado no queda en la caché.
+    """
+    if not has_columnar(path):
+        manifest = ensure_manifest(path, tipo) if tipo else read_manifest(path)
+        header_row = manifest["header_row"] if manifest else 0
+        df = read_csv(path, header=header_row, dtype=str, keep_default_na=False, cache=cache)
+        if manifest and manifest.get("renames"):
+            df = df.rename(columns=manifest["renames"])
+        return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+    col = columnar_path(path)
+    if columns is not None:
+        available = set(column_names(path))
+        columns = [c for c in columns if c in available]
+        if not columns:
+            return pd.DataFrame()
+    key = (os.path.abspath(path), "columnar", tuple(columns or ()))
+    sig = _signature(col)
+    entry = _CACHE.get(key) if cache else None
+    if entry is None or entry[0] != sig:
+        table = feather.read_table(col, columns=columns, memory_map=True)
+        if not cache:
+            return table.to_pandas(types_mapper=_NULLABLE.get)
+        entry = (sig, table.to_pandas(types_mapper=_NULLABLE.get))
+        _CACHE.put(key, entry)
+        logger.info(f"Cargado {os.path.basename(col)} ({table.num_rows} filas, {table.num_columns} columnas)")
+    return entry[1].copy()
+
+
+# Representación compacta en memoria (``load_compact``)
+CATEGORICAL = {"Ciudad", "Bodega", "Línea", "Línea de Negocio", "Canal", "Marca", "Tipo"}
+DATETIME = {"Fecha", "Fecha Entrega", "OC Fecha"}
+# Otras columnas de texto pasan a categoría si tienen a lo más esta fracción
+# de valores distintos (p.ej. RUT o Razón Social, repetidos en cada línea).
+CATEGORY_RATIO = 0.5
+
+
+def compact(df: pd.DataFrame, tipo: str | None = None) -> pd.DataFrame:
+    """``df`` sin relleno y tipado: enteros, fechas y categorías.
+
+    Los enteros son las columnas ``int64`` de ``SCHEMAS``; las fechas que
+    no se pueden leer quedan como ``NaT``.
+    """
+    schema = SCHEMAS.get(tipo, {})
+    out = {}
+    for c in df.columns:
+        if schema.get(c) == "int64":
+            out[c] = _to_int(df[c])
+            continue
+        s = df[c].astype(str).str.strip()
+        if c in DATETIME:
+            out[c] = pd.to_datetime(s, errors="coerce", format="ISO8601")
+        elif c in CATEGORICAL or s.nunique() <= CATEGORY_RATIO * len(s):
+            out[c] = s.astype("category")
+        else:
+            out[c] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def load_compact(path: str, tipo: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """Como ``load`` pero con la representación de ``compact``.
+
+    Sólo se cachea el resultado compacto, no el DataFrame de texto del que
+    sale, así que cada worker mantiene en memoria la versión chica.
+    """
+    key = (os.path.abspath(path), "compacto", tipo, tuple(columns or ()))
+    sig = version(path)
+    entry = _CACHE.get(key)
+    if entry is None or entry[0] != sig:
+        df = compact(load(path, columns, tipo, cache=False), tipo)
+        entry = (sig, df)
+        _CACHE.put(key, entry)
+        logger.info(
+            f"Compactado {os.path.basename(path)} ({len(df)} filas, "
+            f"{df.memory_usage(deep=True).sum() / 1e6:.1f} MB)"
+        )
+    return entry[1].copy()
+
+
+def memory_report(path: str, tipo: str) -> dict:
+    """Memoria del dataset leído como texto (``dtype=str``) y compacto."""
+    manifest = ensure_manifest(path, tipo)
+    texto = read_csv(path, header=manifest["header_row"], dtype=str, keep_default_na=False, cache=False)
+    compacto = compact(texto.rename(columns=manifest.get("renames") or {}), tipo)
+    antes = int(texto.memory_usage(deep=True).sum())
+    despues = int(compacto.memory_usage(deep=True).sum())
+    return {
+        "filas": len(texto),
+        "texto_bytes": antes,
+        "compacto_bytes": despues,
+        "factor": round(antes / despues, 2) if despues else None,
+    }
+
+
+def version(path: str) -> tuple:
+    """Identifica el contenido actual de un dataset (CSV y copia columnar)."""
+    sigs = [_signature(path) if os.path.exists(path) else None]
+    if has_columnar(path):
+        sigs.append(_signature(columnar_path(path)))
+    return tuple(sigs)
+
+
+def invalidate(path: str | None = None) -> None:
+    """Descarta de la caché un archivo (o todos si ``path`` es None)."""
+    if path is None:
+        _CACHE.clear()
+        return
+    path = os.path.abspath(path)
+    _CACHE.pop_where(lambda k: k[0] == path)
+
+
+def stats() -> dict:
+    return _CACHE.stats()
@@ -0,0 +1,105 @@
+"""Pool de conexiones instrumentado y su configuración por variables de entorno.
+
+``InstrumentedQueuePool`` es un ``QueuePool`` que mide cuánto espera cada
+checkout (incluida la apertura de conexiones nuevas) y cuenta los timeouts,
+para ver los atascos de inicio de turno. ``pool_options`` arma los
+argumentos de ``create_engine`` a partir de ``<PREFIJO>_POOL_*``.
+
+Sin ``pool_pre_ping`` (por defecto) las conexiones se renuevan con
+``pool_recycle``; si una conexión muerta igual falla, SQLAlchemy invalida el
+pool completo y ``retry_on_disconnect`` repite la operación una vez.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"yes", "true", "1"}
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        timeout = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timeout = True
+            raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            with self._stats_lock:
+                self._checkouts += 1
+                self._timeouts += timeout
+                self._wait_total += ms
+                self._wait_max = max(self._wait_max, ms)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            checkouts, timeouts = self._checkouts, self._timeouts
+            total, maximo = self._wait_total, self._wait_max
+        return {
+            "tamano": self.size(),
+            "en_uso": self.checkedout(),
+            "libres": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "espera_ms_promedio": round(total / checkouts, 2) if checkouts else None,
+            "espera_ms_max": round(maximo, 2),
+        }
+
+
+def pool_options(prefix: str = "DB") -> dict:
+    """Argumentos de pool para ``create_engine`` desde ``<prefix>_POOL_*``."""
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv(f"{prefix}_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv(f"{prefix}_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv(f"{prefix}_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv(f"{prefix}_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env_bool(f"{prefix}_PRE_PING", False),
+    }
+
+
+def instrument(engine, nombre: str) -> None:
+    """Registra en el log las desconexiones que invalidan el pool."""
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        if context.is_disconnect:
+            logger.warning(f"Conexión perdida en el pool '{nombre}'; se invalida el pool")
+
+
+def retry_on_disconnect(fn, *args, **kwargs):
+    """Ejecuta ``fn`` y la repite una vez si falló por una conexión invalidada."""
+    try:
+        return fn(*args, **kwargs)
+    except exc.DBAPIError as e:
+        if not e.connection_invalidated:
+            raise
+        return fn(*args, **kwargs)
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    if hasattr(pool, "stats"):
+        return pool.stats()
+    return {"pool": type(pool).__name__}
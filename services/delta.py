@@ -0,0 +1,120 @@
+"""Diferencias por clave entre una importación y el dataset vigente.
+
+Cada fila se identifica por las columnas de ``KEYS`` (más el número de
+aparición, porque el stock trae claves repetidas) y se compara por un hash
+de la fila completa. El dataset anterior se recorre por bloques y sólo se
+guarda ``clave -> hash``, así que la memoria no depende del ancho del
+archivo.
+"""
+import logging
+
+import pandas as pd
+
+from services import datasets
+
+logger = logging.getLogger(__name__)
+
+# Columnas clave por tipo, como nombres normalizados (ver ``datasets.norm_header``)
+KEYS = {
+    "stock": ("bodega", "codigo"),
+    "nv": ("numnota", "item"),
+    "oc": ("noc", "item"),
+}
+
+CAMBIOS = ("insertados", "actualizados", "eliminados")
+
+
+def key_columns(tipo: str, columns) -> list[str] | None:
+    """Columnas reales que forman la clave de ``tipo``, o None si faltan."""
+    norm = {datasets.norm_header(c): c for c in columns}
+    keys = KEYS.get(tipo)
+    if not keys or not all(k in norm for k in keys):
+        return None
+    return [norm[k] for k in keys]
+
+
+class _Keyer:
+    """Claves ``(valores..., aparición)`` en el orden del archivo."""
+
+    def __init__(self, columns: list[str]):
+        self.columns = columns
+        self._seen: dict[tuple, int] = {}
+
+    def __call__(self, chunk: pd.DataFrame):
+        for key in zip(*(chunk[c] for c in self.columns)):
+            n = self._seen.get(key, 0)
+            self._seen[key] = n + 1
+            yield key + (n,)
+
+
+def _hashes(chunk: pd.DataFrame):
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+
+def _row_index(path: str, columns: list[str], keys: list[str], chunk_rows: int) -> dict | None:
+    """``clave -> hash`` del CSV vigente; None si no tiene las mismas columnas."""
+    index = {}
+    keyer = _Keyer(keys)
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig",
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        chunk.columns = [str(c).strip() for c in chunk.columns]
+        if list(chunk.columns) != columns:
+            return None
+        chunk = chunk.apply(lambda s: s.str.strip())
+        index.update(zip(keyer(chunk), _hashes(chunk)))
+    return index
+
+
+class Delta:
+    """Clasifica las filas nuevas contra el dataset vigente, bloque a bloque."""
+
+    def __init__(self, old: dict, keys: list[str]):
+        self._old = old
+        self._keyer = _Keyer(keys)
+        self.keys = keys
+        self.counts = {"insertados": 0, "actualizados": 0, "eliminados": 0, "sin_cambios": 0}
+        self.claves: dict[str, list[tuple]] = {c: [] for c in CAMBIOS}
+
+    @classmethod
+    def against(cls, path: str, tipo: str, columns: list[str], chunk_rows: int) -> "Delta | None":
+        """Delta contra ``path``; None si no hay dataset comparable (reemplazo completo)."""
+        keys = key_columns(tipo, columns)
+        if keys is None:
+            return None
+        try:
+            old = _row_index(path, columns, keys, chunk_rows)
+        except (OSError, ValueError, pd.errors.ParserError) as e:
+            logger.info(f"Sin delta para {path}: {e}")
+            return None
+        return None if old is None else cls(old, keys)
+
+    def feed(self, chunk: pd.DataFrame) -> None:
+        for key, h in zip(self._keyer(chunk), _hashes(chunk)):
+            prev = self._old.pop(key, None)
+            if prev is None:
+                cambio = "insertados"
+            elif prev != h:
+                cambio = "actualizados"
+            else:
+                self.counts["sin_cambios"] += 1
+                continue
+            self.counts[cambio] += 1
+            self.claves[cambio].append(key[:-1])
+
+    def finish(self) -> dict:
+        """Cierra el delta (lo que quedó del dataset anterior se eliminó)."""
+        for key in self._old:
+            self.claves["eliminados"].append(key[:-1])
+        self.counts["eliminados"] = len(self._old)
+        self._old = {}
+        return self.counts
+
+    @property
+    def cambios(self) -> int:
+        return sum(self.counts[c] for c in CAMBIOS)
+
+    def changed_values(self, column: str) -> set:
+        """Valores de ``column`` (parte de la clave) en filas con cambios."""
+        i = self.keys.index(column)
+        return {k[i] for c in CAMBIOS for k in self.claves[c]}
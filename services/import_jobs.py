@@ -0,0 +1,201 @@
+"""Importaciones de ``/importar`` en segundo plano.
+
+El request sólo guarda el archivo subido y encola un trabajo; el parseo y la
+escritura (ver ``services.importer``) corren en un pool de hilos de
+``IMPORT_WORKERS`` hilos. Cada trabajo tiene un id y un estado con fase,
+filas leídas y tiempo transcurrido, que se consulta en
+``/importar/estado/<id>``, junto con los conteos del delta contra el
+dataset anterior (insertados, actualizados, eliminados).
+
+El estado se guarda también en ``data/uploads/_jobs/<id>.json`` para que lo
+pueda leer cualquier worker de gunicorn, no sólo el que lanzó el trabajo; de
+ahí sale también qué subidas no puede borrar todavía la retención de
+``services.uploads`` (``pending_sha256``). Si se indica ``uploads_dir``, el
+trabajo compacta al final las copias antiguas de ese directorio.
+Dos importaciones del mismo destino se ejecutan una después de la otra,
+también desde workers distintos (``locks.file_lock`` sobre el destino).
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from services import datasets, importer, locks, nv_query, uploads
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+JOBS_DIR = os.path.join(BASE_DIR, "data", "uploads", "_jobs")
+WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+KEEP_JOBS = 50  # trabajos terminados que se conservan (en memoria y en JOBS_DIR)
+STALE_SECS = 24 * 3600  # un trabajo sin terminar más viejo quedó de un worker caído
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="importar")
+_LOCK = threading.Lock()
+_JOBS: dict[str, dict] = {}
+
+TERMINADOS = ("listo", "error")
+
+
+def _path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _save(job: dict) -> None:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp = _path(job["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp, _path(job["id"]))
+
+
+def _update(job_id: str, **cambios) -> None:
+    with _LOCK:
+        job = _JOBS[job_id]
+        job.update(cambios)
+        snapshot = dict(job)
+    _save(snapshot)
+
+
+def _prune() -> None:
+    terminados = [j for j in _JOBS.values() if j["estado"] in TERMINADOS]
+    for job in sorted(terminados, key=lambda j: j["creado"])[:max(len(terminados) - KEEP_JOBS, 0)]:
+        del _JOBS[job["id"]]
+        try:
+            os.remove(_path(job["id"]))
+        except FileNotFoundError:
+            pass
+
+
+def pending_sha256() -> set[str]:
+    """``sha256`` de las subidas que algún worker todavía tiene que importar."""
+    limite = time.time() - STALE_SECS
+    out = set()
+    try:
+        nombres = os.listdir(JOBS_DIR)
+    except FileNotFoundError:
+        return out
+    for n in nombres:
+        path = os.path.join(JOBS_DIR, n)
+        try:
+            if not n.endswith(".json") or os.path.getmtime(path) < limite:
+                continue
+            with open(path, encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if job.get("sha256") and job.get("estado") not in TERMINADOS:
+            out.add(job["sha256"])
+    return out
+
+
+def submit(path: str, tipo: str, dest: str, *, etiqueta: str, source: str,
+           sha256: str | None = None, uploads_dir: str | None = None) -> str:
+    """Encola la importación de ``path`` en ``dest`` y retorna el id del trabajo.
+
+    Si ya hay un trabajo pendiente con el mismo contenido (``sha256``) para
+    ese destino se retorna su id en vez de encolar otro.
+    """
+    if sha256:
+        with _LOCK:
+            for job in _JOBS.values():
+                if (job["sha256"] == sha256 and job["dest"] == os.path.abspath(dest)
+                        and job["estado"] not in TERMINADOS):
+                    return job["id"]
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        "id": job_id,
+        "tipo": tipo,
+        "etiqueta": etiqueta,
+        "archivo": source,
+        "dest": os.path.abspath(dest),
+        "sha256": sha256,
+        "estado": "en_cola",
+        "fase": "en_cola",
+        "filas": 0,
+        "creado": datetime.now().isoformat(timespec="seconds"),
+        "inicio": None,
+        "fin": None,
+        "filas_por_seg": None,
+        "delta": None,
+        "mensaje": None,
+    }
+    with _LOCK:
+        _prune()
+        _JOBS[job_id] = job
+    _save(job)
+    _EXECUTOR.submit(_run, job_id, path, tipo, dest, source, sha256, uploads_dir)
+    return job_id
+
+
+def _run(job_id: str, path: str, tipo: str, dest: str, source: str, sha256: str | None,
+         uploads_dir: str | None = None) -> None:
+    with locks.file_lock(dest):
+        _importar(job_id, path, tipo, dest, source, sha256)
+    if uploads_dir:
+        try:
+            uploads.compact(uploads_dir, en_uso=pending_sha256())
+        except Exception:
+            logger.exception(f"Compactación de {uploads_dir} falló")
+
+
+def _importar(job_id: str, path: str, tipo: str, dest: str, source: str, sha256: str | None) -> None:
+    _update(job_id, estado="ejecutando", inicio=time.time())
+    try:
+        indice_vigente = tipo == "nv" and nv_query.headers_fresh()
+        res = importer.import_file(
+            path, tipo, dest, source=source, source_sha256=sha256,
+            progress=lambda fase, filas: _update(job_id, fase=fase, filas=filas),
+        )
+        if tipo == "nv":
+            _indices_nv(job_id, res, dest, indice_vigente)
+    except Exception as e:
+        logger.exception(f"Importación {job_id} ({tipo}) falló")
+        _update(job_id, estado="error", fase="error", fin=time.time(), mensaje=str(e))
+        return
+    _update(
+        job_id, estado="listo", fase="listo", fin=time.time(),
+        filas=res.filas, filas_por_seg=round(res.filas_por_seg, 1),
+        delta=res.delta.counts if res.delta is not None else None,
+    )
+
+
+def _indices_nv(job_id: str, res: importer.ImportResult, dest: str, indice_vigente: bool) -> None:
+    """Índice de cabeceras NV: sólo las notas con cambios si hay delta."""
+    if res.delta is not None and res.delta.cambios == 0:
+        return  # nv.csv no se reemplazó
+    _update(job_id, fase="indices")
+    if res.delta is not None and indice_vigente:
+        nv_query.patch_nv_headers(res.delta.changed_values("Num. Nota"))
+    else:
+        nv_query.write_nv_headers(datasets.load(dest, tipo="nv"))
+
+
+def status(job_id: str) -> dict | None:
+    """Estado del trabajo con ``segundos`` transcurridos, o None si no existe."""
+    with _LOCK:
+        job = dict(_JOBS[job_id]) if job_id in _JOBS else None
+    if job is None:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(_path(job_id), encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+    if job["inicio"] is not None:
+        job["segundos"] = round((job["fin"] or time.time()) - job["inicio"], 2)
+    else:
+        job["segundos"] = 0.0
+    return job
+
+
+def recent(limit: int = 10) -> list[dict]:
+    """Últimos trabajos lanzados por este proceso, del más nuevo al más viejo."""
+    with _LOCK:
+        ids = sorted(_JOBS, key=lambda i: _JOBS[i]["creado"], reverse=True)[:limit]
+    return [s for s in (status(i) for i in ids) if s is not None]
@@ -0,0 +1,237 @@
+"""Importación por partes de los archivos que se suben en ``/importar``.
+
+El archivo se recorre en bloques de ``IMPORT_CHUNK_ROWS`` filas: cada bloque
+se normaliza (nombres de columna, ``Unnamed``, nombres canónicos, espacios
+de relleno en las celdas) y se agrega a un CSV temporal y a la copia
+columnar temporal. Al terminar ambos se dejan en su lugar con
+``os.replace``, así que los lectores ven el archivo anterior o el nuevo
+completo, nunca uno a medias.
+
+CSV y XLSX (con ``openpyxl``) se leen en streaming. Los ``.xls`` (BIFF) no
+admiten lectura parcial con ``xlrd``: se leen una sola vez y se procesan por
+bloques igual que el resto.
+"""
+import logging
+import os
+import time
+from itertools import islice
+from typing import Callable, Iterator, NamedTuple
+
+import pandas as pd
+
+from services import datasets
+from services.delta import Delta
+
+try:
+    import openpyxl
+except ModuleNotFoundError:  # pragma: no cover - dependencia opcional
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "20000"))
+PREVIEW_ROWS = 30
+
+# Celdas que identifican la fila de cabecera en la vista previa
+EXPECTED = {
+    "oc":     {"no.", "oc", "ciudad"},
+    "nv":     {"ciudad", "num", "nota", "rut"},
+    "master": set(),
+    "stock":  {"ciudad", "bodega", "codigo", "nombre", "cantidad"},
+}
+
+
+class ImportResult(NamedTuple):
+    filas: int
+    columnas: list[str]
+    header_row: int
+    renames: dict[str, str]
+    segundos: float
+    delta: Delta | None = None  # None: no había dataset comparable
+
+    @property
+    def filas_por_seg(self) -> float:
+        return self.filas / self.segundos if self.segundos > 0 else float(self.filas)
+
+
+def header_row(preview: list[list[str]], tipo: str) -> int:
+    """Primera fila con al menos dos celdas esperadas para ``tipo`` (o 0)."""
+    expected = EXPECTED.get(tipo, set())
+    if expected:
+        for idx, row in enumerate(preview):
+            cells = {str(c).lower() for c in row if str(c).strip()}
+            if len(cells & expected) >= 2:
+                return idx
+    return 0
+
+
+def _names(row: list) -> list[str]:
+    """Nombres de columna como los arma pandas (``Unnamed: n``, ``X.1``)."""
+    names, seen = [], {}
+    for i, c in enumerate(row):
+        name = str(c) if str(c).strip() else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell(v) -> str:
+    """Valor de celda Excel como texto, igual que ``read_excel(dtype=str)``."""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _frames(rows: Iterator[list], columns: list[str], size: int) -> Iterator[pd.DataFrame]:
+    n = len(columns)
+    while True:
+        block = [(list(r) + [""] * n)[:n] for r in islice(rows, size)]
+        if not block:
+            return
+        yield pd.DataFrame(block, columns=columns, dtype=str)
+
+
+def _read_csv(path: str, tipo: str, size: int):
+    opts = dict(dtype=str, keep_default_na=False, encoding="latin-1", sep=",")
+    preview = pd.read_csv(path, header=None, nrows=PREVIEW_ROWS, **opts)
+    row = header_row(preview.values.tolist(), tipo)
+    columns = list(pd.read_csv(path, header=row, nrows=0, **opts).columns)
+    return row, columns, pd.read_csv(path, header=row, chunksize=size, **opts)
+
+
+def _read_xlsx(path: str, tipo: str, size: int):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    rows = ([_cell(v) for v in r] for r in wb.worksheets[0].iter_rows(values_only=True))
+    preview = list(islice(rows, PREVIEW_ROWS))
+    row = header_row(preview, tipo)
+    columns = _names(preview[row]) if preview else []
+
+    def chunks():
+        try:
+            yield from _frames(iter(preview[row + 1:]), columns, size)
+            yield from _frames(rows, columns, size)
+        finally:
+            wb.close()
+    return row, columns, chunks()
+
+
+def _read_xls(path: str, tipo: str, size: int):
+    raw = pd.read_excel(path, header=None, dtype=str, keep_default_na=False)
+    row = header_row(raw.head(PREVIEW_ROWS).values.tolist(), tipo)
+    columns = _names(raw.iloc[row].tolist()) if len(raw) else []
+    data = raw.iloc[row + 1:]
+
+    def chunks():
+        for start in range(0, len(data), size):
+            yield data.iloc[start:start + size].set_axis(columns, axis=1)
+    return row, columns, chunks()
+
+
+def open_source(path: str, tipo: str, size: int = CHUNK_ROWS):
+    """``(fila_cabecera, columnas, bloques)`` del archivo subido."""
+    ext = path.rsplit(".", 1)[-1].lower()
+    if ext == "xlsx" and openpyxl is not None:
+        return _read_xlsx(path, tipo, size)
+    if ext in {"xls", "xlsx"}:
+        return _read_xls(path, tipo, size)
+    return _read_csv(path, tipo, size)
+
+
+def _clean_names(columns) -> tuple[list[str], list[str]]:
+    """Columnas originales a conservar y su nombre ya limpio."""
+    cleaned = [str(c).strip().replace("\ufeff", "") for c in columns]
+    keep = [(c, n) for c, n in zip(columns, cleaned) if not n.lower().startswith("unnamed")]
+    return [c for c, _ in keep], [n for _, n in keep]
+
+
+class _SinCambios(Exception):
+    """El archivo nuevo tiene las mismas filas que el vigente."""
+
+
+def import_file(path: str, tipo: str, dest: str, *, source: str | None = None,
+                source_sha256: str | None = None, chunk_rows: int = CHUNK_ROWS,
+                progress: Callable[[str, int], None] | None = None) -> ImportResult:
+    """Importa ``path`` a ``dest`` (CSV con BOM + copia columnar + manifiesto).
+
+    ``source_sha256`` queda en el manifiesto para reconocer después una
+    subida idéntica (ver ``is_current``).
+
+    ``progress(fase, filas)`` se llama al empezar a leer, después de cada
+    bloque y antes de dejar los archivos en su lugar.
+
+    Si ``dest`` ya existe con las mismas columnas, las filas se comparan por
+    clave (ver ``services.delta``) y el resultado trae los conteos. Sin
+    cambios, el CSV y la copia columnar vigentes se conservan tal cual, así
+    que las cachés que dependen de su versión siguen valiendo.
+    """
+    progress = progress or (lambda fase, filas: None)
+    t0 = time.perf_counter()
+    progress("leyendo", 0)
+    row, raw_columns, chunks = open_source(path, tipo, chunk_rows)
+    keep, cleaned = _clean_names(raw_columns)
+    renames = datasets.canonical_renames(cleaned, tipo)
+    columns = [renames.get(c, c) for c in cleaned]
+
+    delta = Delta.against(dest, tipo, columns, chunk_rows) if os.path.exists(dest) else None
+    tmp = datasets.temp_path(dest)
+    writer = datasets.ColumnarWriter(dest, tipo, columns)
+    filas = 0
+    try:
+        with open(tmp, "w", newline="", encoding="utf-8-sig") as out:
+            pd.DataFrame(columns=columns).to_csv(out, index=False)
+            for chunk in chunks:
+                chunk = chunk[keep]
+                chunk.columns = columns
+                chunk = chunk.apply(lambda s: s.str.strip())
+                chunk.to_csv(out, index=False, header=False)
+                writer.write(chunk)
+                if delta is not None:
+                    delta.feed(chunk)
+                filas += len(chunk)
+                progress("leyendo", filas)
+        if delta is not None:
+            delta.finish()
+        progress("guardando", filas)
+        if delta is not None and delta.cambios == 0:
+            raise _SinCambios
+        os.replace(tmp, dest)
+    except _SinCambios:
+        writer.abort()
+        os.remove(tmp)
+    except BaseException:
+        writer.abort()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    else:
+        datasets.invalidate(dest)
+    datasets.write_manifest(
+        dest, tipo, pd.DataFrame(columns=columns),
+        rows=filas,
+        source=source or os.path.basename(path),
+        source_header_row=int(row),
+        source_sha256=source_sha256,
+        renames=renames,
+        delta=delta.counts if delta is not None else None,
+    )
+    writer.close()
+
+    res = ImportResult(filas, columns, int(row), renames, time.perf_counter() - t0, delta)
+    logger.info(
+        f"Importado {os.path.basename(dest)}: {filas} filas en {res.segundos:.2f}s "
+        f"({res.filas_por_seg:.0f} filas/s)"
+        + (f", delta {delta.counts}" if delta is not None else "")
+    )
+    return res
+
+
+def is_current(dest: str, sha256: str) -> bool:
+    """``dest`` ya es el resultado de importar el contenido ``sha256``."""
+    manifest = datasets.read_manifest(dest)
+    return manifest is not None and manifest.get("source_sha256") == sha256
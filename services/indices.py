@@ -0,0 +1,27 @@
+import pandas as pd
+
+
+def norm_code(x) -> str:
+    # quita espacios y * de Code39; pasa a mayúsculas
+    return str(x).strip().strip('*').upper()
+
+
+def norm_codes(codes: pd.Series) -> pd.Series:
+    """Versión vectorizada de :func:`norm_code` para una columna completa."""
+    return codes.astype(str).str.strip().str.strip('*').str.upper()
+
+
+def code_map(df: pd.DataFrame, code_col: str, columns: dict[str, str] | None = None) -> dict[str, dict]:
+    """Construye ``{codigo_normalizado: {alias: valor}}`` a partir de columnas.
+
+    ``columns`` mapea alias de salida a columnas de ``df``; si se omite se
+    usan todas las columnas con su nombre original. Si un código aparece más
+    de una vez gana la última fila, igual que al recorrer con ``iterrows``.
+    """
+    if df is None or df.empty or code_col not in df.columns:
+        return {}
+    columns = columns or {c: c for c in df.columns}
+    aliases = list(columns)
+    values = [df[src].tolist() if src in df.columns else [None] * len(df) for src in columns.values()]
+    keys = norm_codes(df[code_col]).tolist()
+    return {k: dict(zip(aliases, row)) for k, row in zip(keys, zip(*values))}
@@ -0,0 +1,214 @@
+"""Sesiones de inventario con varios operarios contando en paralelo.
+
+Cada conteo es una fila nueva en ``InvConteo`` (sin actualizar filas
+compartidas), así que los operarios no compiten por el mismo registro. Los
+totales por código se obtienen agregando el log; el ``ScanLedger`` de cada
+sesión se pone al día leyendo sólo las filas con ``id`` mayor a la última
+aplicada (en SQLite las escrituras se serializan, así que los ids se
+confirman en orden).
+"""
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from models import db, InvSesion, InvConteo, Migracion
+from services.cache import LRUCache
+from services.scan_ledger import ScanLedger
+
+CODE_KEY, QTY_KEY = 'Código', 'Cantidad'
+
+_LEDGERS = LRUCache(max_items=32)
+_LOCKS: dict[str, threading.Lock] = {}
+_LOCKS_LOCK = threading.Lock()
+_ITEMS = LRUCache(max_items=32)
+
+
+@contextmanager
+def _bloqueo(sesion_id: str):
+    """Lock de la sesión; se reintenta si ``_soltar`` lo retiró entretanto."""
+    while True:
+        with _LOCKS_LOCK:
+            lock = _LOCKS.setdefault(sesion_id, threading.Lock())
+        lock.acquire()
+        if _LOCKS.get(sesion_id) is lock:
+            break
+        lock.release()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def _soltar(pred) -> None:
+    """Retira los locks libres de las sesiones que cumplen ``pred`` (cerradas o sin ledger)."""
+    with _LOCKS_LOCK:
+        for sid, lock in list(_LOCKS.items()):
+            if pred(sid) and lock.acquire(blocking=False):
+                del _LOCKS[sid]
+                lock.release()
+
+
+def crear_sesion(creado_por: str = "") -> InvSesion:
+    sid = datetime.now().strftime('%Y%m%d%H%M%S')
+    n = 1
+    while db.session.get(InvSesion, sid) is not None:
+        n += 1
+        sid = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{n}"
+    s = InvSesion(id=sid, estado="EN_PROCESO", creado_por=creado_por or "", items_json="[]",
+                  version=time.time_ns() // 1000)
+    db.session.add(s)
+    db.session.commit()
+    return s
+
+
+def get_sesion(sesion_id: str) -> InvSesion | None:
+    """Búsqueda por clave primaria."""
+    return db.session.get(InvSesion, str(sesion_id)) if sesion_id else None
+
+
+def sesiones_abiertas() -> list[InvSesion]:
+    return InvSesion.query.filter_by(estado="EN_PROCESO").order_by(InvSesion.creado.desc()).all()
+
+
+def cerrar_sesion(sesion_id: str) -> None:
+    s = get_sesion(sesion_id)
+    if s and s.estado != "CERRADA":
+        s.estado = "CERRADA"
+        db.session.commit()
+    _LEDGERS.pop(str(sesion_id))
+    _soltar(lambda sid: sid == str(sesion_id))
+
+
+def cargar_esperado(sesion_id: str, items: list[dict]) -> None:
+    """Reemplaza el inventario esperado; los conteos ya registrados se mantienen."""
+    s = get_sesion(sesion_id)
+    s.items_json = json.dumps(list(items), ensure_ascii=False, default=str)
+    s.version = max((s.version or 0) + 1, time.time_ns() // 1000)
+    db.session.commit()
+
+
+def esperado(s: InvSesion) -> list[dict]:
+    entry = _ITEMS.get((s.id, s.version))
+    if entry is None:
+        entry = json.loads(s.items_json or "[]")
+        _ITEMS.put((s.id, s.version), entry)
+    return entry
+
+
+def registrar(sesion_id: str, codigo: str, cantidad: int, operario: str = "") -> InvConteo:
+    """Agrega un conteo al log de la sesión."""
+    c = InvConteo(sesion_id=sesion_id, codigo=codigo, cantidad=int(cantidad), operario=operario or "")
+    db.session.add(c)
+    db.session.commit()
+    return c
+
+
+def registrar_lote(sesion_id: str, conteos, operario: str = "") -> int:
+    """Agrega un lote de ``(codigo, cantidad)`` al log en una sola transacción."""
+    filas = [
+        InvConteo(sesion_id=sesion_id, codigo=codigo, cantidad=int(cantidad), operario=operario or "")
+        for codigo, cantidad in conteos
+    ]
+    db.session.add_all(filas)
+    db.session.commit()
+    return len(filas)
+
+
+def totales(sesion_id: str, hasta_id: int | None = None) -> dict[str, int]:
+    """Total contado por código, sumando los conteos de todos los operarios."""
+    q = db.session.query(InvConteo.codigo, db.func.sum(InvConteo.cantidad)).filter(
+        InvConteo.sesion_id == sesion_id
+    )
+    if hasta_id is not None:
+        q = q.filter(InvConteo.id <= hasta_id)
+    rows = q.group_by(InvConteo.codigo).all()
+    return {codigo: int(total or 0) for codigo, total in rows}
+
+
+def por_operario(sesion_id: str) -> list[dict]:
+    rows = (
+        db.session.query(
+            InvConteo.operario,
+            db.func.count(InvConteo.id),
+            db.func.sum(InvConteo.cantidad),
+            db.func.max(InvConteo.registrado),
+        )
+        .filter(InvConteo.sesion_id == sesion_id)
+        .group_by(InvConteo.operario)
+        .order_by(InvConteo.operario)
+        .all()
+    )
+    return [
+        {'Operario': op or '-', 'Escaneos': n, 'Unidades': int(total or 0),
+         'Último': ultimo.strftime('%Y-%m-%d %H:%M:%S') if ultimo else ''}
+        for op, n, total, ultimo in rows
+    ]
+
+
+def ultimos(sesion_id: str, n: int = 20) -> list[InvConteo]:
+    return (
+        InvConteo.query.filter_by(sesion_id=sesion_id)
+        .order_by(InvConteo.id.desc())
+        .limit(n)
+        .all()
+    )
+
+
+def ledger(sesion_id: str) -> ScanLedger:
+    """Conciliación de la sesión al día con el log de conteos."""
+    s = get_sesion(sesion_id)
+    if s is None:
+        return ScanLedger([], CODE_KEY, QTY_KEY)
+    with _bloqueo(s.id):
+        led = _LEDGERS.get(s.id)
+        if led is None or led.version != s.version:
+            led = ScanLedger(esperado(s), CODE_KEY, QTY_KEY)
+            led.version = s.version
+            led.stamp = 0
+            _LEDGERS.put(s.id, led)
+            _soltar(lambda sid: sid not in _LEDGERS)
+
+        nuevos = (
+            db.session.query(InvConteo.id, InvConteo.codigo, InvConteo.cantidad)
+            .filter(InvConteo.sesion_id == s.id, InvConteo.id > led.stamp)
+            .order_by(InvConteo.id)
+            .all()
+        )
+        for _id, codigo, cantidad in nuevos:
+            led.add(codigo, cantidad)
+        if nuevos:
+            led.stamp = nuevos[-1][0]
+    return led
+
+
+MIGRACION_CSV = "inv_sesiones_csv"
+
+
+def migrar_csv(path: str) -> int:
+    """Importa las sesiones del antiguo ``inv_sesiones.csv`` que falten.
+
+    Se aplica una sola vez: queda registrada en ``Migracion`` y las llamadas
+    siguientes no vuelven a leer el archivo.
+    """
+    if not os.path.exists(path) or db.session.get(Migracion, MIGRACION_CSV) is not None:
+        return 0
+    nuevas = 0
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            sid = (row.get('id') or '').strip()
+            if not sid or db.session.get(InvSesion, sid) is not None:
+                continue
+            try:
+                creado = datetime.fromisoformat(row.get('creado') or '')
+            except ValueError:
+                creado = datetime.now()
+            db.session.add(InvSesion(id=sid, estado=row.get('estado') or 'EN_PROCESO', creado=creado,
+                                     creado_por='', items_json='[]', version=0))
+            nuevas += 1
+    db.session.add(Migracion(nombre=MIGRACION_CSV))
+    db.session.commit()
+    return nuevas
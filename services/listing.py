@@ -0,0 +1,132 @@
+"""Motor de listados con filtros, orden y paginación del lado del servidor.
+
+``ListingIndex`` se arma una vez por versión del dataset: precalcula las
+columnas de búsqueda (minúsculas y sin tildes) y, para las columnas
+categóricas, los códigos de cada fila, de modo que un filtro se evalúa sobre
+los valores distintos y no sobre todas las filas. Las consultas trabajan con
+posiciones y sólo materializan las filas de la página pedida.
+"""
+import threading
+import time
+from typing import Callable, Hashable, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+
+class ListingPage(NamedTuple):
+    rows: list[dict]
+    total: int
+    elapsed_ms: float
+
+
+def fold(values: pd.Series) -> pd.Series:
+    """Texto en minúsculas, sin tildes ni espacios de relleno."""
+    return (
+        values.astype(str)
+        .str.normalize("NFKD")
+        .str.encode("ascii", "ignore")
+        .str.decode("ascii")
+        .str.lower()
+        .str.strip()
+    )
+
+
+def parse_sort(arg: str | None, allowed) -> list[tuple[str, bool]]:
+    """``"-Fecha,Ciudad"`` -> ``[('Fecha', False), ('Ciudad', True)]``."""
+    keys = []
+    for part in (arg or "").split(","):
+        part = part.strip()
+        col = part.lstrip("-")
+        if col and col in allowed:
+            keys.append((col, not part.startswith("-")))
+    return keys
+
+
+class ListingIndex:
+    def __init__(self, df: pd.DataFrame, search_cols=(), categorical=()):
+        self.df = df.reset_index(drop=True)
+        self.columns = list(self.df.columns)
+        self._search: dict[str, pd.Series] = {}
+        self._cats: dict[str, tuple[np.ndarray, pd.Series]] = {}
+        self._orders: dict[tuple, np.ndarray] = {}
+
+        for col in categorical:
+            if col in self.df.columns:
+                cat = pd.Categorical(self.df[col].astype(str))
+                self._cats[col] = (np.asarray(cat.codes), fold(pd.Series(cat.categories)))
+        for col in search_cols:
+            if col in self.df.columns and col not in self._cats:
+                self._search[col] = fold(self.df[col])
+
+    def _mask(self, col: str, text: str) -> np.ndarray | None:
+        text = fold(pd.Series([text])).iloc[0]
+        if not text:
+            return None
+        if col in self._cats:
+            codes, categories = self._cats[col]
+            hits = np.flatnonzero(categories.str.contains(text, regex=False).to_numpy())
+            return np.isin(codes, hits)
+        if col in self._search:
+            return self._search[col].str.contains(text, regex=False).to_numpy()
+        if col in self.df.columns:
+            return fold(self.df[col]).str.contains(text, regex=False).to_numpy()
+        return None
+
+    def _order(self, sort: tuple[tuple[str, bool], ...]) -> np.ndarray:
+        """Posiciones ordenadas por ``sort``; se calcula una vez por clave."""
+        if sort not in self._orders:
+            keys = []
+            for col, ascending in reversed(sort):  # lexsort: la última clave manda
+                values = self.df[col]
+                if values.dtype.kind not in "iufM":
+                    values = fold(values)
+                rank = values.rank(method="dense").to_numpy()
+                keys.append(rank if ascending else -rank)
+            self._orders[sort] = np.lexsort(keys)
+        return self._orders[sort]
+
+    def query(
+        self,
+        filters: dict[str, str] | None = None,
+        sort: list[tuple[str, bool]] | None = None,
+        offset: int = 0,
+        limit: int = 20,
+        columns: list[str] | None = None,
+    ) -> ListingPage:
+        t0 = time.perf_counter()
+        mask = None
+        for col, text in (filters or {}).items():
+            m = self._mask(col, text or "")
+            if m is not None:
+                mask = m if mask is None else mask & m
+
+        sort = tuple((c, asc) for c, asc in (sort or []) if c in self.df.columns)
+        if sort:
+            positions = self._order(sort)
+            if mask is not None:
+                positions = positions[mask[positions]]
+        else:
+            positions = np.flatnonzero(mask) if mask is not None else np.arange(len(self.df))
+
+        page = self.df.iloc[positions[offset:offset + limit]]
+        if columns:
+            page = page[[c for c in columns if c in page.columns]]
+        rows = page.to_dict(orient="records")
+        return ListingPage(rows, int(len(positions)), (time.perf_counter() - t0) * 1000)
+
+
+_LOCK = threading.Lock()
+_INDEXES: dict[str, tuple[Hashable, ListingIndex]] = {}
+
+
+def cached_index(name: str, version: Hashable, build: Callable[[], ListingIndex]) -> ListingIndex:
+    """Reutiliza el índice ``name`` mientras ``version`` no cambie."""
+    with _LOCK:
+        entry = _INDEXES.get(name)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    index = build()
+    with _LOCK:
+        _INDEXES[name] = (version, index)
+    return index
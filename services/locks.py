@@ -0,0 +1,36 @@
+"""Exclusión entre procesos sobre un archivo, con ``<ruta>.lock``.
+
+Los workers de gunicorn son procesos distintos, así que un
+``threading.Lock`` no los coordina. ``file_lock`` toma además un ``flock``
+exclusivo sobre ``<ruta>.lock``. Sin ``fcntl`` (Windows) sólo excluye a los
+hilos del mismo proceso.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # pragma: no cover - sólo POSIX
+    fcntl = None
+
+_LOCK = threading.Lock()
+_THREAD_LOCKS: dict[str, threading.Lock] = {}
+
+
+@contextmanager
+def file_lock(path: str):
+    """Sección exclusiva sobre ``path`` para hilos y procesos."""
+    lock_path = os.path.abspath(path) + ".lock"
+    with _LOCK:
+        lock = _THREAD_LOCKS.setdefault(lock_path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
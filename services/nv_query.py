@@ -1,25 +1,291 @@
+import logging
 import os
+import threading
+import time
+from typing import Hashable, List
+
 import pandas as pd
-from typing import List
+
+import db
+from services import datasets, listing
+from services.listing import ListingIndex, ListingPage
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+NV_FILE = os.path.join(BASE_DIR, "data", "nv.csv")
+NV_HEADERS_FILE = os.path.join(BASE_DIR, "data", "nv_headers.csv")
 
+# Columnas de cabecera (iguales en todas las líneas de una nota)
+NV_HEADER_COLS = [
+    "Num. Nota", "RUT", "Ciudad", "Fecha", "Razón Social", "Canal",
+    "Fecha Entrega", "Forma de Pago", "Num. Ord .Compra", "Terminado",
+    "Cod. Vendedor", "Nombre Vendedor N/V",
+]
 
-def get_nv_headers_by_nums(nums: List[str]) -> list[dict]:
-    nums = [n for n in (nums or []) if n]
-    if not nums:
-        return []
 
+# nv_headers.csv -> claves que retorna la BBDD para ``get_nv_headers_by_nums``.
+# ``SUCUR`` y ``ESTADO`` no tienen columna equivalente en el informe (``Ciudad``
+# y ``Terminado`` son otros campos): desde el índice esas claves no vienen.
+HEADER_INDEX_COLS = {
+    "NUMNOTA": "Num. Nota", "NRUTCLIE": "RUT", "FECHA": "Fecha", "TOTAL": "Total Neto",
+}
+
+_INDEX_LOCK = threading.Lock()
+_HEADER_INDEX: tuple[Hashable, dict[str, dict]] | None = None
+_ORIGENES = {"sql": 0, "indice": 0}
+
+
+def header_index() -> dict[str, dict]:
+    """``num_nota -> cabecera`` sobre ``nv_headers``; se arma una vez por importación."""
+    global _HEADER_INDEX
+    if not os.path.exists(NV_FILE):
+        return {}
+    version = datasets.version(NV_FILE)
+    with _INDEX_LOCK:
+        if _HEADER_INDEX is not None and _HEADER_INDEX[0] == version:
+            return _HEADER_INDEX[1]
+    headers = nv_headers()  # reconstruye nv_headers.csv si nv.csv es más nuevo
+    cols = {k: c for k, c in HEADER_INDEX_COLS.items() if c in headers.columns}
+    rows = headers[list(cols.values())].rename(columns={c: k for k, c in cols.items()})
+    index = {}
+    if "NUMNOTA" in rows.columns:
+        keys = rows["NUMNOTA"].astype(str).str.strip().tolist()
+        index = dict(zip(keys, rows.to_dict(orient="records")))
+    with _INDEX_LOCK:
+        _HEADER_INDEX = (version, index)
+    logger.info(f"Índice en memoria de cabeceras NV: {len(index)} notas")
+    return index
+
+
+def get_nv_headers_by_nums(nums: List[str], con_origen: bool = False):
+    """Cabeceras de las notas pedidas (claves ``NV_HEADER_DB_COLS``).
+
+    Consulta ``NOTV_DB`` en lotes; si la BBDD falla responde desde el
+    índice en memoria de ``nv_headers``, sólo con las claves de
+    ``HEADER_INDEX_COLS``. ``NUMNOTA`` es siempre texto sin espacios. Con ``con_origen=True`` retorna
+    ``(filas, origen)`` con origen ``"sql"`` o ``"indice"``.
+    """
+    nums = list(dict.fromkeys(str(n).strip() for n in (nums or []) if n and str(n).strip()))
+    rows, origen = [], "sql"
+    if nums:
+        t0 = time.perf_counter()
+        try:
+            rows = db.get_nv_headers(nums).to_dict(orient="records")
+        except Exception as e:
+            logger.warning(f"Cabeceras NV desde la BBDD fallaron, se usa el índice: {e}")
+            origen = "indice"
+            index = header_index()
+            rows = [dict(index[n]) for n in nums if n in index]
+        with _INDEX_LOCK:
+            _ORIGENES[origen] += 1
+        logger.debug(f"Cabeceras NV ({origen}): {len(rows)}/{len(nums)} en {(time.perf_counter() - t0) * 1000:.1f} ms")
+    return (rows, origen) if con_origen else rows
+
+
+def header_stats() -> dict:
+    """Cuántas llamadas a ``get_nv_headers_by_nums`` sirvió cada camino."""
+    with _INDEX_LOCK:
+        return {
+            "origenes": dict(_ORIGENES),
+            "indice": len(_HEADER_INDEX[1]) if _HEADER_INDEX is not None else None,
+        }
+
+
+# Cabecera de cada nota en ``cargar_notas``: clave -> columna de nv.csv (las
+# mismas claves que ``db.get_notas_detalle``; None si el informe no la trae)
+NOTA_HEADER_CSV = {
+    "fecha": "Fecha", "rut": "RUT", "razon_social": "Razón Social", "sucursal": None,
+    "num_oc": "Num. Ord .Compra",
+}
+
+
+def _notas_sql(nums: list[str]) -> dict[str, dict]:
+    df = db.get_notas_detalle(nums)
+    header_cols = [c for c in df.columns if c not in db.NOTA_COLS]
+    out = {}
+    for num, grupo in df.groupby("num_nota", sort=False):
+        lineas = grupo[db.NOTA_COLS].reset_index(drop=True)
+        # La ola deja lista la búsqueda individual de cada NV en /salida
+        db.cache_documento(db.get_nota_detalle, num, lineas)
+        out[num] = {
+            "num_nota": num,
+            "header": {"num_nota": num, **grupo[header_cols].iloc[0].to_dict()},
+            "lineas": lineas.drop(columns="num_nota").to_dict(orient="records"),
+            "origen": "sql",
+        }
+    return out
+
+
+def _valor(v):
+    """Celda de la cabecera; las fechas vacías (``NaT``) quedan como None."""
+    return None if v is None or pd.isna(v) else v
+
+
+def _notas_csv(nums: list[str]) -> dict[str, dict]:
+    """Misma estructura que ``_notas_sql`` desde ``nv.csv``, en una pasada."""
+    if not os.path.exists(NV_FILE):
+        return {}
+    df = datasets.load_compact(NV_FILE, "nv")
+    if "Num. Nota" not in df.columns:
+        return {}
+    keys = df["Num. Nota"].astype(str).str.strip()
+    df = df[keys.isin(nums)].assign(_num=keys)
+
+    def _col(grupo, col, numeric=False):
+        if col not in grupo.columns:
+            return [0 if numeric else ""] * len(grupo)
+        if numeric:
+            return pd.to_numeric(grupo[col].astype(str).str.strip().str.replace(",", "."), errors="coerce").fillna(0).tolist()
+        return grupo[col].astype(str).str.strip().tolist()
+
+    out = {}
+    for num, grupo in df.groupby("_num", sort=False):
+        first = grupo.iloc[0]
+        lineas = pd.DataFrame({
+            "codigo": _col(grupo, "Código"),
+            "nombre": _col(grupo, "Descriptor"),
+            "cantidad": [  # pendiente, como en la BBDD
+                int(round(q - d))
+                for q, d in zip(_col(grupo, "Cantidad", numeric=True), _col(grupo, "Cant. Desp.", numeric=True))
+            ],
+            "prec_unit": _col(grupo, "Precio Unitario", numeric=True),
+        })
+        out[num] = {
+            "num_nota": num,
+            "header": {"num_nota": num, **{k: _valor(first.get(c)) if c else None for k, c in NOTA_HEADER_CSV.items()}},
+            "lineas": lineas.to_dict(orient="records"),
+            "origen": "csv",
+        }
+    return out
+
+
+def cargar_notas(nums: List[str]) -> dict[str, dict]:
+    """Cabecera y líneas de varias NV de una vez, por número de nota.
+
+    Retorna ``{num: {"num_nota", "header", "lineas", "origen"}}`` en el
+    orden pedido; las notas que no existen se omiten. Usa una consulta en
+    lote a la BBDD y, si falla, una sola pasada sobre ``nv.csv``.
+    """
+    nums = list(dict.fromkeys(str(n).strip() for n in (nums or []) if str(n).strip()))
+    if not nums:
+        return {}
     try:
-        raise RuntimeError("usar fallback CSV")
-    except Exception:
-        path = os.path.join(BASE_DIR, "data", "nv.csv")
-        if not os.path.exists(path):
-            return []
-        df = pd.read_csv(path, dtype=str, keep_default_na=False)
-        df = df[df["NUMNOTA"].isin(nums)]
-        cols = [c for c in ["NUMNOTA", "NRUTCLIE", "FECHA", "SUCUR", "TOTAL", "ESTADO"] if c in df.columns]
-        if not cols:
-            return []
-        out = df[cols].copy()
-        return out.to_dict(orient="records")
\ No newline at end of file
+        found = _notas_sql(nums)
+    except Exception as e:
+        logger.warning(f"Carga de NV por lote desde la BBDD falló, se usa nv.csv: {e}")
+        found = _notas_csv(nums)
+    return {n: found[n] for n in nums if n in found}
+
+
+def build_nv_headers(df: pd.DataFrame) -> pd.DataFrame:
+    """Una fila por nota con sus datos de cabecera, ``Líneas`` y ``Total Neto``.
+
+    ``Total Neto`` toma ``Tot. Neto`` del export (viene repetido en cada
+    línea); si no existe se calcula como Cantidad x Precio Unitario.
+    """
+    if df.empty or not {"Num. Nota", "RUT"}.issubset(df.columns):
+        return pd.DataFrame(columns=NV_HEADER_COLS + ["Líneas", "Total Neto"])
+
+    def _num(col):
+        return pd.to_numeric(df[col].astype(str).str.strip(), errors="coerce").fillna(0)
+
+    work = df[[c for c in NV_HEADER_COLS if c in df.columns]].copy()
+    if "Tot. Neto" in df.columns:
+        work["Total Neto"] = _num("Tot. Neto")
+        agg_neto = "first"
+    else:
+        work["Total Neto"] = _num("Cantidad") * _num("Precio Unitario") if {"Cantidad", "Precio Unitario"}.issubset(df.columns) else 0
+        agg_neto = "sum"
+    work["Líneas"] = 1
+
+    agg = {c: "first" for c in work.columns if c not in ("Num. Nota", "RUT", "Líneas", "Total Neto")}
+    agg.update({"Líneas": "sum", "Total Neto": agg_neto})
+    out = work.groupby(["Num. Nota", "RUT"], as_index=False, sort=True).agg(agg)
+    out["Total Neto"] = out["Total Neto"].round().astype("int64")
+    return out
+
+
+def _save_nv_headers(headers: pd.DataFrame) -> None:
+    tmp = datasets.temp_path(NV_HEADERS_FILE)
+    headers.to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, NV_HEADERS_FILE)
+    datasets.invalidate(NV_HEADERS_FILE)
+    datasets.write_columnar(headers, "nv_headers", NV_HEADERS_FILE)
+
+
+def write_nv_headers(df: pd.DataFrame) -> pd.DataFrame:
+    """Materializa el índice de cabeceras a partir de las líneas de NV."""
+    headers = build_nv_headers(df)
+    _save_nv_headers(headers)
+    logger.info(f"Índice de cabeceras NV: {len(headers)} notas")
+    return headers
+
+
+def headers_fresh() -> bool:
+    """``nv_headers.csv`` existe y no es más antiguo que ``nv.csv``."""
+    return (
+        os.path.exists(NV_HEADERS_FILE)
+        and os.path.exists(NV_FILE)
+        and os.stat(NV_HEADERS_FILE).st_mtime_ns >= os.stat(NV_FILE).st_mtime_ns
+    )
+
+
+def patch_nv_headers(notas) -> pd.DataFrame:
+    """Rehace en el índice de cabeceras sólo las notas de ``notas``.
+
+    Para después de una importación con delta: el índice vigente debe
+    corresponder al ``nv.csv`` anterior (ver ``headers_fresh``). Las notas
+    que ya no tienen líneas salen del índice.
+    """
+    notas = {str(n) for n in notas}
+    old = datasets.load(NV_HEADERS_FILE)
+    lineas = datasets.load(NV_FILE, tipo="nv")
+    lineas = lineas[lineas["Num. Nota"].astype(str).isin(notas)]
+    headers = pd.concat(
+        [old[~old["Num. Nota"].astype(str).isin(notas)], build_nv_headers(lineas)],
+        ignore_index=True,
+    ).sort_values(["Num. Nota", "RUT"], kind="stable", ignore_index=True)
+    _save_nv_headers(headers)
+    logger.info(f"Índice de cabeceras NV: {len(notas)} notas actualizadas de {len(headers)}")
+    return headers
+
+
+def nv_headers() -> pd.DataFrame:
+    """Índice de cabeceras de NV; se reconstruye si ``nv.csv`` es más nuevo."""
+    if not os.path.exists(NV_FILE):
+        return pd.DataFrame(columns=NV_HEADER_COLS + ["Líneas", "Total Neto"])
+    if not headers_fresh():
+        return write_nv_headers(datasets.load(NV_FILE, tipo="nv"))
+    return datasets.load(NV_HEADERS_FILE)
+
+
+def nv_listing() -> ListingIndex:
+    """Índice de listado sobre las cabeceras de NV (se rearma al reimportar).
+
+    Las cabeceras sólo se cargan cuando cambia la versión de
+    ``nv_headers.csv``; antes se reconstruye el índice si ``nv.csv`` es más
+    nuevo, para tomar la versión ya actualizada.
+    """
+    if os.path.exists(NV_FILE) and not headers_fresh():
+        nv_headers()
+    return listing.cached_index(
+        "nv_headers",
+        datasets.version(NV_HEADERS_FILE),
+        lambda: ListingIndex(nv_headers(), search_cols=["Num. Nota", "RUT"], categorical=["Ciudad", "Razón Social"]),
+    )
+
+
+def page_nv_headers(
+    offset: int,
+    limit: int,
+    filters: dict[str, str] | None = None,
+    columns: list[str] | None = None,
+    sort: list[tuple[str, bool]] | None = None,
+) -> ListingPage:
+    """Página ``[offset, offset+limit)`` del índice, con filtros y orden opcionales.
+
+    ``filters`` mapea columna -> texto a buscar (sin distinguir mayúsculas ni
+    tildes).
+    """
+    return nv_listing().query(filters, sort, offset, limit, columns)
@@ -0,0 +1,167 @@
+"""Índice de un documento de escaneo y totales acumulados por código.
+
+``ScanLedger`` se arma una vez cuando se carga el documento (OC, NV,
+factura, inventario): guarda ``código normalizado -> línea`` y la cantidad
+esperada por código, y lleva los totales escaneados. Validar un escaneo,
+acumularlo y calcular lo que falta son búsquedas en diccionario.
+
+También lleva un resumen de la conciliación (unidades contadas, códigos
+contados, códigos con diferencia) que se ajusta en cada escaneo, y vistas
+paginadas por código (``view``) sin recorrer todo el documento.
+"""
+import re
+import threading
+from itertools import islice
+from typing import Callable, Iterable
+
+from services.indices import norm_code
+
+
+def to_qty(val) -> int:
+    """Convierte "1.000000" o "1,000000" a 1; valores raros -> 0."""
+    s = str(val).strip().replace(',', '.')
+    try:
+        return int(round(float(s)))
+    except (TypeError, ValueError):
+        m = re.search(r'\d+', s)
+        return int(m.group(0)) if m else 0
+
+
+VISTAS = ('todos', 'diferencias', 'sin_contar', 'contados')
+
+
+class ScanLedger:
+    def __init__(
+        self,
+        items: list[dict],
+        code_key: str,
+        qty_key: str | None = None,
+        normalize: Callable[[object], str] = norm_code,
+    ):
+        self.items = items
+        self.code_key = code_key
+        self.qty_key = qty_key
+        self.normalize = normalize
+        self.codes = [normalize(it.get(code_key, '')) for it in items]
+        self.qtys = [to_qty(it.get(qty_key, 0)) if qty_key else 0 for it in items]
+
+        self.index: dict[str, int] = {}      # código -> primera línea
+        self.expected: dict[str, int] = {}   # código -> cantidad del documento
+        for i, (code, qty) in enumerate(zip(self.codes, self.qtys)):
+            self.index.setdefault(code, i)
+            self.expected[code] = self.expected.get(code, 0) + qty
+
+        self.order = list(self.index)        # códigos en orden del documento
+        self.esperado = sum(self.expected.values())
+
+        self.totals: dict[str, int] = {}
+        self.diferencias: set[str] = set()   # contados con total != esperado
+        self._stats = {'contado': 0, 'contados': 0, 'neta': 0}
+        self.version = None  # versión del documento indexado
+        self.stamp = None    # marca de los escaneos ya reflejados en ``totals``
+        self._lock = threading.Lock()
+
+    def __contains__(self, codigo) -> bool:
+        return self.normalize(codigo) in self.index
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def line(self, codigo) -> dict | None:
+        i = self.index.get(self.normalize(codigo))
+        return None if i is None else self.items[i]
+
+    def _bump(self, code: str, old: int | None, new: int | None) -> None:
+        """Ajusta el resumen cuando el total de ``code`` pasa de ``old`` a ``new``."""
+        exp = self.expected.get(code)
+        if exp is None:
+            return  # código fuera del documento: no entra en la conciliación
+        st = self._stats
+        st['contado'] += (new or 0) - (old or 0)
+        st['contados'] += (new is not None) - (old is not None)
+        st['neta'] += (0 if new is None else new - exp) - (0 if old is None else old - exp)
+        if new is not None and new != exp:
+            self.diferencias.add(code)
+        else:
+            self.diferencias.discard(code)
+
+    def add(self, codigo, cantidad: int) -> int:
+        """Acumula ``cantidad`` y retorna el total escaneado del código."""
+        code = self.normalize(codigo)
+        with self._lock:
+            old = self.totals.get(code)
+            total = self.totals[code] = (old or 0) + int(cantidad)
+            self._bump(code, old, total)
+        return total
+
+    def remove(self, codigo) -> None:
+        code = self.normalize(codigo)
+        with self._lock:
+            self._bump(code, self.totals.pop(code, None), None)
+
+    def reset(self, scans: Iterable[tuple[object, int]] = (), stamp=None) -> None:
+        """Recalcula los totales desde pares ``(codigo, cantidad)``."""
+        totals: dict[str, int] = {}
+        for codigo, cantidad in scans:
+            code = self.normalize(codigo)
+            totals[code] = totals.get(code, 0) + int(cantidad or 0)
+        with self._lock:
+            self.totals = {}
+            self.diferencias = set()
+            self._stats = {'contado': 0, 'contados': 0, 'neta': 0}
+            for code, total in totals.items():
+                self.totals[code] = total
+                self._bump(code, None, total)
+            self.stamp = stamp
+
+    def scanned(self, codigo) -> int:
+        return self.totals.get(self.normalize(codigo), 0)
+
+    def count(self, codigo) -> int | None:
+        """Total escaneado o None si el código no se ha escaneado."""
+        return self.totals.get(self.normalize(codigo))
+
+    def expected_qty(self, codigo) -> int:
+        return self.expected.get(self.normalize(codigo), 0)
+
+    def faltan(self, codigo) -> int:
+        code = self.normalize(codigo)
+        return max(self.expected.get(code, 0) - self.totals.get(code, 0), 0)
+
+    def summary(self) -> dict:
+        """Totales de la conciliación, sin recorrer el documento."""
+        with self._lock:
+            st = dict(self._stats)
+            st['con_diferencia'] = len(self.diferencias)
+        st['codigos'] = len(self.order)
+        st['esperado'] = self.esperado
+        st['sin_contar'] = st['codigos'] - st['contados']
+        return st
+
+    def view(self, vista: str = 'todos', offset: int = 0, limit: int | None = 50):
+        """Página de la conciliación por código: ``(filas, total)``.
+
+        Cada fila es ``(primera_línea, esperado, contado)``, con ``contado``
+        None si el código no se ha escaneado. Las vistas son las de
+        ``VISTAS``; sólo se ordenan o recorren los códigos de la vista.
+        """
+        end = None if limit is None else offset + limit
+        with self._lock:
+            if vista == 'diferencias':
+                codes = sorted(self.diferencias, key=self.index.__getitem__)
+                total, page = len(codes), codes[offset:end]
+            elif vista == 'contados':
+                codes = sorted((c for c in self.totals if c in self.index), key=self.index.__getitem__)
+                total, page = len(codes), codes[offset:end]
+            elif vista == 'sin_contar':
+                total = len(self.order) - self._stats['contados']
+                page = list(islice((c for c in self.order if c not in self.totals), offset, end))
+            else:
+                total, page = len(self.order), self.order[offset:end]
+            rows = [(self.items[self.index[c]], self.expected[c], self.totals.get(c)) for c in page]
+        return rows, total
+
+    def rows(self):
+        """``(item, cantidad_línea, escaneado_código)`` en el orden del documento."""
+        for item, code, qty in zip(self.items, self.codes, self.qtys):
+            yield item, qty, self.totals.get(code, 0)
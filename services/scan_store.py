@@ -0,0 +1,215 @@
+"""Estado de los flujos de escaneo guardado en el servidor.
+
+La cookie de sesión sólo lleva un identificador (``sid``); el documento
+cargado y los escaneos viven en la base de la aplicación (``models``). Cada
+escaneo actualiza una sola fila de ``ScanItem``, así que el tamaño del
+request no depende del tamaño del documento.
+
+Las líneas del documento se decodifican una vez por ``version`` y quedan en
+una caché del proceso; quien las recibe no debe mutarlas. Lo mismo para el
+``ScanLedger`` del documento, cuyos totales se mantienen al día con cada
+escaneo y se recalculan desde la base sólo si otro proceso escribió.
+"""
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from models import db, ScanSesion, ScanItem
+from services.cache import LRUCache
+from services.indices import norm_code
+from services.scan_ledger import ScanLedger
+
+_ITEMS = LRUCache(
+    max_items=256,
+    max_bytes=int(os.getenv("SCAN_CACHE_MB", "64")) * 1024 * 1024,
+    sizeof=lambda v: v[1],
+)
+_LEDGERS = LRUCache(max_items=256)
+
+
+def new_sid() -> str:
+    return uuid.uuid4().hex
+
+
+def _version(s: ScanSesion | None = None) -> int:
+    """Versión nueva para ``s``, única también entre filas: los ids de SQLite
+    se reutilizan después de ``purge`` y las cachés se indexan por ``(id, version)``."""
+    return max((s.version or 0) + 1 if s is not None else 0, time.time_ns() // 1000)
+
+
+def _sesion(sid: str, flujo: str, create: bool = False) -> ScanSesion | None:
+    s = ScanSesion.query.filter_by(sid=sid, flujo=flujo).first()
+    if s is None and create:
+        s = ScanSesion(sid=sid, flujo=flujo, numero="", guia="", items_json="[]", version=_version())
+        db.session.add(s)
+        db.session.flush()
+    return s
+
+
+def _items(s: ScanSesion) -> list[dict]:
+    key = (s.id, s.version)
+    entry = _ITEMS.get(key)
+    if entry is None:
+        entry = (json.loads(s.items_json or "[]"), len(s.items_json or ""))
+        _ITEMS.put(key, entry)
+    return entry[0]
+
+
+def documento(sid: str, flujo: str) -> tuple[str, str, list[dict]]:
+    """``(numero, guia, items)`` del flujo; vacío si no hay nada cargado."""
+    s = _sesion(sid, flujo)
+    if s is None:
+        return "", "", []
+    return s.numero, s.guia, _items(s)
+
+
+def ledger(sid: str, flujo: str, code_key: str, qty_key: str | None = None,
+           normalize=norm_code) -> ScanLedger:
+    """Índice y totales escaneados del documento cargado en el flujo."""
+    s = _sesion(sid, flujo)
+    if s is None:
+        return ScanLedger([], code_key, qty_key, normalize)
+    led = _LEDGERS.get(s.id)
+    if (led is None or led.version != s.version or led.code_key != code_key
+            or led.qty_key != qty_key or led.normalize is not normalize):
+        led = ScanLedger(_items(s), code_key, qty_key, normalize)
+        led.version = s.version
+        _LEDGERS.put(s.id, led)
+    if led.stamp != s.updated_at:
+        rows = (
+            db.session.query(ScanItem.codigo, db.func.sum(ScanItem.cantidad))
+            .filter(ScanItem.sesion_id == s.id)
+            .group_by(ScanItem.codigo)
+            .all()
+        )
+        led.reset(rows, stamp=s.updated_at)
+    return led
+
+
+def _touch(s: ScanSesion, apply) -> None:
+    """Marca actividad en ``s`` y aplica el cambio al ledger si estaba al día."""
+    led = _LEDGERS.get(s.id)
+    stamp, s.updated_at = s.updated_at, datetime.utcnow()
+    db.session.commit()
+    if led is not None and led.version == s.version and led.stamp == stamp:
+        apply(led)
+        led.stamp = s.updated_at
+
+
+def set_documento(sid: str, flujo: str, numero: str, items=(), guia: str = "") -> None:
+    """Reemplaza el documento del flujo y descarta sus escaneos."""
+    s = _sesion(sid, flujo, create=True)
+    s.numero = numero or ""
+    s.guia = guia or ""
+    s.items_json = json.dumps(list(items), ensure_ascii=False, default=str)
+    s.version = _version(s)
+    ScanItem.query.filter_by(sesion_id=s.id).delete()
+    db.session.commit()
+
+
+def set_guia(sid: str, flujo: str, guia: str) -> None:
+    s = _sesion(sid, flujo, create=True)
+    s.guia = guia or ""
+    db.session.commit()
+
+
+def add_scan(sid: str, flujo: str, codigo: str, cantidad: int, guia: str = "") -> tuple[int, bool]:
+    """Suma ``cantidad`` al código; retorna ``(total, es_nuevo)``."""
+    return add_scans(sid, flujo, [(guia, codigo, cantidad)])[(guia or "", codigo)]
+
+
+def add_scans(sid: str, flujo: str, entradas) -> dict[tuple[str, str], tuple[int, bool]]:
+    """Registra un lote de ``(guia, codigo, cantidad)`` en una sola transacción.
+
+    Retorna ``{(guia, codigo): (total, es_nuevo)}`` por cada par del lote.
+    """
+    lote: dict[tuple[str, str], int] = {}
+    for guia, codigo, cantidad in entradas:
+        key = (guia or "", codigo)
+        lote[key] = lote.get(key, 0) + int(cantidad)
+    if not lote:
+        return {}
+
+    s = _sesion(sid, flujo, create=True)
+    codigos = {codigo for _guia, codigo in lote}
+    existentes = {
+        (it.guia, it.codigo): it
+        for it in ScanItem.query.filter(ScanItem.sesion_id == s.id, ScanItem.codigo.in_(codigos))
+    }
+    ahora = datetime.now()
+    out = {}
+    for key, cantidad in lote.items():
+        item = existentes.get(key)
+        if item is None:
+            item = ScanItem(sesion_id=s.id, guia=key[0], codigo=key[1], cantidad=0)
+            db.session.add(item)
+        item.cantidad += cantidad
+        item.scanned_at = ahora
+        out[key] = (item.cantidad, key not in existentes)
+
+    def _apply(led):
+        for (_guia, codigo), cantidad in lote.items():
+            led.add(codigo, cantidad)
+
+    _touch(s, _apply)
+    return out
+
+
+def remove_scan(sid: str, flujo: str, codigo: str) -> int:
+    """Elimina los escaneos de ``codigo`` (en todas las guías)."""
+    s = _sesion(sid, flujo)
+    if s is None:
+        return 0
+    n = ScanItem.query.filter_by(sesion_id=s.id, codigo=codigo).delete()
+    _touch(s, lambda led: led.remove(codigo))
+    return n
+
+
+def scans(sid: str, flujo: str, ultimos: int | None = None) -> list[dict]:
+    """Escaneos del flujo en orden de registro (o los ``ultimos`` más recientes)."""
+    s = _sesion(sid, flujo)
+    if s is None:
+        return []
+    q = ScanItem.query.filter_by(sesion_id=s.id)
+    if ultimos:
+        rows = q.order_by(ScanItem.scanned_at.desc()).limit(ultimos).all()
+    else:
+        rows = q.order_by(ScanItem.id).all()
+    return [
+        {
+            "guia": r.guia,
+            "codigo": r.codigo,
+            "cantidad": r.cantidad,
+            "hora": r.scanned_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        for r in rows
+    ]
+
+
+def clear(sid: str, flujo: str, documento: bool = True) -> None:
+    """Borra los escaneos del flujo y, si ``documento``, también el documento."""
+    s = _sesion(sid, flujo)
+    if s is None:
+        return
+    ScanItem.query.filter_by(sesion_id=s.id).delete()
+    if documento:
+        db.session.delete(s)
+        _LEDGERS.pop(s.id)
+    else:
+        s.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def purge(max_age_hours: float = 72) -> int:
+    """Elimina los flujos sin actividad en las últimas ``max_age_hours``."""
+    limite = datetime.utcnow() - timedelta(hours=max_age_hours)
+    ids = [s.id for s in ScanSesion.query.filter(ScanSesion.updated_at < limite).all()]
+    if ids:
+        ScanItem.query.filter(ScanItem.sesion_id.in_(ids)).delete(synchronize_session=False)
+        ScanSesion.query.filter(ScanSesion.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        for i in ids:
+            _LEDGERS.pop(i)
+    return len(ids)
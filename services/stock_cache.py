@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable
+
+import pandas as pd
+
+from services.cache import LRUCache
+from services.indices import code_map, norm_code
+
+logger = logging.getLogger(__name__)
+
+
+class StockCache:
+    """Snapshot del stock en memoria, compartido por todo el proceso.
+
+    Guarda un diccionario ``codigo -> {'Nombre', 'Cantidad'}`` para que las
+    vistas resuelvan cada código en O(1) sin volver a recorrer
+    ``STOCK_DB JOIN ART_DB`` en cada request. Cuando el snapshot vence se
+    sigue sirviendo el anterior mientras un hilo en segundo plano lo recarga.
+
+    Si se entrega ``loader_codigos`` la caché se llena de forma incremental:
+    ``get_many`` sólo consulta los códigos que faltan o vencieron. Esas
+    entradas van aparte del snapshot, en una ``LRUCache`` de a lo más
+    ``max_codigos`` códigos (``STOCK_CACHE_CODIGOS``), y cada recarga completa
+    las descarta.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], pd.DataFrame],
+        ttl: float = 60,
+        loader_codigos: Callable[[list[str]], pd.DataFrame] | None = None,
+        max_codigos: int = int(os.getenv('STOCK_CACHE_CODIGOS', '20000')),
+    ):
+        self._loader = loader
+        self._loader_codigos = loader_codigos
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._data: dict[str, dict | None] = {}
+        # codigo -> (fila o None si no existe, marca de carga)
+        self._codigos = LRUCache(max_items=max_codigos)
+        self._loaded_at: float | None = None
+        self._refreshing = False
+        self._pending: set[str] = set()
+        self._gen = 0  # sube con cada invalidate; descarta recargas ya lanzadas
+
+    @staticmethod
+    def _rows(df: pd.DataFrame) -> dict[str, dict]:
+        if df is None or df.empty:
+            return {}
+        df = pd.DataFrame({
+            'codigo': df['codigo'],
+            'Nombre': df['nombre'].fillna('').astype(str).str.strip(),
+            'Cantidad': pd.to_numeric(df['cantidad'], errors='coerce').fillna(0).astype(int),
+        })
+        return code_map(df, 'codigo', {'Nombre': 'Nombre', 'Cantidad': 'Cantidad'})
+
+    def refresh(self) -> None:
+        """Recarga el snapshot completo de forma síncrona."""
+        gen = self._gen
+        data = self._rows(self._loader())
+        with self._lock:
+            if gen != self._gen:
+                return  # se invalidó mientras se cargaba
+            self._data = data
+            self._codigos.clear()
+            self._loaded_at = time.monotonic()
+
+    def refresh_codigos(self, codigos: Iterable[str]) -> None:
+        """Recarga sólo los códigos indicados.
+
+        Los códigos que no vienen en la respuesta quedan registrados como
+        ausentes para no volver a consultarlos hasta que venzan.
+        """
+        codigos = [norm_code(c) for c in codigos]
+        if not codigos:
+            return
+        gen = self._gen
+        found = self._rows(self._loader_codigos(codigos))
+        now = time.monotonic()
+        with self._lock:
+            if gen != self._gen:
+                return  # se invalidó mientras se cargaba
+            for c in codigos:
+                self._codigos.put(c, (found.get(c), now))
+
+    def _refresh_worker(self, codigos: list[str] | None) -> None:
+        try:
+            if codigos is None:
+                self.refresh()
+            else:
+                self.refresh_codigos(codigos)
+        except Exception as e:
+            logger.error(f"Error al refrescar caché de stock: {e}")
+        finally:
+            with self._lock:
+                if codigos is None:
+                    self._refreshing = False
+                else:
+                    self._pending.difference_update(codigos)
+
+    def _refresh_background(self, codigos: list[str] | None = None) -> None:
+        with self._lock:
+            if codigos is None:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            else:
+                codigos = [c for c in codigos if c not in self._pending]
+                if not codigos:
+                    return
+                self._pending.update(codigos)
+        threading.Thread(
+            target=self._refresh_worker, args=(codigos,), name='stock-cache', daemon=True
+        ).start()
+
+    def _expired(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl
+
+    def _entry(self, codigo: str) -> tuple[dict | None, float] | None:
+        """``(fila, marca)`` más reciente del código, o None si no se conoce."""
+        entry = self._codigos.get(codigo)
+        loaded_at = self._loaded_at
+        if loaded_at is not None and codigo in self._data and (entry is None or entry[1] < loaded_at):
+            return self._data[codigo], loaded_at
+        return entry
+
+    def snapshot(self) -> dict[str, dict | None]:
+        """Devuelve el mapa de stock vigente.
+
+        La primera carga es síncrona; después, si el snapshot venció, se
+        dispara un refresco en segundo plano y se responde con el actual.
+        """
+        if self._loaded_at is None:
+            self.refresh()
+        elif self._expired():
+            self._refresh_background()
+        return self._data
+
+    def get_many(self, codigos: Iterable[str]) -> dict[str, dict]:
+        """Stock de los códigos pedidos, consultando sólo lo necesario.
+
+        Los códigos desconocidos se traen en una sola consulta síncrona; los
+        que ya están en memoria pero vencieron se responden igual y se
+        refrescan en segundo plano.
+        """
+        keys = list(dict.fromkeys(norm_code(c) for c in codigos))
+        if self._loader_codigos is None:
+            data = self.snapshot()
+            return {k: data[k] for k in keys if data.get(k)}
+
+        now = time.monotonic()
+        entries = {k: self._entry(k) for k in keys}
+        missing = [k for k, e in entries.items() if e is None]
+        stale = [k for k, e in entries.items() if e is not None and now - e[1] > self._ttl]
+        if missing:
+            self.refresh_codigos(missing)
+            entries.update((k, self._entry(k)) for k in missing)
+        if stale:
+            self._refresh_background(stale)
+        return {k: e[0] for k, e in entries.items() if e is not None and e[0]}
+
+    def get(self, codigo: str) -> dict | None:
+        return self.get_many([codigo]).get(norm_code(codigo))
+
+    def invalidate(self) -> None:
+        """Descarta todo el stock en memoria.
+
+        La siguiente lectura vuelve a consultar de forma síncrona (no se
+        responde con cantidades anteriores a la invalidación), y las recargas
+        en segundo plano que ya estaban en curso no escriben su resultado.
+        """
+        with self._lock:
+            self._gen += 1
+            self._data = {}
+            self._codigos.clear()
+            self._loaded_at = None
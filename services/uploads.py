@@ -0,0 +1,191 @@
+"""Almacén por contenido de los archivos subidos en ``/importar``.
+
+Cada archivo se guarda una sola vez en ``uploads/<tipo>/objetos/<sha256>.<ext>``
+aunque se suba muchas veces; ``uploads/<tipo>/index.json`` registra los
+nombres con que llegó y cuándo se subió por primera y última vez. Se
+conservan los ``UPLOAD_RETENTION`` contenidos subidos más recientemente
+(según el orden de subida), sin borrar los que todavía espera una
+importación en curso (``en_uso``). El índice se actualiza bajo
+``locks.file_lock``, así que los workers de gunicorn no se pisan.
+
+``compact`` pasa al almacén las copias antiguas ``<tipo>_<fecha>_<nombre>``
+que dejaba ``/importar``, borrando las repetidas.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+from services import locks
+
+logger = logging.getLogger(__name__)
+
+RETENTION = int(os.getenv("UPLOAD_RETENTION", "10"))
+BLOCK = 1024 * 1024
+
+_LEGACY = re.compile(r"^[a-z]+_\d{8}_\d{6}_(?P<nombre>.+)$")
+
+
+class Upload(NamedTuple):
+    sha256: str
+    path: str
+    nombre: str
+    nuevo: bool  # el contenido no estaba en el almacén
+
+
+def _index_path(tipo_dir: str) -> str:
+    return os.path.join(tipo_dir, "index.json")
+
+
+def _objects_dir(tipo_dir: str) -> str:
+    return os.path.join(tipo_dir, "objetos")
+
+
+def read_index(tipo_dir: str) -> dict:
+    try:
+        with open(_index_path(tipo_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"objetos": {}}
+
+
+def _write_index(tipo_dir: str, index: dict) -> None:
+    tmp = _index_path(tipo_dir) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, _index_path(tipo_dir))
+
+
+def _ext(nombre: str) -> str:
+    return nombre.rsplit(".", 1)[-1].lower() if "." in nombre else "bin"
+
+
+def _register(index: dict, sha: str, nombre: str, size: int, cuando: str) -> bool:
+    """Anota ``nombre`` para el contenido ``sha``; True si el contenido es nuevo."""
+    objetos = index["objetos"]
+    index["secuencia"] = orden = index.get("secuencia", 0) + 1
+    entry = objetos.get(sha)
+    if entry is None:
+        objetos[sha] = {
+            "archivo": f"{sha}.{_ext(nombre)}",
+            "nombres": [nombre],
+            "bytes": size,
+            "primera": cuando,
+            "ultima": cuando,
+            "subidas": 1,
+            "orden": orden,
+        }
+        return True
+    if nombre not in entry["nombres"]:
+        entry["nombres"].append(nombre)
+    entry["ultima"] = max(entry["ultima"], cuando)
+    entry["subidas"] += 1
+    entry["orden"] = orden
+    return False
+
+
+def _retain(tipo_dir: str, index: dict, keep: int, en_uso: Iterable[str] = ()) -> int:
+    """Borra los contenidos más antiguos fuera de los ``keep`` recientes.
+
+    Los de ``en_uso`` (sha256 que una importación aún va a leer) se conservan.
+    """
+    objetos = index["objetos"]
+    en_uso = set(en_uso)
+    viejos = [
+        s for s in sorted(objetos, key=lambda s: objetos[s]["orden"], reverse=True)[keep:]
+        if s not in en_uso
+    ]
+    for sha in viejos:
+        try:
+            os.remove(os.path.join(_objects_dir(tipo_dir), objetos[sha]["archivo"]))
+        except FileNotFoundError:
+            pass
+        del objetos[sha]
+    return len(viejos)
+
+
+def store(stream, tipo_dir: str, nombre: str, keep: int = RETENTION,
+          en_uso: Iterable[str] = ()) -> Upload:
+    """Guarda ``stream`` en el almacén calculando el hash mientras se escribe."""
+    objetos_dir = _objects_dir(tipo_dir)
+    os.makedirs(objetos_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    tmp = os.path.join(objetos_dir, f".subida_{os.getpid()}_{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as out:
+        while True:
+            block = stream.read(BLOCK)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+            size += len(block)
+    sha = digest.hexdigest()
+
+    with locks.file_lock(_index_path(tipo_dir)):
+        index = read_index(tipo_dir)
+        nuevo = _register(index, sha, nombre, size, datetime.now().isoformat(timespec="seconds"))
+        path = os.path.join(objetos_dir, index["objetos"][sha]["archivo"])
+        if nuevo or not os.path.exists(path):
+            os.replace(tmp, path)
+        else:
+            os.remove(tmp)
+        _retain(tipo_dir, index, keep, en_uso)
+        _write_index(tipo_dir, index)
+    return Upload(sha, path, nombre, nuevo)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compact(tipo_dir: str, keep: int = RETENTION, en_uso: Iterable[str] = ()) -> dict:
+    """Mueve las copias sueltas al almacén, elimina repetidos y aplica retención.
+
+    Sin copias sueltas no hace nada (la retención ya se aplica en ``store``).
+    Recorre y hashea todas las copias: se llama desde la importación en
+    segundo plano, no desde el request.
+    """
+    sueltos = [
+        n for n in sorted(os.listdir(tipo_dir) if os.path.isdir(tipo_dir) else [])
+        if _LEGACY.match(n) and os.path.isfile(os.path.join(tipo_dir, n))
+    ]
+    if not sueltos:
+        return {"archivos": 0, "repetidos": 0, "eliminados": 0, "bytes_liberados": 0}
+    repetidos = liberados = 0
+    with locks.file_lock(_index_path(tipo_dir)):
+        index = read_index(tipo_dir)
+        os.makedirs(_objects_dir(tipo_dir), exist_ok=True)
+        for n in sueltos:
+            path = os.path.join(tipo_dir, n)
+            if not os.path.isfile(path):
+                continue  # otro worker ya lo compactó
+            st = os.stat(path)
+            cuando = datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds")
+            sha = _sha256(path)
+            nuevo = _register(index, sha, _LEGACY.match(n)["nombre"], st.st_size, cuando)
+            destino = os.path.join(_objects_dir(tipo_dir), index["objetos"][sha]["archivo"])
+            if nuevo or not os.path.exists(destino):
+                os.replace(path, destino)
+            else:
+                os.remove(path)
+                repetidos += 1
+                liberados += st.st_size
+        antes = {s: e["bytes"] for s, e in index["objetos"].items()}
+        eliminados = _retain(tipo_dir, index, keep, en_uso)
+        liberados += sum(b for s, b in antes.items() if s not in index["objetos"])
+        _write_index(tipo_dir, index)
+    logger.info(
+        f"Compactado {tipo_dir}: {len(sueltos)} archivos, {repetidos} repetidos, "
+        f"{eliminados} fuera de retención"
+    )
+    return {"archivos": len(sueltos), "repetidos": repetidos,
+            "eliminados": eliminados, "bytes_liberados": liberados}
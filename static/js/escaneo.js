@@ -0,0 +1,146 @@
+/*
+ * Escaneo sin recargar la página.
+ *
+ * Un formulario con ``data-api`` se envía como JSON a
+ * ``/api/<flujo>/escaneos`` y con la respuesta se actualizan sólo las filas
+ * del código escaneado (Escaneado, Faltan, stock restante, fila de la guía)
+ * y el resumen. Si la API falla, el formulario se envía de la forma normal.
+ *
+ * Marcas que usa en la plantilla:
+ *   tbody[data-escaneo="documento"][data-clases="nada parcial completo"]
+ *     tr[data-codigo][data-cant] > td[data-campo="escaneado|faltan"]
+ *   tbody[data-escaneo="stock"]      tr[data-codigo] > td[data-campo="stock"]
+ *   tbody[data-escaneo="escaneos"]   tr[data-clave="guia|codigo"]
+ *   [data-escaneo="resumen"]         [data-campo="contado|esperado|..."]
+ *   [data-escaneo="mensaje"]         aviso cuando no hay showToast()
+ */
+(function () {
+  function celda(tr, campo, valor) {
+    const td = tr.querySelector('[data-campo="' + campo + '"]');
+    if (td) td.textContent = valor;
+  }
+
+  function filas(tipo, atributo, valor) {
+    const sel = '[data-escaneo="' + tipo + '"] tr[' + atributo + '="' + CSS.escape(valor) + '"]';
+    return document.querySelectorAll(sel);
+  }
+
+  function patchLineas(lineas) {
+    lineas.forEach(function (l) {
+      filas('documento', 'data-codigo', l.clave).forEach(function (tr) {
+        const cant = parseInt(tr.dataset.cant, 10) || 0;
+        const faltan = Math.max(cant - l.escaneado, 0);
+        celda(tr, 'escaneado', l.escaneado);
+        celda(tr, 'faltan', faltan);
+        const clases = (tr.parentNode.dataset.clases || '').split(' ');
+        if (clases.length === 3) {
+          const estado = faltan === 0 ? 2 : (l.escaneado === 0 ? 0 : 1);
+          clases.forEach(function (c) { tr.classList.remove(c); });
+          tr.classList.add(clases[estado]);
+        }
+      });
+      if (l.stock !== undefined) {
+        filas('stock', 'data-codigo', l.clave).forEach(function (tr) {
+          celda(tr, 'stock', l.stock);
+        });
+      }
+    });
+  }
+
+  function patchEscaneos(escaneos) {
+    const tbody = document.querySelector('[data-escaneo="escaneos"]');
+    if (!tbody) return;
+    escaneos.forEach(function (e) {
+      const clave = e.guia + '|' + e.codigo;
+      let tr = tbody.querySelector('tr[data-clave="' + CSS.escape(clave) + '"]');
+      if (!tr) {
+        tr = document.createElement('tr');
+        tr.dataset.clave = clave;
+        ['guia', 'codigo', 'cantidad', 'hora'].forEach(function (campo) {
+          const td = document.createElement('td');
+          td.dataset.campo = campo;
+          tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+      }
+      ['guia', 'codigo', 'cantidad', 'hora'].forEach(function (campo) {
+        celda(tr, campo, e[campo]);
+      });
+    });
+  }
+
+  function patchResumen(resumen) {
+    document.querySelectorAll('[data-escaneo="resumen"] [data-campo]').forEach(function (el) {
+      if (resumen[el.dataset.campo] !== undefined) el.textContent = resumen[el.dataset.campo];
+    });
+  }
+
+  function mensaje(texto, categoria) {
+    if (typeof window.showToast === 'function') {
+      window.showToast(texto);
+      return;
+    }
+    const el = document.querySelector('[data-escaneo="mensaje"]');
+    if (!el) return;
+    el.className = 'flash-message flash-' + categoria;
+    el.textContent = texto;
+  }
+
+  function texto(res, documento) {
+    if (res.estado === 'ok') {
+      return res.cantidad + ' unidad(es) de ' + res.codigo + ' registradas. Faltan ' + res.faltan + '.';
+    }
+    if (res.estado === 'no_encontrado') {
+      return 'El código ' + res.codigo + ' no pertenece al documento ' + documento + '.';
+    }
+    return 'Escaneo inválido: ' + (res.codigo || '(vacío)') + '.';
+  }
+
+  document.querySelectorAll('form[data-api]').forEach(function (form) {
+    let enviando = false;
+    form.addEventListener('submit', function (ev) {
+      if (!window.fetch || !window.CSS || !CSS.escape) return;
+      ev.preventDefault();
+      if (enviando) return;
+
+      const datos = new FormData(form);
+      const codigo = (datos.get('codigo') || '').trim();
+      if (!codigo) return;
+      const escaneo = {codigo: codigo, cantidad: parseInt(datos.get('cantidad'), 10) || 1};
+      if (datos.get('guia')) escaneo.guia = datos.get('guia').trim();
+
+      enviando = true;
+      fetch(form.dataset.api, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+        body: JSON.stringify({escaneos: [escaneo]})
+      })
+        .then(function (resp) {
+          if (!resp.ok) throw new Error('HTTP ' + resp.status);
+          return resp.json();
+        })
+        .then(function (data) {
+          patchLineas(data.lineas || []);
+          patchEscaneos(data.escaneos || []);
+          patchResumen(data.resumen || {});
+          const res = data.resultados[0];
+          mensaje(texto(res, data.documento), res.estado === 'ok' ? 'success' : 'warning');
+          const input = form.querySelector('[name="codigo"]');
+          if (input) {
+            input.value = '';
+            input.focus();
+          }
+        }, function () {
+          // Sin API: envío normal con recarga (el código pudo haberse limpiado).
+          // Sólo ante fallas del request, para no registrar dos veces.
+          const input = form.querySelector('[name="codigo"]');
+          if (input) input.value = codigo;
+          form.submit();
+        })
+        .finally(function () {
+          enviando = false;
+        });
+    });
+  });
+})();
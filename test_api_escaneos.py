@@ -0,0 +1,104 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(__file__))
+from auth_map import ROL_JEFE
+from services import scan_store
+
+app_module = None
+
+
+@pytest.fixture(autouse=True)
+def _app(tmp_path, monkeypatch):
+    """La app sobre una base temporal: no toca ``data/app.db`` ni ``data/inv_sesiones.csv``."""
+    global app_module
+    monkeypatch.setenv('APP_DATABASE_URL', f"sqlite:///{tmp_path / 'app.db'}")
+    import app
+    app_module = importlib.reload(app)
+    monkeypatch.setattr(app_module, 'INV_SESIONES_FILE', str(tmp_path / 'inv_sesiones.csv'))
+    with app_module.app.app_context():
+        app_module.init_db()
+    yield
+    with app_module.app.app_context():
+        app_module.orm.engine.dispose()
+
+
+def _client(documento=None, items=(), login=True):
+    app_module.app.config['TESTING'] = True
+    client = app_module.app.test_client()
+    sid = scan_store.new_sid()
+    if documento:
+        with app_module.app.app_context():
+            scan_store.set_documento(sid, 'ingreso', documento, list(items), 'G1')
+    with client.session_transaction() as s:
+        s['scan_sid'] = sid
+        if login:
+            s['current_user'] = {'usuario': 'BODEGA', 'rol': ROL_JEFE}
+    return client
+
+
+def test_sin_sesion_401():
+    resp = _client(login=False).post('/api/ingreso/escaneos', json=[{'codigo': 'A1'}])
+    assert resp.status_code == 401
+
+
+def test_flujo_desconocido_404():
+    assert _client().post('/api/nada/escaneos', json=[]).status_code == 404
+
+
+def test_sin_documento_409():
+    resp = _client().post('/api/ingreso/escaneos', json=[{'codigo': 'A1'}])
+    assert resp.status_code == 409
+
+
+def test_lote_demasiado_grande_413(monkeypatch):
+    monkeypatch.setattr(app_module, 'SCAN_BATCH_MAX', 2)
+    resp = _client('100', [{'codigo': 'A1', 'cantidad': 3}]).post(
+        '/api/ingreso/escaneos', json={'escaneos': [{'codigo': 'A1'}] * 3})
+    assert resp.status_code == 413
+
+
+def test_lote_mixto():
+    items = [{'codigo': 'A1', 'nombre': 'a', 'cantidad': 3},
+             {'codigo': 'B2', 'nombre': 'b', 'cantidad': 1}]
+    client = _client('100', items)
+    resp = client.post('/api/ingreso/escaneos', json={'escaneos': [
+        {'codigo': 'A1', 'cantidad': 2},
+        {'codigo': 'ZZ9', 'cantidad': 1},
+        {'codigo': '', 'cantidad': 1},
+        {'codigo': 'B2', 'cantidad': 'x'},
+        {'codigo': 'A1', 'guia': 'G2'},
+    ]})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['documento'] == '100'
+    assert [r['estado'] for r in data['resultados']] == ['ok', 'no_encontrado', 'invalido', 'invalido', 'ok']
+    assert (data['aceptados'], data['rechazados']) == (2, 3)
+    assert data['resultados'][0]['total'] == 3 and data['resultados'][0]['faltan'] == 0
+    assert data['lineas'] == [{'clave': 'A1', 'escaneado': 3, 'faltan': 0}]
+    assert sorted((e['guia'], e['codigo'], e['cantidad']) for e in data['escaneos']) == [
+        ('G1', 'A1', 2), ('G2', 'A1', 1)]
+
+    # El lote siguiente parte de los totales ya grabados
+    data = client.post('/api/ingreso/escaneos', json=[{'codigo': 'B2'}]).get_json()
+    assert data['lineas'] == [{'clave': 'B2', 'escaneado': 1, 'faltan': 0}]
+    assert data['escaneos'] == [dict(data['escaneos'][0], guia='G2', codigo='B2', cantidad=1)]
+
+
+def test_exportar_inventario_sin_contar_es_cero():
+    from services import inventarios
+
+    with app_module.app.app_context():
+        inv_id = inventarios.crear_sesion('JEFE').id
+        inventarios.cargar_esperado(inv_id, [{'Código': 'A', 'Nombre': 'a', 'Cantidad': 4},
+                                             {'Código': 'B', 'Nombre': 'b', 'Cantidad': 2}])
+        inventarios.registrar(inv_id, 'A', 3)
+    client = _client()
+    with client.session_transaction() as s:
+        s['inv_sesion_id'] = inv_id
+    resp = client.post('/inventario', data={'action': 'export_inv', 'vista': 'todos'})
+    lineas = resp.get_data().decode('utf-8-sig').splitlines()
+    assert lineas[1:] == ['A,a,4,3,-1', 'B,b,2,0,-2']
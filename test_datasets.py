@@ -0,0 +1,231 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+from services import datasets
+from services.cache import LRUCache
+
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8-sig') as f:
+        f.write(text)
+
+
+def test_read_csv_cachea_y_detecta_cambios(tmp_path, monkeypatch):
+    path = tmp_path / 'stock.csv'
+    _write(path, ' Código ,Cantidad,Unnamed: 2\n1,5,\n')
+
+    calls = []
+    real = datasets.pd.read_csv
+    monkeypatch.setattr(datasets.pd, 'read_csv', lambda *a, **k: calls.append(1) or real(*a, **k))
+
+    df = datasets.read_csv(str(path), dtype=str)
+    assert list(df.columns) == ['Código', 'Cantidad']
+    df['Cantidad'] = '99'  # la copia se puede mutar sin tocar la caché
+    assert datasets.read_csv(str(path), dtype=str)['Cantidad'].tolist() == ['5']
+    assert len(calls) == 1
+
+    _write(path, 'Código,Cantidad\n1,5\n2,7\n')
+    assert len(datasets.read_csv(str(path), dtype=str)) == 2
+    assert len(calls) == 2
+
+    datasets.invalidate(str(path))
+    datasets.read_csv(str(path), dtype=str)
+    assert len(calls) == 3
+
+
+def test_lru_respeta_presupuesto_de_bytes():
+    cache = LRUCache(max_items=10, max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    cache.get('a')
+    cache.put('c', 'xxxx')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'xxxx'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_importar_por_bloques(tmp_path):
+    from services import importer
+
+    src = tmp_path / 'stock_subido.csv'
+    with open(src, 'w', encoding='latin-1') as f:
+        f.write('Reporte de stock,,,,,\n,,,,,\n')
+        f.write('Ciudad,Bodega,Codigo,Nombre,Cantidad,\n')
+        for i in range(25):
+            f.write(f'SCL,  B1 ,A{i:03d} ,Producto {i},{i},\n')
+    dest = tmp_path / 'stock.csv'
+
+    res = importer.import_file(str(src), 'stock', str(dest), chunk_rows=10)
+    assert res.filas == 25 and res.header_row == 2
+    assert res.filas_por_seg > 0
+    assert not os.path.exists(str(dest) + '.tmp')
+
+    df = datasets.read_csv(str(dest), dtype=str, keep_default_na=False)
+    assert list(df.columns) == ['Ciudad', 'Bodega', 'Codigo', 'Nombre', 'Cantidad']
+    assert df.loc[3, 'Bodega'] == 'B1' and df.loc[3, 'Codigo'] == 'A003'
+    assert datasets.read_manifest(str(dest))['rows'] == 25
+    if datasets.feather is not None:
+        assert datasets.has_columnar(str(dest))
+        assert datasets.load(str(dest), tipo='stock')['Cantidad'].sum() == sum(range(25))
+
+
+def test_importacion_en_segundo_plano(tmp_path, monkeypatch):
+    import time
+    from services import import_jobs
+
+    monkeypatch.setattr(import_jobs, 'JOBS_DIR', str(tmp_path / '_jobs'))
+    src = tmp_path / 'master.csv'
+    src.write_text('Codigo,Nombre\nA1,Uno\nA2,Dos\n', encoding='latin-1')
+    dest = tmp_path / 'productos_maestra.csv'
+
+    job_id = import_jobs.submit(str(src), 'master', str(dest), etiqueta='Maestro', source='master.csv')
+    for _ in range(100):
+        job = import_jobs.status(job_id)
+        if job['estado'] in import_jobs.TERMINADOS:
+            break
+        time.sleep(0.05)
+    assert job['estado'] == 'listo' and job['filas'] == 2 and job['segundos'] >= 0
+    assert os.path.exists(dest)
+
+    # Otro worker sólo ve el archivo de estado
+    import_jobs._JOBS.pop(job_id)
+    assert import_jobs.status(job_id)['estado'] == 'listo'
+    assert import_jobs.status('noexiste') is None
+    assert not list(tmp_path.glob('*.tmp')) and not list(tmp_path.glob('.*.tmp'))
+
+    # Los trabajos que salen de la retención se borran también del disco
+    import_jobs._JOBS[job_id] = job
+    monkeypatch.setattr(import_jobs, 'KEEP_JOBS', 0)
+    import_jobs._prune()
+    assert import_jobs.status(job_id) is None
+
+    # Las subidas de trabajos sin terminar (de cualquier worker) quedan reservadas
+    import_jobs._save({'id': 'otroworker', 'sha256': 'abc', 'estado': 'en_cola'})
+    import_jobs._save({'id': 'terminado', 'sha256': 'def', 'estado': 'listo'})
+    assert import_jobs.pending_sha256() == {'abc'}
+
+
+def test_file_lock_entre_procesos(tmp_path):
+    import subprocess
+    import sys
+    from services import locks
+
+    if locks.fcntl is None:
+        return
+    dest = tmp_path / 'stock.csv'
+    code = ("import fcntl, sys; f = open(sys.argv[1], 'a')\n"
+            "try:\n    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)\nexcept OSError:\n    sys.exit(1)")
+    with locks.file_lock(str(dest)):
+        assert subprocess.run([sys.executable, '-c', code, f'{dest}.lock']).returncode == 1
+    assert subprocess.run([sys.executable, '-c', code, f'{dest}.lock']).returncode == 0
+
+
+def test_subidas_por_contenido(tmp_path):
+    import io
+    from services import uploads
+
+    tipo_dir = tmp_path / 'stock'
+    tipo_dir.mkdir()
+    for ts in ('20250801_080000', '20250802_080000'):
+        (tipo_dir / f'stock_{ts}_Stock.xls').write_bytes(b'mismo contenido')
+    res = uploads.compact(str(tipo_dir))
+    assert res['archivos'] == 2 and res['repetidos'] == 1
+    assert os.listdir(tipo_dir / 'objetos') != [] and not list(tipo_dir.glob('stock_*'))
+
+    a = uploads.store(io.BytesIO(b'mismo contenido'), str(tipo_dir), 'Stock.xls')
+    assert not a.nuevo and a.path.endswith('.xls')
+    b = uploads.store(io.BytesIO(b'otro'), str(tipo_dir), 'Stock.xls', keep=1)
+    assert b.nuevo and os.listdir(tipo_dir / 'objetos') == [os.path.basename(b.path)]
+    assert list(uploads.read_index(str(tipo_dir))['objetos']) == [b.sha256]
+
+    # Lo que una importación todavía va a leer no sale por retención
+    c = uploads.store(io.BytesIO(b'tercero'), str(tipo_dir), 'Stock.xls', keep=1, en_uso={b.sha256})
+    assert sorted(os.listdir(tipo_dir / 'objetos')) == sorted(os.path.basename(p) for p in (b.path, c.path))
+
+
+def test_importar_con_delta(tmp_path):
+    from services import importer
+
+    def subir(nombre, filas):
+        src = tmp_path / nombre
+        src.write_text('Ciudad,Bodega,Codigo,Nombre,Cantidad\n' + ''.join(filas), encoding='latin-1')
+        return str(src)
+
+    base = [f'SCL,B1,A{i},P{i},{i}\n' for i in range(6)] + ['SCL,B1,A0,P0 bis,1\n']
+    dest = str(tmp_path / 'stock.csv')
+    assert importer.import_file(subir('v1.csv', base), 'stock', dest).delta is None
+
+    mtime = os.stat(dest).st_mtime_ns
+    res = importer.import_file(subir('v2.csv', base), 'stock', dest)
+    assert res.delta.cambios == 0 and os.stat(dest).st_mtime_ns == mtime
+
+    nuevo = base[:2] + ['SCL,B1,A2,P2,99\n'] + base[3:5] + base[6:] + ['SCL,B2,A9,P9,1\n']
+    res = importer.import_file(subir('v3.csv', nuevo), 'stock', dest)
+    assert res.delta.counts == {'insertados': 1, 'actualizados': 1, 'eliminados': 1, 'sin_cambios': 5}
+    assert res.delta.changed_values('Codigo') == {'A2', 'A5', 'A9'}
+    assert datasets.read_manifest(dest)['delta']['actualizados'] == 1
+
+
+def test_load_compact_tipado(tmp_path):
+    path = tmp_path / 'nv.csv'
+    _write(path, 'Ciudad,Fecha,Num. Nota,Código,Cantidad,Precio Unitario\n'
+                 'Santiago   ,2025-08-01 00:00:00,10,A1      ,2,100\n'
+                 'Santiago   ,,10,A2      ,1.0,50\n'
+                 'P. Montt   ,2025-08-02 00:00:00,11,A1      ,,70\n')
+    datasets.invalidate()
+
+    df = datasets.load_compact(str(path), 'nv')
+    assert str(df['Ciudad'].dtype) == 'category' and df['Ciudad'].iloc[0] == 'Santiago'
+    assert df['Cantidad'].dtype == 'Int64' and df['Cantidad'].isna().tolist() == [False, False, True]
+    assert df['Cantidad'].iloc[:2].tolist() == [2, 1]
+    assert str(df['Fecha'].dtype).startswith('datetime64') and df['Fecha'].isna().tolist() == [False, True, False]
+    assert df['Código'].tolist() == ['A1', 'A2', 'A1']
+
+    # Sólo queda en caché la versión compacta
+    assert all(k[1] == 'compacto' for k in datasets._CACHE._items)
+    rep = datasets.memory_report(str(path), 'nv')
+    assert rep['filas'] == 3 and rep['texto_bytes'] > rep['compacto_bytes']
+
+
+def test_numeros_con_miles_y_celdas_ilegibles():
+    s = datasets.pd.Series(['1.234', '1.234,5', '14.8', '1,000000', '', 'abc'], name='Cantidad')
+    out = datasets._to_int(s)
+    assert out.iloc[:4].tolist() == [1234, 1234, 15, 1]
+    assert out.isna().tolist() == [False] * 4 + [True, True]
+
+
+def test_listing_filtros_orden_y_paginas():
+    from services import listing
+
+    df = datasets.pd.DataFrame({
+        'Num. Nota': ['3', '1', '2', '4'],
+        'Ciudad': ['Concepción', 'SANTIAGO', 'Santiago ', 'Temuco'],
+        'Total': [30, 10, 20, 40],
+    })
+    idx = listing.ListingIndex(df, search_cols=['Num. Nota'], categorical=['Ciudad'])
+
+    page = idx.query({'Ciudad': 'santiago'})  # sin mayúsculas ni relleno
+    assert page.total == 2 and [r['Num. Nota'] for r in page.rows] == ['1', '2']
+    assert idx.query({'Ciudad': 'concepcion'}).total == 1  # sin tildes
+
+    orden = listing.parse_sort('-Total,Ciudad,NoExiste', allowed=df.columns)
+    assert orden == [('Total', False), ('Ciudad', True)]
+    page = idx.query(sort=orden, offset=1, limit=2, columns=['Num. Nota'])
+    assert page.total == 4 and page.rows == [{'Num. Nota': '3'}, {'Num. Nota': '2'}]
+    page = idx.query({'Ciudad': 'santiago'}, sort=[('Total', False)], limit=1)
+    assert page.total == 2 and page.rows[0]['Num. Nota'] == '2'
+
+
+def test_listing_cached_index_por_version():
+    from services import listing
+
+    builds = []
+
+    def build():
+        builds.append(1)
+        return listing.ListingIndex(datasets.pd.DataFrame({'a': [1]}))
+
+    first = listing.cached_index('prueba', 1, build)
+    assert listing.cached_index('prueba', 1, build) is first and len(builds) == 1
+    assert listing.cached_index('prueba', 2, build) is not first and len(builds) == 2
@@ -0,0 +1,199 @@
+import pandas as pd
+
+import db
+
+
+def _fake_query(frames, calls):
+    def fake(sql, params=None):
+        calls.append((sql, params))
+        return frames.pop(0)
+    return fake
+
+
+def test_guia_desde_nv_una_consulta(monkeypatch):
+    fila = {c: None for c in db.GUIA_HEADER}
+    fila.update(OC_NUM='OC1', FAV_RUT='1-9', VEND_NOMBRE='ANA PEREZ')
+    df = pd.DataFrame([
+        {**fila, 'Codigo': 'A', 'Descripcion': 'x', 'Cantidad': 2, 'Precio': 10, 'D%': 5, 'Item': 1},
+        {**fila, 'Codigo': 'B', 'Descripcion': 'y', 'Cantidad': 1, 'Precio': 20, 'D%': 5, 'Item': 2},
+    ])
+    calls = []
+    monkeypatch.setattr(db, 'query_df', _fake_query([df], calls))
+    db.invalidate_documento()
+
+    header, detalles = db.get_guia_desde_nv('123')
+    assert len(calls) == 1
+    assert header['OC_NUM'] == 'OC1' and header['DESCUENTO_UNICO_LINEAS'] == 5
+    assert [d['Codigo'] for d in detalles] == ['A', 'B']
+    assert 'OC_NUM' not in detalles[0]
+    assert db.loader_stats()['get_guia_desde_nv']['llamadas'] >= 1
+
+
+def test_oc_items_guia_sin_lineas(monkeypatch):
+    df = pd.DataFrame([{'NUMGUIAF': 'G7', 'ITEM': None, 'CODIGO2': None, 'NOMBRE': None,
+                        'CANTIDAD': None, 'RPECUNIT': None}])
+    calls = []
+    monkeypatch.setattr(db, 'query_df', _fake_query([df], calls))
+    db.invalidate_documento()
+
+    items, guia = db.get_oc_items('OC9')
+    assert len(calls) == 1
+    assert guia == 'G7' and items.empty
+
+
+def test_cache_documentos(monkeypatch):
+    db.invalidate_documento()
+    df = pd.DataFrame([{'num_nota': '55', 'codigo': 'A', 'nombre': 'x', 'cantidad': 3, 'prec_unit': 1.0}])
+    calls = []
+    monkeypatch.setattr(db, 'query_df', _fake_query([df, df.copy()], calls))
+
+    first = db.get_nota_detalle('55')
+    first.loc[0, 'cantidad'] = 99  # el llamador puede mutar su copia
+    again = db.get_nota_detalle(' 55 ')
+    assert len(calls) == 1 and again.loc[0, 'cantidad'] == 3
+
+    assert db.invalidate_documento('55') == 1
+    db.get_nota_detalle('55')
+    assert len(calls) == 2
+    assert db.DOC_CACHE.stats()['hits'] >= 1
+
+
+def test_cargar_notas_un_viaje(monkeypatch):
+    from services import nv_query
+
+    db.invalidate_documento()
+    head = {'fecha': '2025-08-01', 'rut': '1-9', 'razon_social': 'ACME', 'sucursal': 'SCL', 'num_oc': ''}
+    df = pd.DataFrame([
+        {'num_nota': 11, **head, 'codigo': 'A', 'nombre': 'x', 'cantidad': 2, 'prec_unit': 10},
+        {'num_nota': 11, **head, 'codigo': 'B', 'nombre': 'y', 'cantidad': 1, 'prec_unit': 20},
+        {'num_nota': 12, **head, 'codigo': 'A', 'nombre': 'x', 'cantidad': 5, 'prec_unit': 10},
+    ])
+    calls = []
+    monkeypatch.setattr(db, 'query_df', _fake_query([df], calls))
+
+    notas = nv_query.cargar_notas(['12', '11', '99'])
+    assert len(calls) == 1 and list(notas) == ['12', '11']
+    assert notas['11']['origen'] == 'sql' and notas['11']['header']['razon_social'] == 'ACME'
+    assert [l['codigo'] for l in notas['11']['lineas']] == ['A', 'B']
+
+    # La búsqueda individual queda servida desde la caché
+    assert list(db.get_nota_detalle('12')['cantidad']) == [5]
+    assert len(calls) == 1
+
+
+def test_cargar_notas_desde_csv(monkeypatch, tmp_path):
+    from services import nv_query
+
+    nv = tmp_path / 'nv.csv'
+    pd.DataFrame([
+        {'Num. Nota': '11', 'Fecha': '2025-08-01', 'RUT': '1-9', 'Razón Social': 'ACME', 'Ciudad': 'SCL',
+         'Num. Ord .Compra': 'OC1', 'Código': 'A', 'Descriptor': 'x', 'Cantidad': 3, 'Cant. Desp.': 1,
+         'Precio Unitario': 10},
+        {'Num. Nota': '11', 'Fecha': '2025-08-01', 'RUT': '1-9', 'Razón Social': 'ACME', 'Ciudad': 'SCL',
+         'Num. Ord .Compra': 'OC1', 'Código': 'B', 'Descriptor': 'y', 'Cantidad': 1, 'Cant. Desp.': 0,
+         'Precio Unitario': 20},
+    ]).to_csv(nv, index=False)
+    monkeypatch.setattr(nv_query, 'NV_FILE', str(nv))
+
+    def caida(sql, params=None):
+        raise RuntimeError('sin BBDD')
+    monkeypatch.setattr(db, 'query_df', caida)
+    notas = nv_query.cargar_notas(['11', '99'])
+    assert list(notas) == ['11'] and notas['11']['origen'] == 'csv'
+    # Mismas claves de cabecera que la consulta en lote a la BBDD
+    assert notas['11']['header'] == {'num_nota': '11', 'fecha': pd.Timestamp('2025-08-01'), 'rut': '1-9',
+                                     'razon_social': 'ACME', 'sucursal': None, 'num_oc': 'OC1'}
+    assert [(l['codigo'], l['cantidad']) for l in notas['11']['lineas']] == [('A', 2), ('B', 1)]
+
+
+def test_nv_headers_sql_e_indice(monkeypatch, tmp_path):
+    from services import nv_query
+
+    calls = []
+    monkeypatch.setattr(db, 'query_df', _fake_query([pd.DataFrame([{'NUMNOTA': 7, 'NRUTCLIE': '1-9'}])], calls))
+    rows, origen = nv_query.get_nv_headers_by_nums(['7', '7', ''], con_origen=True)
+    assert origen == 'sql' and len(calls) == 1 and rows[0]['NUMNOTA'] == '7'
+
+    nv = tmp_path / 'nv.csv'
+    pd.DataFrame([
+        {'Num. Nota': '7', 'RUT': '1-9', 'Fecha': '2025-08-01', 'Ciudad': 'SCL', 'Cantidad': 1, 'Precio Unitario': 10},
+        {'Num. Nota': '8', 'RUT': '2-7', 'Fecha': '2025-08-02', 'Ciudad': 'LS', 'Cantidad': 2, 'Precio Unitario': 10},
+    ]).to_csv(nv, index=False)
+    monkeypatch.setattr(nv_query, 'NV_FILE', str(nv))
+    monkeypatch.setattr(nv_query, 'NV_HEADERS_FILE', str(tmp_path / 'nv_headers.csv'))
+
+    def caida(sql, params=None):
+        raise RuntimeError('sin BBDD')
+    monkeypatch.setattr(db, 'query_df', caida)
+    rows, origen = nv_query.get_nv_headers_by_nums(['8', '99'], con_origen=True)
+    assert origen == 'indice'
+    # Misma forma que la BBDD, sin las claves que el informe no trae (SUCUR, ESTADO)
+    assert rows == [{'NUMNOTA': '8', 'NRUTCLIE': '2-7', 'FECHA': '2025-08-02', 'TOTAL': 20}]
+    assert nv_query.header_stats()['origenes']['indice'] >= 1
+
+
+def test_query_one_y_login(monkeypatch, tmp_path):
+    from sqlalchemy import create_engine, text
+
+    import auth_service
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE USER_DB (NOMBRE TEXT, PASSWORD TEXT, Eliminado INTEGER)'))
+        conn.execute(text("INSERT INTO USER_DB VALUES ('JEFE BODEGA ', 'x1', 0), ('BAJA', 'x2', 1)"))
+
+    assert db.query_scalar('SELECT COUNT(*) FROM USER_DB', engine=engine) == 2
+    assert db.query_one('SELECT * FROM USER_DB WHERE NOMBRE = :n', {'n': 'nadie'}, engine=engine) is None
+    assert len(db.query_rows('SELECT * FROM USER_DB', engine=engine)) == 2
+
+    monkeypatch.setattr(auth_service, 'ENGINE', engine)
+    assert auth_service.login_nivel1('JEFE BODEGA', 'x1')['is_admin'] is True
+    assert auth_service.login_nivel1('JEFE BODEGA', 'mala') is None
+    assert auth_service.login_nivel1('BAJA', 'x2') is None
+
+
+def test_auth_service_sin_db():
+    import os
+    import subprocess
+    import sys
+
+    # Con USERS_DB_URL en SQLite no se importa ``db`` (ni pyodbc)
+    code = ("import sys; sys.modules['pyodbc'] = None; import auth_service; "
+            "assert 'db' not in sys.modules; assert auth_service.ENGINE.dialect.name == 'sqlite'")
+    env = dict(os.environ, USERS_DB_URL='sqlite://')
+    subprocess.run([sys.executable, '-c', code], check=True, env=env, cwd=os.path.dirname(__file__))
+
+
+def test_build_nv_headers_y_reconstruccion(monkeypatch, tmp_path):
+    import os
+
+    from services import datasets, nv_query
+
+    lineas = pd.DataFrame([
+        {'Num. Nota': '7', 'RUT': '1-9', 'Ciudad': 'SCL', 'Tot. Neto': '300', 'Cantidad': '1', 'Precio Unitario': '100'},
+        {'Num. Nota': '7', 'RUT': '1-9', 'Ciudad': 'SCL', 'Tot. Neto': '300', 'Cantidad': '2', 'Precio Unitario': '100'},
+        {'Num. Nota': '8', 'RUT': '2-7', 'Ciudad': 'Temuco', 'Tot. Neto': '50', 'Cantidad': '5', 'Precio Unitario': '10'},
+    ])
+    headers = nv_query.build_nv_headers(lineas)
+    assert headers['Num. Nota'].tolist() == ['7', '8']  # una fila por nota
+    assert headers['Líneas'].tolist() == [2, 1]
+    assert headers['Total Neto'].tolist() == [300, 50]  # de Tot. Neto, no sumado
+    sin_total = nv_query.build_nv_headers(lineas.drop(columns='Tot. Neto'))
+    assert sin_total['Total Neto'].tolist() == [300, 50]  # Cantidad x Precio
+
+    nv = tmp_path / 'nv.csv'
+    monkeypatch.setattr(nv_query, 'NV_FILE', str(nv))
+    monkeypatch.setattr(nv_query, 'NV_HEADERS_FILE', str(tmp_path / 'nv_headers.csv'))
+    lineas.to_csv(nv, index=False)
+    page = nv_query.page_nv_headers(0, 10, {'Ciudad': 'temuco'})
+    assert page.total == 1 and page.rows[0]['Num. Nota'] == '8'
+    assert nv_query.headers_fresh()
+
+    # nv.csv más nuevo que el índice: se reconstruye en la siguiente lectura
+    lineas.iloc[:2].to_csv(nv, index=False)
+    st = os.stat(nv_query.NV_HEADERS_FILE)
+    os.utime(nv, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    datasets.invalidate()
+    assert not nv_query.headers_fresh()
+    assert nv_query.nv_headers()['Num. Nota'].tolist() == ['7']
+    assert nv_query.page_nv_headers(0, 10).total == 1
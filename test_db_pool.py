@@ -0,0 +1,57 @@
+import os
+import sys
+
+from sqlalchemy import create_engine, exc, text
+
+sys.path.append(os.path.dirname(__file__))
+from services.db_pool import InstrumentedQueuePool, pool_stats, retry_on_disconnect
+
+
+def _engine(tmp_path, **kw):
+    return create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+        pool_size=1, max_overflow=1, **kw,
+    )
+
+
+def test_pool_cuenta_checkouts_y_overflow(tmp_path):
+    engine = _engine(tmp_path)
+    c1, c2 = engine.connect(), engine.connect()
+    st = pool_stats(engine)
+    assert st['en_uso'] == 2 and st['overflow'] == 1 and st['checkouts'] == 2
+    c1.close()
+    c2.close()
+    assert pool_stats(engine)['en_uso'] == 0
+
+
+def test_pool_timeout_registrado(tmp_path):
+    engine = _engine(tmp_path, pool_timeout=0.05)
+    conns = [engine.connect(), engine.connect()]
+    try:
+        engine.connect()
+    except exc.TimeoutError:
+        pass
+    else:
+        raise AssertionError('se esperaba timeout')
+    assert pool_stats(engine)['timeouts'] == 1
+    for c in conns:
+        c.close()
+
+
+def test_retry_on_disconnect():
+    intentos = []
+
+    def lectura():
+        intentos.append(1)
+        if len(intentos) == 1:
+            raise exc.DBAPIError('SELECT 1', {}, Exception('caída'), connection_invalidated=True)
+        return 'ok'
+
+    assert retry_on_disconnect(lectura) == 'ok' and len(intentos) == 2
+
+
+def test_engine_sqlite_sin_pool():
+    engine = create_engine('sqlite://')
+    with engine.connect() as c:
+        assert c.execute(text('SELECT 1')).scalar() == 1
+    assert 'pool' in pool_stats(engine)
@@ -0,0 +1,62 @@
+import os
+import sys
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(__file__))
+from models import db
+from services import inventarios
+
+
+def test_conteos_de_varios_operarios_se_agregan():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        sesion = inventarios.crear_sesion('JEFE')
+        assert inventarios.get_sesion(sesion.id).estado == 'EN_PROCESO'
+        inventarios.cargar_esperado(sesion.id, [
+            {'Código': 'A', 'Nombre': 'a', 'Cantidad': 4},
+            {'Código': 'B', 'Nombre': 'b', 'Cantidad': 1},
+        ])
+
+        inventarios.registrar(sesion.id, 'A', 1, 'ANA')
+        inventarios.registrar(sesion.id, 'A', 2, 'LUIS')
+        led = inventarios.ledger(sesion.id)
+        assert led.scanned('A') == 3
+
+        # Sólo se aplican los conteos nuevos
+        inventarios.registrar(sesion.id, 'B', 1, 'ANA')
+        assert inventarios.ledger(sesion.id) is led
+        assert led.summary()['contados'] == 2 and led.faltan('A') == 1
+        assert inventarios.totales(sesion.id) == {'A': 3, 'B': 1}
+        assert [(o['Operario'], o['Escaneos'], o['Unidades']) for o in inventarios.por_operario(sesion.id)] == [
+            ('ANA', 2, 2), ('LUIS', 1, 2)]
+
+        # Los conteos de otras sesiones no se mezclan
+        otra = inventarios.crear_sesion('JEFE')
+        inventarios.registrar(otra.id, 'A', 1)
+        inventarios.registrar(sesion.id, 'A', 1)
+        assert inventarios.ledger(sesion.id).scanned('A') == 4
+
+        inventarios.cerrar_sesion(sesion.id)
+        assert inventarios.sesiones_abiertas() == [otra]
+        assert sesion.id not in inventarios._LOCKS
+
+
+def test_migrar_csv_una_sola_vez(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    path = tmp_path / 'inv_sesiones.csv'
+    path.write_text('id,estado,creado\nS1,CERRADA,2025-08-01T10:00:00\n', encoding='utf-8')
+    with app.app_context():
+        db.create_all()
+        assert inventarios.migrar_csv(str(path)) == 1
+        assert inventarios.get_sesion('S1').estado == 'CERRADA'
+
+        # Ya aplicada: no se vuelve a leer aunque el archivo cambie
+        path.write_text('id,estado,creado\nS2,EN_PROCESO,\n', encoding='utf-8')
+        assert inventarios.migrar_csv(str(path)) == 0
+        assert inventarios.get_sesion('S2') is None
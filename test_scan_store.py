@@ -0,0 +1,122 @@
+import os
+import sys
+
+from flask import Flask
+
+sys.path.append(os.path.dirname(__file__))
+from models import db
+from services import scan_store
+
+
+def _app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    return app
+
+
+def test_escaneos_se_acumulan_en_el_servidor():
+    app = _app()
+    with app.app_context():
+        db.create_all()
+        sid = scan_store.new_sid()
+        assert scan_store.documento(sid, 'ingreso') == ('', '', [])
+
+        items = [{'codigo': 'A1', 'cantidad': 3}, {'codigo': 'B2', 'cantidad': 1}]
+        scan_store.set_documento(sid, 'ingreso', '123', items, 'G1')
+        assert scan_store.documento(sid, 'ingreso') == ('123', 'G1', items)
+
+        assert scan_store.add_scan(sid, 'ingreso', 'A1', 2, 'G1') == (2, True)
+        assert scan_store.add_scan(sid, 'ingreso', 'A1', 1, 'G1') == (3, False)
+        scan_store.add_scan(sid, 'ingreso', 'B2', 1, 'G1')
+        assert [(s['codigo'], s['cantidad']) for s in scan_store.scans(sid, 'ingreso')] == [('A1', 3), ('B2', 1)]
+        assert scan_store.scans(sid, 'salida') == []
+
+        scan_store.remove_scan(sid, 'ingreso', 'B2')
+        assert len(scan_store.scans(sid, 'ingreso')) == 1
+
+        # Reemplazar el documento descarta los escaneos
+        scan_store.set_documento(sid, 'ingreso', '456', items[:1])
+        assert scan_store.documento(sid, 'ingreso')[0] == '456'
+        assert scan_store.scans(sid, 'ingreso') == []
+
+        scan_store.clear(sid, 'ingreso')
+        assert scan_store.documento(sid, 'ingreso') == ('', '', [])
+
+
+def test_ledger_sigue_los_escaneos():
+    app = _app()
+    with app.app_context():
+        db.create_all()
+        sid = scan_store.new_sid()
+        items = [{'Código': '*a1*', 'Cant.': '2.000'}, {'Código': 'B2', 'Cant.': 1}]
+        scan_store.set_documento(sid, 'salida', '77', items)
+
+        led = scan_store.ledger(sid, 'salida', 'Código', 'Cant.')
+        assert 'A1' in led and 'ZZ' not in led
+        assert led.line(' b2 ') == items[1]
+
+        scan_store.add_scan(sid, 'salida', 'A1', 1)
+        scan_store.add_scan(sid, 'salida', 'A1', 5)
+        assert scan_store.ledger(sid, 'salida', 'Código', 'Cant.') is led
+        assert led.scanned('a1') == 6 and led.faltan('B2') == 1
+        assert [(qty, esc) for _it, qty, esc in led.rows()] == [(2, 6), (1, 0)]
+
+        # Si otro proceso escribe, los totales se recalculan desde la base
+        led.totals.clear()
+        led.stamp = None
+        assert scan_store.ledger(sid, 'salida', 'Código', 'Cant.').scanned('A1') == 6
+
+        scan_store.remove_scan(sid, 'salida', 'A1')
+        assert led.count('A1') is None
+
+
+def test_conciliacion_incremental():
+    from services.scan_ledger import ScanLedger
+    items = [{'Código': 'A', 'Cantidad': 2}, {'Código': 'B', 'Cantidad': 1},
+             {'Código': 'C', 'Cantidad': 0}, {'Código': 'A', 'Cantidad': 1}]
+    led = ScanLedger(items, 'Código', 'Cantidad')
+    led.add('B', 1)
+    led.add('A', 1)
+    assert led.summary() == {'contado': 2, 'contados': 2, 'neta': -2, 'con_diferencia': 1,
+                             'codigos': 3, 'esperado': 4, 'sin_contar': 1}
+    rows, total = led.view('diferencias')
+    assert total == 1 and rows[0][1:] == (3, 1)
+    assert [r[0]['Código'] for r in led.view('sin_contar')[0]] == ['C']
+
+    led.add('A', 2)
+    led.remove('B')
+    assert led.view('diferencias')[1] == 0
+    assert led.summary()['contados'] == 1 and led.view('todos', 1, 1)[0][0][2] is None
+
+
+def test_lote_de_escaneos_en_una_transaccion():
+    app = _app()
+    with app.app_context():
+        db.create_all()
+        sid = scan_store.new_sid()
+        scan_store.set_documento(sid, 'ingreso', '1', [{'codigo': 'A1', 'cantidad': 5}])
+        led = scan_store.ledger(sid, 'ingreso', 'codigo', 'cantidad')
+        scan_store.add_scan(sid, 'ingreso', 'A1', 1, 'G1')
+
+        out = scan_store.add_scans(sid, 'ingreso', [('G1', 'A1', 2), ('G2', 'A1', 1), ('G1', 'A1', 1)])
+        assert out == {('G1', 'A1'): (4, False), ('G2', 'A1'): (1, True)}
+        assert led.scanned('A1') == 5 and led.faltan('A1') == 0
+
+
+def test_id_reutilizado_despues_de_purge():
+    app = _app()
+    with app.app_context():
+        db.create_all()
+        viejo = scan_store.new_sid()
+        scan_store.set_documento(viejo, 'salida', '1', [{'codigo': 'A1', 'cantidad': 5}])
+        scan_store.add_scan(viejo, 'salida', 'A1', 2)
+        assert scan_store.ledger(viejo, 'salida', 'codigo', 'cantidad').scanned('A1') == 2
+        assert scan_store.purge(max_age_hours=-1) == 1
+
+        # SQLite reutiliza el id: la sesión nueva no debe ver las cachés de la purgada
+        nuevo = scan_store.new_sid()
+        scan_store.set_guia(nuevo, 'salida', 'G9')
+        assert scan_store.documento(nuevo, 'salida') == ('', 'G9', [])
+        led = scan_store.ledger(nuevo, 'salida', 'codigo', 'cantidad')
+        assert led.scanned('A1') == 0
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from services.stock_cache import StockCache
+
+
+def _frame(cantidades):
+    return pd.DataFrame([
+        {'codigo': c, 'nombre': c.lower(), 'cantidad': q} for c, q in cantidades.items()
+    ])
+
+
+def test_invalidate_recarga_sincrona():
+    stock = {'A1': 10, 'B2': 5}
+    calls = []
+
+    def por_codigos(codigos):
+        calls.append(list(codigos))
+        return _frame({c: stock[c] for c in codigos if c in stock})
+
+    cache = StockCache(lambda: _frame(stock), ttl=60, loader_codigos=por_codigos)
+    assert cache.get('A1')['Cantidad'] == 10
+    assert cache.get('A1')['Cantidad'] == 10 and len(calls) == 1
+
+    stock['A1'] = 7  # p.ej. después de finalizar una salida
+    cache.invalidate()
+    assert cache.get('A1')['Cantidad'] == 7
+    assert len(calls) == 2
+
+
+def test_invalidate_snapshot_completo():
+    stock = {'A1': 10}
+    cache = StockCache(lambda: _frame(stock), ttl=60)
+    assert cache.get('A1')['Cantidad'] == 10
+    stock['A1'] = 3
+    cache.invalidate()
+    assert cache.get('A1')['Cantidad'] == 3
+
+
+def test_codigos_sueltos_acotados():
+    stock = {f'C{i}': i for i in range(10)}
+    calls = []
+
+    def por_codigos(codigos):
+        calls.append(list(codigos))
+        return _frame({c: stock[c] for c in codigos if c in stock})
+
+    cache = StockCache(lambda: _frame(stock), ttl=60, loader_codigos=por_codigos, max_codigos=3)
+    for i in range(10):
+        cache.get(f'C{i}')
+    assert cache.get('NOEXISTE') is None and cache.get('NOEXISTE') is None
+    assert len(calls) == 11  # la ausencia también queda en caché
+    assert cache._codigos.stats()['items'] == 3
+    assert cache.get('C0')['Cantidad'] == 0 and len(calls) == 12  # desalojado: se vuelve a consultar